@@ -1,7 +1,11 @@
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import platforms
-from kubectl import Kubectl
+from checks.probes import node_prober
+from kubectl import DEFAULT_NAMESPACE, Kubectl
+from utils.polling import (PollingPolicy, poll)
+from utils.tracing import propagate_context
 from utils.utils import Utils
 
 
@@ -17,9 +21,11 @@ class Check():
 
 _checks = []
 _checks_by_name = {}
+_probes = {}
 
 
-def check(description=None, scope=None, roles=[], stages=[], check_timeout=300, check_backoff=20):
+def check(description=None, scope=None, roles=[], stages=[], check_timeout=300, check_backoff=20, policy=None,
+          probe=None):
     """Decorator for waiting a check to become true.
        Can receve the following arguments when invoking the check function
        description: used for reporting. if not defined, check
@@ -28,7 +34,13 @@ def check(description=None, scope=None, roles=[], stages=[], check_timeout=300,
        roles: list of node roles this check applies
        stages: list of deployment stages this check applies to (e.g provisioned, joined)
        check_timeout: the timeout for the check
-       check_backoff: the backoff between retries
+       check_backoff: the maximum backoff between retries
+       policy: the PollingPolicy for the backoff between retries. Retries start
+               fast and back off exponentially up to check_backoff
+       probe: shell command executed in the node for node checks. The probes
+              of all the checks for a node are executed in one ssh session
+              (see checks.probes) and the check function receives the
+              ProbeResult of its probe instead of (conf, platform, role, node)
 
       The check_timout and check_backoff parameters can be overidden when
       calling the check_node function
@@ -42,25 +54,42 @@ def check(description=None, scope=None, roles=[], stages=[], check_timeout=300,
 
             timeout = kwargs.pop('check_timeout', check_timeout)
             backoff = kwargs.pop('check_backoff', check_backoff)
-            deadline = int(time.time()) + timeout
-            while True:
+            last_error = None
+
+            def evaluate():
+                if probe is None:
+                    return check(*args, **kwargs)
+                conf, platform, role, node = args
+                prober = node_prober(platforms.get_platform(conf, platform), _probes)
+                return check(prober.result(role, node, _name))
+
+            def attempt():
+                nonlocal last_error
                 last_error = None
                 try:
-                    if check(*args, **kwargs):
-                        return True
+                    return bool(evaluate()), None
                 except Exception as ex:
                     last_error = ex
+                    return False, None
 
-                if int(time.time()) >= deadline:
-                    msg = (f'condition "{_description}" not satisfied after {timeout} seconds'
-                           f'{". Last error:"+str(last_error) if last_error else ""}')
-                    raise AssertionError(msg)
+            _policy = policy if policy is not None else PollingPolicy()
+            done, _ = poll(attempt, timeout=timeout, policy=_policy.capped(backoff),
+                           fixed_backoff=backoff, name=_name)
+            if done:
+                return True
 
-                time.sleep(backoff)
+            msg = (f'condition "{_description}" not satisfied after {timeout} seconds'
+                   f'{". Last error:"+str(last_error) if last_error else ""}')
+            raise AssertionError(msg)
 
         if scope is None:
             raise ValueError("scope must be defined: 'cluster' or 'node'")
 
+        if probe is not None:
+            if scope != "node":
+                raise ValueError("probes can only be defined for node checks")
+            _probes[check.__name__] = (probe, roles)
+
         _check = Check(
             check.__name__,
             description,
@@ -97,7 +126,7 @@ class Checker:
         for name in names:
             _check = _checks_by_name.get(name, None)
             if _check is None:
-                raise ValueError("Check {name} not found")
+                raise ValueError(f"Check {name} not found")
             checks.append(_check)
 
         return checks
@@ -120,12 +149,102 @@ class Checker:
                 raise ValueError("stage must be specified")
             checks = self._filter_checks(_checks, stage=stage, scope="node")
 
+        platform = self._get_platform()
         start = int(time.time())
         for check in checks:
             remaining = timeout - (int(time.time()) - start)
-            check.func(self.conf, self.platform, role, node, check_timeout=remaining, check_backoff=backoff)
+            check.func(self.conf, platform, role, node, check_timeout=remaining, check_backoff=backoff)
+
+    def _get_platform(self):
+        """Returns the platform, creating it on first use so it can be shared by checks
+        running in multiple threads"""
+        self.platform = platforms.get_platform(self.conf, self.platform)
+        return self.platform
+
+    def _select_checks(self, checks, stage, scopes):
+        """Returns the checks with the given names, or the checks for the stage.
+        Raises a ValueError if a named check is not found or its scope is not one of scopes
+        """
+        if checks:
+            selected = self._filter_by_name(checks)
+            for check in selected:
+                if check.scope not in scopes:
+                    raise ValueError(f'check {check.name} is not a {" or ".join(scopes)} check')
+            return selected
+        if not stage:
+            raise ValueError("stage must be specified")
+        return [c for c in _checks if c.scope in scopes and stage in c.stages]
+
+    def check_nodes(self, nodes=None, checks=None, stage=None, timeout=180, backoff=20,
+                    concurrency=None, cluster=False):
+        """Run the checks for multiple nodes concurrently.
+        nodes is a list of (role, node) pairs. Defaults to all the nodes in the platform.
+        Every (node, check) pair for which the check applies to the node's role is
+        evaluated in its own thread. All pairs share the same deadline.
+        If cluster is True, the cluster checks are evaluated as well.
+        Raises an AssertionError reporting all the failed checks.
+        """
+        if timeout is None:
+            timeout = 180
+        if backoff is None:
+            backoff = 20
+
+        platform = self._get_platform()
+        if nodes is None:
+            nodes = [(role, n) for role in ("master", "worker")
+                     for n in range(platform.get_num_nodes(role))]
+
+        selected = self._select_checks(checks, stage, ("node", "cluster") if cluster else ("node",))
+        pairs = []
+        for check in selected:
+            if check.scope == "cluster":
+                pairs.append((None, check))
+                continue
+            targets = [(role, node) for role, node in nodes if not check.roles or role in check.roles]
+            if checks and not targets:
+                raise ValueError(f"check {check.name} does not apply to any of the nodes")
+            pairs += [(target, check) for target in targets]
+
+        if not pairs:
+            return
+
+        deadline = time.time() + timeout
+
+        def run(pair):
+            target, check = pair
+            remaining = max(int(deadline - time.time()), 0)
+            try:
+                if target is None:
+                    check.func(self.conf, platform, check_timeout=remaining, check_backoff=backoff)
+                else:
+                    role, node = target
+                    check.func(self.conf, platform, role, node, check_timeout=remaining, check_backoff=backoff)
+            except Exception as ex:
+                name = "cluster" if target is None else "{}-{}".format(*target)
+                return f"{name}: {check.name}: {ex}"
+            return None
+
+        if concurrency is None:
+            concurrency = len(pairs)
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(pairs))) as executor:
+            failures = [f for f in executor.map(propagate_context(run), pairs) if f is not None]
+
+        if failures:
+            raise AssertionError("{} check(s) failed:\n{}".format(len(failures), "\n".join(failures)))
+
+    def check_all(self, checks=None, stage=None, timeout=180, backoff=20, concurrency=None):
+        """Run the node checks for all the nodes and the cluster checks concurrently"""
+        self.check_nodes(checks=checks, stage=stage, timeout=timeout, backoff=backoff,
+                         concurrency=concurrency, cluster=True)
 
     def check_cluster(self, checks=None, stage=None, timeout=180, backoff=20):
+
+        # Prevent defaults to be accidentally overridden by callers with None
+        if timeout is None:
+            timeout = 180
+        if backoff is None:
+            backoff = 20
+
         if checks:
             checks = self._filter_by_name(checks)
             for check in checks:
@@ -142,33 +261,27 @@ class Checker:
             check.func(self.conf, self.platform, check_timeout=remaining, check_backoff=backoff)
 
 
-@check(description="apiserver healthz check", scope="node", roles=['master'])
-def check_apiserver_healthz(conf, platform, role, node):
-    platform = platforms.get_platform(conf, platform)
-    cmd = 'curl -Ls --insecure https://localhost:6443/healthz'
-    output = platform.ssh_run(role, node, cmd)
-    return output.find("ok") > -1
+@check(description="apiserver healthz check", scope="node", roles=['master'],
+       probe='curl -Ls --insecure https://localhost:6443/healthz')
+def check_apiserver_healthz(result):
+    return result.output.find("ok") > -1
 
 
-@check(description="etcd health check", scope="node", roles=['master'])
-def check_etcd_health(conf, platform, role, node):
-    platform = platforms.get_platform(conf, platform)
-    cmd = ('sudo curl -Ls --cacert /etc/kubernetes/pki/etcd/ca.crt '
-           '--key /etc/kubernetes/pki/etcd/server.key '
-           '--cert /etc/kubernetes/pki/etcd/server.crt '
-           'https://localhost:2379/health')
-    output = platform.ssh_run(role, node, cmd)
-    return output.find("true") > -1
+@check(description="etcd health check", scope="node", roles=['master'],
+       probe=('sudo curl -Ls --cacert /etc/kubernetes/pki/etcd/ca.crt '
+              '--key /etc/kubernetes/pki/etcd/server.key '
+              '--cert /etc/kubernetes/pki/etcd/server.crt '
+              'https://localhost:2379/health'))
+def check_etcd_health(result):
+    return result.output.find("true") > -1
 
 
 @check(description="check node is ready", scope="node", roles=["master", "worker"], stages=["joined"])
 def check_node_ready(conf, platform, role, node):
     platform = platforms.get_platform(conf, platform)
     node_name = platform.get_nodes_names(role)[node]
-    cmd = ("get nodes {} -o jsonpath='{{range @.status.conditions[*]}}"
-           "{{@.type}}={{@.status}};{{end}}'").format(node_name)
     kubectl = Kubectl(conf)
-    return kubectl.run_kubectl(cmd).find("Ready=True") != -1
+    return kubectl.snapshot().node(node_name).ready
 
 
 @check(description="check system pods ready", scope="cluster", stages=["joined"])
@@ -178,17 +291,10 @@ def check_system_pods_ready(conf, platform):
 
 
 def check_pods_ready(kubectl, namespace=None, pods=[], node=None, statuses=['Running', 'Succeeded']):
-    ns = f'{"--namespace="+namespace if namespace else ""}'
-    node_selector = f'{"--field-selector spec.nodeName="+node if node else ""}'
-    cmd = (f'get pods {" ".join(pods)} {ns} {node_selector} '
-           f'-o jsonpath="{{ range .items[*]}}{{@.metadata.name}}:'
-           f'{{@.status.phase}};"')
-
-    result = kubectl.run_kubectl(cmd)
-    # get pods can return a list of items or a single pod
-    pod_list = result.split(";")
-    for name,status in [ pod.split(":") for pod in pod_list if pod is not ""]:
-        if status not in statuses:
+    found = kubectl.snapshot().pods(namespace=namespace or DEFAULT_NAMESPACE, node=node)
+    if pods:
+        found = [pod for pod in found if pod.name in pods]
+        if len(found) < len(set(pods)):
             return False
 
-    return True
+    return all(pod.phase in statuses for pod in found)
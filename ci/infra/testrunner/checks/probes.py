@@ -0,0 +1,116 @@
+"""Probes executed in the nodes for evaluating node checks.
+
+A probe is a shell command declared by a check (see the probe argument of the
+check decorator). Instead of opening a ssh session for each check, all the
+probes applicable to a node are sent as a single script, executed in one ssh
+session. The script runs the probes concurrently and prints the result of each
+one as a line of JSON, which is demultiplexed to the checks.
+"""
+
+import base64
+import json
+import shlex
+import threading
+import weakref
+
+_SCRIPT_HEADER = """
+probe() {
+    out=$(bash -c "$2" 2>&1)
+    rc=$?
+    printf '{"name": "%s", "exit_code": %d, "output": "%s"}\\n' "$1" "$rc" "$(printf '%s' "$out" | base64 -w0)"
+}
+"""
+
+
+class ProbeResult:
+    def __init__(self, name, exit_code, output):
+        self.name = name
+        self.exit_code = exit_code
+        self.output = output
+
+    @property
+    def ok(self):
+        return self.exit_code == 0
+
+
+def probe_script(probes):
+    """Returns the script for running the probes, given as a dictionary of name and command"""
+    lines = [_SCRIPT_HEADER]
+    for name, command in probes.items():
+        lines.append(f"probe {shlex.quote(name)} {shlex.quote(command)} &")
+    lines.append("wait")
+    return "\n".join(lines) + "\n"
+
+
+def parse_results(output):
+    """Returns the results printed by a probe script, as a dictionary by probe name"""
+    results = {}
+    for line in output.splitlines():
+        line = line.strip()
+        if not line.startswith("{"):
+            continue
+        r = json.loads(line)
+        results[r["name"]] = ProbeResult(r["name"], r["exit_code"],
+                                         base64.b64decode(r["output"]).decode(errors="replace"))
+    return results
+
+
+class _NodeProbes:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.results = {}
+        self.seen = {}
+
+
+class NodeProber:
+    """Runs the probes for a node in a single ssh session, sharing the results
+    among the checks for the node.
+
+    A check never receives the same result twice: if it already consumed the
+    results of the last run, the probes are executed again. Checks retrying at
+    the same time therefore share one ssh session per node and poll round.
+    """
+
+    def __init__(self, platform, probes):
+        self.platform = platform
+        self.probes = probes
+        self.runs = 0
+        self._nodes = {}
+        self._lock = threading.Lock()
+
+    def _probes_for(self, role):
+        return {name: command for name, (command, roles) in self.probes.items()
+                if not roles or role in roles}
+
+    def result(self, role, node, name):
+        """Returns the ProbeResult of the named probe in the node"""
+        with self._lock:
+            entry = self._nodes.setdefault((role, node), _NodeProbes())
+
+        with entry.lock:
+            if name not in entry.results or entry.seen.get(name) == entry.generation:
+                output = self.platform.ssh_run(role, node, "bash -s",
+                                               stdin=probe_script(self._probes_for(role)).encode())
+                entry.results = parse_results(output)
+                entry.generation += 1
+                self.runs += 1
+            entry.seen[name] = entry.generation
+
+            if name not in entry.results:
+                raise RuntimeError(f"probe {name} returned no result in {role}-{node}")
+            return entry.results[name]
+
+
+_probers = weakref.WeakKeyDictionary()
+_probers_lock = threading.Lock()
+
+
+def node_prober(platform, probes):
+    """Returns the prober shared by all the checks running on the platform"""
+    with _probers_lock:
+        prober = _probers.get(platform)
+        if prober is None:
+            prober = NodeProber(platform, probes)
+            _probers[platform] = prober
+        return prober
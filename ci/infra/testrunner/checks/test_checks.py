@@ -0,0 +1,121 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from checks.checks import Check, Checker, check_pods_ready
+from kubectl.snapshot import ClusterSnapshot
+
+
+class FakeKubectl:
+    """Kubectl answering the snapshot with a pending pod in kube-system and a
+    running pod in the default namespace"""
+
+    def get_raw(self, path):
+        if path == "/api/v1/nodes":
+            return {"items": []}
+        return {"items": [{"metadata": {"name": "write-pod", "namespace": ns},
+                           "spec": {"nodeName": "worker-0"}, "status": {"phase": phase}}
+                          for ns, phase in (("kube-system", "Pending"), ("default", "Running"))
+                          if path in ("/api/v1/pods", f"/api/v1/namespaces/{ns}/pods")]}
+
+    def snapshot(self):
+        return ClusterSnapshot(self.get_raw)
+
+
+def test_check_cluster_default_timeout(monkeypatch):
+    """Test the cluster checks get the default timeout and backoff when called with None,
+    as rolling_upgrade does
+    """
+    calls = []
+    cluster_check = Check("pods_ready", "pods ready", lambda conf, platform, **kwargs: calls.append(kwargs),
+                          scope="cluster", stages=["joined"])
+    monkeypatch.setattr("checks.checks._checks", [cluster_check])
+
+    checker = Checker.__new__(Checker)
+    checker.conf, checker.platform = None, "openstack"
+    checker.check_cluster(stage="joined", timeout=None, backoff=None)
+
+    assert len(calls) == 1
+    assert 170 <= calls[0]["check_timeout"] <= 180
+    assert calls[0]["check_backoff"] == 20
+
+
+def test_check_pods_ready_default_namespace():
+    """Test pods are checked in the default namespace when none is given, as kubectl does
+    """
+    kubectl = FakeKubectl()
+    assert check_pods_ready(kubectl)
+    assert check_pods_ready(kubectl, pods=["write-pod"])
+    assert not check_pods_ready(kubectl, namespace="kube-system")
+
+
+@pytest.fixture
+def checker(monkeypatch):
+    """Checker for a cluster of 2 masters and 2 workers with a node check for all
+    the nodes, a node check for the masters and a cluster check, recording the
+    targets of each check. The cluster check fails"""
+    calls = []
+    lock = threading.Lock()
+
+    def node_check(name):
+        def func(conf, platform, role, node, **kwargs):
+            with lock:
+                calls.append((name, role, node))
+        return Check(name, name, func, scope="node", roles=["master"] if name == "master_ready" else [],
+                     stages=["joined"])
+
+    def cluster_func(conf, platform, **kwargs):
+        with lock:
+            calls.append(("pods_ready",))
+        raise AssertionError("pods not ready")
+
+    checks = [node_check("node_ready"), node_check("master_ready"),
+              Check("pods_ready", "pods ready", cluster_func, scope="cluster", stages=["joined"])]
+    monkeypatch.setattr("checks.checks._checks", checks)
+    monkeypatch.setattr("checks.checks._checks_by_name", {c.name: c for c in checks})
+
+    checker = Checker.__new__(Checker)
+    checker.conf = None
+    checker.platform = SimpleNamespace(get_num_nodes=lambda role: 2)
+    checker._get_platform = lambda: checker.platform
+    checker.calls = calls
+    return checker
+
+
+def test_check_nodes(checker):
+    """Test each node check runs for every node of its roles, and the cluster
+    checks only run when requested
+    """
+    checker.check_nodes(stage="joined")
+    assert sorted(checker.calls) == sorted(
+        [("node_ready", role, n) for role in ("master", "worker") for n in range(2)]
+        + [("master_ready", "master", n) for n in range(2)])
+
+    checker.calls.clear()
+    checker.check_nodes(nodes=[("worker", 1)], checks=["node_ready"])
+    assert checker.calls == [("node_ready", "worker", 1)]
+
+
+def test_check_all(checker):
+    """Test the node and cluster checks run together, and the failures are reported
+    after all of them ran
+    """
+    with pytest.raises(AssertionError, match="cluster: pods_ready: pods not ready"):
+        checker.check_all(stage="joined", concurrency=2)
+    assert len(checker.calls) == 7
+    assert ("pods_ready",) in checker.calls
+
+
+@pytest.mark.parametrize("call", [
+    lambda checker: checker.check_all(checks=["node_ready", "missing"]),
+    lambda checker: checker.check_nodes(checks=["pods_ready"]),
+    lambda checker: checker.check_nodes(nodes=[("worker", 0)], checks=["master_ready"]),
+])
+def test_check_unknown_or_mismatched_names(checker, call):
+    """Test named checks are rejected instead of running nothing when they are
+    not found, have another scope or do not apply to the nodes
+    """
+    with pytest.raises(ValueError):
+        call(checker)
+    assert checker.calls == []
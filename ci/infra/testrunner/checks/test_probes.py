@@ -0,0 +1,50 @@
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from checks.probes import (NodeProber, parse_results, probe_script)
+
+
+class LocalPlatform:
+    """Runs the commands sent to the nodes in the local host"""
+
+    def __init__(self):
+        self.sessions = 0
+
+    def ssh_run(self, role, nr, cmd, stdin=None):
+        self.sessions += 1
+        return subprocess.run(cmd, shell=True, input=stdin, stdout=subprocess.PIPE, check=True).stdout.decode()
+
+
+def test_probe_script():
+    """Test probe results are demultiplexed, including multiline output and failures
+    """
+    script = probe_script({"ok": "echo 'line 1'; echo \"line 2\"", "fails": "echo error >&2; exit 3"})
+    output = subprocess.run(["bash", "-s"], input=script.encode(), stdout=subprocess.PIPE).stdout.decode()
+    results = parse_results(output)
+
+    assert results["ok"].ok
+    assert results["ok"].output == "line 1\nline 2"
+    assert results["fails"].exit_code == 3
+    assert results["fails"].output == "error"
+
+
+def test_probes_batched_per_node():
+    """Test concurrent checks for a node share a single ssh session per round
+    """
+    platform = LocalPlatform()
+    probes = {"check_a": ("echo a", ["master"]),
+              "check_b": ("echo b", []),
+              "check_worker": ("echo w", ["worker"])}
+    prober = NodeProber(platform, probes)
+
+    def run(name):
+        return prober.result("master", 0, name).output
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert list(executor.map(run, ["check_a", "check_b"])) == ["a", "b"]
+    assert platform.sessions == 1
+
+    # the next round executes the probes again
+    run("check_a")
+    run("check_b")
+    assert platform.sessions == 2
@@ -0,0 +1 @@
+from impact.impact import ImpactTest, TestImpact, read_changed_files, REPO_DIR
@@ -0,0 +1,124 @@
+"""Selection of the tests impacted by a change.
+
+The paths which impact a test are declared with the impact marker, on the test
+or on its module (pytestmark), as paths relative to the repository root. A path
+matches the files under it, and may contain wildcards:
+
+    pytestmark = pytest.mark.impact("internal/pkg/skuba/upgrade", "pkg/skuba/actions/*/upgrade")
+
+Changing the module of a test impacts its tests as well. Tests marked as smoke
+are always selected. If any of the changed files does not impact any test, its
+impact is unknown and all the tests are selected.
+
+The mapping is extended with the failures of previous runs: when a test fails,
+the directories of the changed files are recorded as impacting its module.
+Learned paths add tests to the selection, but don't make a file known.
+"""
+
+import fcntl
+import json
+import logging
+import os
+from collections import defaultdict
+from fnmatch import fnmatch
+
+logger = logging.getLogger('testrunner')
+
+REPO_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), "..", "..", "..", ".."))
+
+
+def read_changed_files(path):
+    """Returns the paths listed in a file, one per line, as printed by git diff --name-only"""
+    with open(path) as f:
+        return [os.path.normpath(line.strip()) for line in f if line.strip()]
+
+
+def matches(path, pattern):
+    """Returns True if the path is the pattern, is under it or matches its wildcards"""
+    pattern = pattern.rstrip("/")
+    return (path == pattern or path.startswith(pattern + "/") or
+            fnmatch(path, pattern) or fnmatch(path, pattern + "/*"))
+
+
+class ImpactTest:
+    """Test to be selected.
+       nodeid: pytest node id
+       module: path of the module of the test, relative to the repository root
+       paths: paths which impact the test
+       smoke: the test is always selected
+    """
+
+    __test__ = False
+
+    def __init__(self, nodeid, module, paths=(), smoke=False):
+        self.nodeid = nodeid
+        self.module = module
+        self.paths = list(paths)
+        self.smoke = smoke
+
+    def impacted_by(self, path):
+        return path == self.module or any(matches(path, pattern) for pattern in self.paths)
+
+
+class TestImpact:
+    """Selects the tests impacted by a set of changed files.
+       state_path: file with the mapping learned from the failures
+       ignore: patterns of the files which don't impact any test (e.g. documentation)
+    """
+
+    __test__ = False
+
+    def __init__(self, state_path, ignore=()):
+        self.state_path = state_path
+        self.ignore = list(ignore or ())
+
+    def learned(self):
+        """Returns the modules impacted by each directory, with the number of failures"""
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def relevant(self, changed):
+        return [path for path in changed if not any(fnmatch(path, pattern) for pattern in self.ignore)]
+
+    def select(self, tests, changed):
+        """Returns the tests impacted by the changed files and the smoke tests"""
+        changed = self.relevant(changed)
+        learned = self.learned()
+        selected = set()
+        unknown = []
+        for path in changed:
+            impacted = [test for test in tests if test.impacted_by(path)]
+            if not impacted:
+                unknown.append(path)
+            selected.update(test.nodeid for test in impacted)
+            modules = learned.get(os.path.dirname(path), {})
+            selected.update(test.nodeid for test in tests if test.module in modules)
+
+        if unknown:
+            logger.info(f"Impact of {', '.join(unknown[:5])}{'...' if len(unknown) > 5 else ''} "
+                        f"is unknown: selecting all the tests")
+            return list(tests)
+
+        selection = [test for test in tests if test.nodeid in selected or test.smoke]
+        logger.info(f"Selected {len(selection)} of {len(tests)} tests impacted by {len(changed)} changed files")
+        return selection
+
+    def learn(self, changed, failed_modules):
+        """Records the directories of the changed files as impacting the modules of the failed tests"""
+        dirs = {os.path.dirname(path) for path in self.relevant(changed)}
+        if not dirs or not failed_modules:
+            return
+
+        with open(f"{self.state_path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            state = defaultdict(dict, self.learned())
+            for directory in dirs:
+                for module in failed_modules:
+                    state[directory][module] = state[directory].get(module, 0) + 1
+            tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(state, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.state_path)
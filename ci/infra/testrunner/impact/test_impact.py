@@ -0,0 +1,49 @@
+import pytest
+
+from impact.impact import ImpactTest, TestImpact
+
+MODULE = "ci/infra/testrunner/tests/{}.py"
+
+
+@pytest.fixture
+def tests():
+    return [ImpactTest("test_nginx.py::test_nginx", MODULE.format("test_nginx"),
+                       paths=["ci/infra/openstack"], smoke=True),
+            ImpactTest("test_upgrade.py::test_plan", MODULE.format("test_upgrade"),
+                       paths=["internal/pkg/skuba/upgrade", "pkg/skuba/actions/*/upgrade"]),
+            ImpactTest("test_upgrade.py::test_apply", MODULE.format("test_upgrade"),
+                       paths=["internal/pkg/skuba/upgrade"]),
+            ImpactTest("test_reboot.py::test_reboot", MODULE.format("test_reboot"), paths=["skuba-update"])]
+
+
+def _ids(selection):
+    return [test.nodeid for test in selection]
+
+
+def test_select(tmp_path, tests):
+    """Test only the impacted tests and the smoke tests are selected, unless the
+    impact of a change is unknown
+    """
+    impact = TestImpact(str(tmp_path / "impact.json"), ignore=["*.md"])
+    assert _ids(impact.select(tests, ["pkg/skuba/actions/node/upgrade/upgrade.go", "README.md"])) == [
+        "test_nginx.py::test_nginx", "test_upgrade.py::test_plan"]
+    assert _ids(impact.select(tests, [MODULE.format("test_reboot")])) == [
+        "test_nginx.py::test_nginx", "test_reboot.py::test_reboot"]
+    assert _ids(impact.select(tests, ["docs/README.md"])) == ["test_nginx.py::test_nginx"]
+    assert len(impact.select(tests, ["skuba-update/setup.py", "internal/pkg/skuba/oidc/oidc.go"])) == 4
+
+
+def test_learn(tmp_path, tests):
+    """Test a failure makes the directories of the changed files impact the module of
+    the failed test, without making them known
+    """
+    impact = TestImpact(str(tmp_path / "impact.json"))
+    changed = ["internal/pkg/skuba/upgrade/plan.go", "internal/pkg/skuba/kubernetes/versions.go"]
+    assert _ids(impact.select(tests, changed)) == _ids(tests)
+
+    impact.learn(changed, {MODULE.format("test_reboot")})
+    impact.learn(["internal/pkg/skuba/upgrade/addon.go"], {MODULE.format("test_reboot")})
+    assert impact.learned()["internal/pkg/skuba/upgrade"] == {MODULE.format("test_reboot"): 2}
+
+    assert _ids(impact.select(tests, ["internal/pkg/skuba/upgrade/node.go"])) == _ids(tests)
+    assert len(impact.select(tests, ["internal/pkg/skuba/kubernetes/nodes.go"])) == 4
@@ -1 +1 @@
-from kubectl.kubectl import Kubectl
+from kubectl.kubectl import DEFAULT_NAMESPACE, Kubectl
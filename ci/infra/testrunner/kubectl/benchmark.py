@@ -0,0 +1,37 @@
+import statistics
+import time
+
+from kubectl.kubectl import Kubectl
+
+BACKENDS = ("kubectl", "api")
+
+
+def benchmark(conf, iterations=20):
+    """Times listing the nodes of the cluster with each of the Kubectl backends.
+    Returns a dictionary with the duration of each request, by backend
+    """
+    results = {}
+    for backend in BACKENDS:
+        kubectl = Kubectl(conf)
+        kubectl.backend = backend
+        timings = []
+        for _ in range(iterations):
+            start = time.monotonic()
+            kubectl.get_nodes()
+            timings.append(time.monotonic() - start)
+        results[backend] = timings
+    return results
+
+
+def report(results):
+    """Returns a summary of the benchmark results"""
+    lines = ["{:10} {:>8} {:>10} {:>10} {:>10}".format("backend", "requests", "mean", "p50", "p95")]
+    for backend, timings in results.items():
+        ordered = sorted(timings)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        lines.append("{:10} {:>8} {:>9.1f}ms {:>9.1f}ms {:>9.1f}ms".format(
+            backend, len(timings),
+            statistics.mean(timings) * 1000,
+            statistics.median(timings) * 1000,
+            p95 * 1000))
+    return "\n".join(lines)
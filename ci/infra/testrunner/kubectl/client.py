@@ -0,0 +1,113 @@
+import atexit
+import base64
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+import requests
+import urllib3
+import yaml
+from requests.adapters import HTTPAdapter
+
+from utils import deadline
+
+logger = logging.getLogger('testrunner')
+
+
+class KubeClient:
+    """Kubernetes API client using the credentials from a kubeconfig file.
+    Requests are sent over a pooled HTTPS session, which keeps the connections
+    to the apiserver alive between calls.
+    """
+
+    _clients = {}
+    _clients_lock = threading.Lock()
+
+    def __init__(self, kubeconfig, timeout=30, pool_size=10):
+        self.kubeconfig = kubeconfig
+        self.timeout = timeout
+        self._certs_dir = tempfile.mkdtemp(prefix="testrunner-kube-")
+        atexit.register(shutil.rmtree, self._certs_dir, True)
+
+        with open(kubeconfig) as f:
+            config = yaml.safe_load(f)
+
+        context_name = config.get("current-context") or config["contexts"][0]["name"]
+        context = KubeClient._find(config["contexts"], context_name)
+        cluster = KubeClient._find(config["clusters"], context["cluster"])
+        user = KubeClient._find(config["users"], context["user"])
+
+        self.server = cluster["server"].rstrip("/")
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        if cluster.get("insecure-skip-tls-verify"):
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+            self.session.verify = False
+        else:
+            self.session.verify = self._credential(cluster, "certificate-authority", "ca.crt") or True
+
+        cert = self._credential(user, "client-certificate", "client.crt")
+        key = self._credential(user, "client-key", "client.key")
+        if cert and key:
+            self.session.cert = (cert, key)
+        if user.get("token"):
+            self.session.headers["Authorization"] = f"Bearer {user['token']}"
+
+    @staticmethod
+    def for_kubeconfig(kubeconfig, timeout=30):
+        """Returns a client for the kubeconfig shared by all callers. A new client is
+        created if the kubeconfig changed (e.g. the cluster was bootstrapped again)"""
+        key = (kubeconfig, os.stat(kubeconfig).st_mtime)
+        with KubeClient._clients_lock:
+            client = KubeClient._clients.get(key)
+            if client is None:
+                client = KubeClient(kubeconfig, timeout=timeout)
+                KubeClient._clients[key] = client
+            return client
+
+    @staticmethod
+    def _find(entries, name):
+        for entry in entries:
+            if entry["name"] == name:
+                return entry[[k for k in entry if k != "name"][0]]
+        raise ValueError(f"{name} not found in kubeconfig")
+
+    def _credential(self, section, field, file_name):
+        """Returns the path to a credential, writing it to a private file if it is embedded"""
+        if section.get(f"{field}-data"):
+            path = os.path.join(self._certs_dir, file_name)
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(base64.b64decode(section[f"{field}-data"]))
+            return path
+        return section.get(field)
+
+    def get(self, path):
+        """Returns the json response for the API path"""
+        response = self.session.get(self.server + path, timeout=self.timeout)
+        if response.status_code != 200:
+            raise RuntimeError(f"Error getting {path}: {response.status_code} {response.text}")
+        return response.json()
+
+    def stream(self, path):
+        """Yields the json objects streamed by the API path (e.g. watch events)"""
+        d = deadline.current()
+        read_timeout = None
+        if d is not None and d.remaining() is not None:
+            read_timeout = max(d.remaining(), 0) + 5
+
+        with self.session.get(self.server + path, stream=True,
+                              timeout=(self.timeout, read_timeout)) as response:
+            if response.status_code != 200:
+                raise RuntimeError(f"Error watching {path}: {response.status_code} {response.text}")
+            for line in response.iter_lines():
+                if d is not None:
+                    d.check()
+                if line:
+                    yield json.loads(line)
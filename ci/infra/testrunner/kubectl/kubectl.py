@@ -1,5 +1,54 @@
-from utils.utils import (Utils)
+import json
+import logging
 from time import sleep
+from urllib.parse import urlencode
+
+import requests
+
+from kubectl.client import KubeClient
+from kubectl.resources import (ConfigMap, Deployment, Node, Pod)
+from kubectl.snapshot import (invalidate_snapshot, shared_snapshot)
+from utils import deadline
+from utils.utils import (Utils)
+
+logger = logging.getLogger('testrunner')
+
+# namespace of the kubeconfig context, used by kubectl when none is given
+DEFAULT_NAMESPACE = "default"
+
+# kubectl commands changing the cluster, after which the snapshot is fetched again
+MUTATING_COMMANDS = ("annotate", "apply", "cordon", "create", "delete", "drain", "label",
+                     "patch", "replace", "rollout", "scale", "set", "taint", "uncordon")
+
+API_PATHS = {
+    "nodes": "/api/v1/nodes",
+    "pods": "/api/v1/{namespace}pods",
+    "deployments": "/apis/apps/v1/{namespace}deployments",
+}
+
+
+def pods_ready(statuses=("Running", "Succeeded")):
+    """Returns a predicate for wait_for which checks there are pods and all are in any of the statuses"""
+    def pods_ready(pods):
+        return len(pods) > 0 and all(pod["status"].get("phase") in statuses for pod in pods)
+    return pods_ready
+
+
+def _condition_true(obj, condition):
+    for c in obj.get("status", {}).get("conditions", []):
+        if c["type"] == condition:
+            return c["status"] == "True"
+    return False
+
+
+def nodes_ready(nodes):
+    """Predicate for wait_for which checks there are nodes and all are Ready"""
+    return len(nodes) > 0 and all(_condition_true(node, "Ready") for node in nodes)
+
+
+def deployments_available(deployments):
+    """Predicate for wait_for which checks there are deployments and all are Available"""
+    return len(deployments) > 0 and all(_condition_true(d, "Available") for d in deployments)
 
 
 class Kubectl:
@@ -8,8 +57,14 @@ class Kubectl:
         self.conf = conf
         self.binpath = conf.kubectl.binpath
         self.kubeconfig = conf.kubectl.kubeconfig
+        self.backend = conf.kubectl.backend
+        self.api_timeout = conf.kubectl.api_timeout
+        self.snapshot_max_age = conf.kubectl.snapshot_max_age
         self.utils = Utils(self.conf)
 
+        if self.backend not in ("api", "kubectl"):
+            raise ValueError(f"Invalid kubectl backend {self.backend}")
+
     def get_kubeconfig(self):
         return self.kubeconfig
 
@@ -19,6 +74,166 @@ class Kubectl:
             return self.utils.runshellcommand(shell_cmd, stdin=stdin)
         except Exception as ex:
             raise Exception("Error executing cmd {}".format(shell_cmd)) from ex
+        finally:
+            # the command may have changed the cluster even if it failed
+            if command.split(" ", 1)[0] in MUTATING_COMMANDS:
+                invalidate_snapshot(self.kubeconfig)
+
+    def _client(self):
+        """Returns the API client for the kubeconfig, or None if the kubectl backend is used.
+        The kubeconfig only exists once the cluster is bootstrapped, so the client
+        is obtained on each request."""
+        if self.backend != "api":
+            return None
+        return KubeClient.for_kubeconfig(self.kubeconfig, timeout=self.api_timeout)
+
+    def get_raw(self, path):
+        """Returns the json response for the API path"""
+        client = self._client()
+        if client is not None:
+            return client.get(path)
+        return json.loads(self.run_kubectl(f"get --raw '{path}'"))
+
+    def watch_raw(self, path):
+        """Yields the events of a watch on the API path"""
+        client = self._client()
+        if client is not None:
+            yield from client.stream(path)
+            return
+
+        shell_cmd = f"{self.binpath} --kubeconfig={self.kubeconfig} get --raw '{path}'"
+        for line in self.utils.stream_shellcommand(shell_cmd):
+            if line.strip():
+                yield json.loads(line)
+
+    def _list(self, kind, namespace=None, label_selector=None, field_selector=None):
+        path = API_PATHS[kind].format(namespace=f"namespaces/{namespace}/" if namespace else "")
+        params = {}
+        if label_selector:
+            params["labelSelector"] = label_selector
+        if field_selector:
+            params["fieldSelector"] = field_selector
+        if params:
+            path = f"{path}?{urlencode(params)}"
+        return self.get_raw(path)["items"]
+
+    def get_nodes(self, label_selector=None):
+        """Returns the nodes, optionally filtered by a label selector"""
+        return [Node(o) for o in self._list("nodes", label_selector=label_selector)]
+
+    def get_node(self, name):
+        return Node(self.get_raw(f"{API_PATHS['nodes']}/{name}"))
+
+    def get_pods(self, namespace=None, node=None, label_selector=None):
+        """Returns the pods, optionally in a namespace, a node or matching a label selector"""
+        field_selector = f"spec.nodeName={node}" if node else None
+        return [Pod(o) for o in self._list("pods", namespace=namespace, label_selector=label_selector,
+                                           field_selector=field_selector)]
+
+    def get_deployment(self, name, namespace="default"):
+        path = API_PATHS["deployments"].format(namespace=f"namespaces/{namespace}/")
+        return Deployment(self.get_raw(f"{path}/{name}"))
+
+    def get_configmap(self, name, namespace="default"):
+        return ConfigMap(self.get_raw(f"/api/v1/namespaces/{namespace}/configmaps/{name}"))
+
+    def snapshot(self):
+        """Returns the snapshot of the nodes and pods of the cluster, shared with
+        other Kubectl instances. Use it for conditions evaluated repeatedly."""
+        client = self._client()
+        get_raw = client.get if client is not None else self.get_raw
+        return shared_snapshot(self.kubeconfig, get_raw, max_age=self.snapshot_max_age)
+
+    def wait_for(self, kind, predicate, namespace=None, field_selector=None, timeout=300):
+        """Waits until predicate is true for the objects of a kind
+        The predicate receives the list of objects (as returned by the API) and is
+        evaluated after listing them, and then on every change reported by a watch.
+        If the watch is disconnected, it is resumed from the last resourceVersion seen.
+        Keyword arguments:
+        kind -- "nodes", "pods" or "deployments"
+        predicate -- function receiving the list of objects
+        namespace -- namespace of the objects. All namespaces by default
+        field_selector -- field selector for the objects (e.g. metadata.name=my-node)
+        timeout -- seconds to wait for the predicate to become true
+        Returns the list of objects
+        """
+        if kind not in API_PATHS:
+            raise ValueError(f"Invalid kind {kind}")
+
+        path = API_PATHS[kind].format(namespace=f"namespaces/{namespace}/" if namespace else "")
+        params = {"fieldSelector": field_selector} if field_selector else {}
+        name = getattr(predicate, "__name__", "predicate")
+
+        with deadline.deadline(timeout) as d:
+            try:
+                return self._wait_for(path, params, predicate, d)
+            except deadline.DeadlineExceeded:
+                raise deadline.DeadlineExceeded(f"{kind} did not satisfy {name} after {timeout}s")
+
+    def _wait_for(self, path, params, predicate, d):
+        objects, version = {}, None
+        while True:
+            try:
+                if version is None:
+                    response = self.get_raw(f"{path}?{urlencode(params)}")
+                    objects = {self._object_key(o): o for o in response["items"]}
+                    version = response["metadata"]["resourceVersion"]
+
+                if predicate(list(objects.values())):
+                    return list(objects.values())
+
+                watch_params = {**params,
+                                "watch": "true",
+                                "allowWatchBookmarks": "true",
+                                "resourceVersion": version}
+                if d.remaining() is not None:
+                    watch_params["timeoutSeconds"] = int(d.remaining()) + 1
+                for event in self.watch_raw(f"{path}?{urlencode(watch_params)}"):
+                    obj = event["object"]
+                    if event["type"] == "ERROR":
+                        # 410 Gone: the resourceVersion is too old, list again
+                        if obj.get("code") != 410:
+                            logger.warning(f"Error watching {path}: {obj.get('message')}")
+                        version = None
+                        break
+
+                    version = obj["metadata"]["resourceVersion"]
+                    if event["type"] == "BOOKMARK":
+                        continue
+                    if event["type"] == "DELETED":
+                        objects.pop(self._object_key(obj), None)
+                    else:
+                        objects[self._object_key(obj)] = obj
+
+                    if predicate(list(objects.values())):
+                        return list(objects.values())
+            except (requests.RequestException, RuntimeError, ValueError) as ex:
+                if d.expired():
+                    raise deadline.DeadlineExceeded() from ex
+                # the apiserver may be unavailable (e.g. a master is rebooting). Resume later.
+                logger.warning(f"Watch on {path} disconnected: {ex}")
+                deadline.sleep(2)
+
+    @staticmethod
+    def _object_key(obj):
+        return obj["metadata"].get("namespace", ""), obj["metadata"]["name"]
+
+    def wait_for_pods_ready(self, namespace=DEFAULT_NAMESPACE, node=None, statuses=("Running", "Succeeded"),
+                            timeout=300):
+        """Waits until there are pods in the namespace, optionally in a node, and all are in any
+        of the statuses"""
+        field_selector = f"spec.nodeName={node}" if node else None
+        return self.wait_for("pods", pods_ready(statuses), namespace=namespace,
+                             field_selector=field_selector, timeout=timeout)
+
+    def wait_for_node_ready(self, name, timeout=300):
+        """Waits until the node is Ready"""
+        return self.wait_for("nodes", nodes_ready, field_selector=f"metadata.name={name}", timeout=timeout)
+
+    def wait_for_deployment_available(self, name, namespace=DEFAULT_NAMESPACE, timeout=300):
+        """Waits until the deployment is Available"""
+        return self.wait_for("deployments", deployments_available, namespace=namespace,
+                             field_selector=f"metadata.name={name}", timeout=timeout)
 
     def get_num_nodes_by_role(self, role):
         """ Returns the number of nodes by role (master/worker)"""
@@ -37,12 +252,11 @@ class Kubectl:
         if role not in ("master", "worker"):
             raise ValueError("Invalid role {}".format(role))
 
-        roles = {
-            "master": "==",
-            "worker": "!="
+        selectors = {
+            "master": "node-role.kubernetes.io/master",
+            "worker": "!node-role.kubernetes.io/master"
         }
-        command = f"get nodes --selector=node-role.kubernetes.io/master{roles.get(role)}"" -o jsonpath='{.items[*].metadata.name}'"
-        return self.run_kubectl(command).split()
+        return [node.name for node in self.get_nodes(label_selector=selectors[role])]
 
     def inhibit_kured(self):
         max_attempt = 18
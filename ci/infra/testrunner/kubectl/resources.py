@@ -0,0 +1,77 @@
+class Resource:
+    """Kubernetes object as returned by the API.
+    The raw object is kept in the obj attribute.
+    """
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    @property
+    def name(self):
+        return self.obj["metadata"]["name"]
+
+    @property
+    def namespace(self):
+        return self.obj["metadata"].get("namespace")
+
+    @property
+    def labels(self):
+        return self.obj["metadata"].get("labels", {})
+
+    def condition(self, condition_type):
+        """Returns the status of a condition ("True", "False", "Unknown") or None if not reported"""
+        for c in self.obj.get("status", {}).get("conditions", []):
+            if c["type"] == condition_type:
+                return c["status"]
+        return None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.name})"
+
+
+class Node(Resource):
+
+    @property
+    def ready(self):
+        return self.condition("Ready") == "True"
+
+    @property
+    def kubelet_version(self):
+        return self.obj["status"]["nodeInfo"]["kubeletVersion"]
+
+    @property
+    def is_master(self):
+        return "node-role.kubernetes.io/master" in self.labels
+
+
+class Pod(Resource):
+
+    @property
+    def phase(self):
+        return self.obj.get("status", {}).get("phase")
+
+    @property
+    def node_name(self):
+        return self.obj["spec"].get("nodeName")
+
+
+class Deployment(Resource):
+
+    @property
+    def available(self):
+        return self.condition("Available") == "True"
+
+    @property
+    def replicas(self):
+        return self.obj["spec"].get("replicas", 0)
+
+    @property
+    def ready_replicas(self):
+        return self.obj.get("status", {}).get("readyReplicas", 0)
+
+
+class ConfigMap(Resource):
+
+    @property
+    def data(self):
+        return self.obj.get("data", {})
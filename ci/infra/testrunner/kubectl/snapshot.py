@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+
+from kubectl.resources import (Node, Pod)
+
+
+class ClusterSnapshot:
+    """Nodes and pods of the cluster, fetched with a single request for each kind,
+    or namespace for the pods, and reused for max_age seconds.
+
+    A snapshot is shared by all the checks and helpers querying the same cluster,
+    so evaluating a condition for every node or pod costs two API requests per
+    interval, regardless of the number of nodes and checks. Concurrent callers
+    wait for the refresh in progress instead of issuing their own requests.
+    """
+
+    def __init__(self, get_raw, max_age=1, clock=time.monotonic):
+        """get_raw: function returning the json response for an API path"""
+        self.get_raw = get_raw
+        self.max_age = max_age
+        self.clock = clock
+        self.refreshes = 0
+        # (kind, namespace) -> (time fetched, objects)
+        self._fetched = {}
+        self._lock = threading.Lock()
+
+    def _fetch(self, key, path, resource):
+        """Returns the objects of the API path, fetched again if older than max_age"""
+        with self._lock:
+            fetched, objects = self._fetched.get(key, (None, None))
+            if fetched is None or self.clock() - fetched >= self.max_age:
+                objects = [resource(o) for o in self.get_raw(path)["items"]]
+                self._fetched[key] = (self.clock(), objects)
+                self.refreshes += 1
+            return objects
+
+    def invalidate(self):
+        """Forces the next query to fetch the state of the cluster"""
+        with self._lock:
+            self._fetched.clear()
+
+    def nodes(self):
+        return list(self._fetch(("nodes", None), "/api/v1/nodes", Node))
+
+    def node(self, name):
+        """Returns the node with the given name. Raises KeyError if it does not exist"""
+        for node in self.nodes():
+            if node.name == name:
+                return node
+        raise KeyError(name)
+
+    def pods(self, namespace=None, node=None):
+        """Returns the pods, optionally in a namespace or a node. Only the pods
+        of the namespace are fetched when one is given"""
+        path = f"/api/v1/namespaces/{namespace}/pods" if namespace else "/api/v1/pods"
+        return [pod for pod in self._fetch(("pods", namespace), path, Pod)
+                if node is None or pod.node_name == node]
+
+
+# (kubeconfig, modification time) -> ClusterSnapshot
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def shared_snapshot(kubeconfig, get_raw, max_age=1):
+    """Returns the snapshot shared by all the clients of the kubeconfig. A new
+    snapshot, using get_raw, replaces the one of a previous version of the
+    kubeconfig (e.g. the cluster was bootstrapped again)"""
+    key = (kubeconfig, os.stat(kubeconfig).st_mtime)
+    with _snapshots_lock:
+        snapshot = _snapshots.get(key)
+        if snapshot is None:
+            for stale in [k for k in _snapshots if k[0] == kubeconfig]:
+                del _snapshots[stale]
+            snapshot = ClusterSnapshot(get_raw, max_age=max_age)
+            _snapshots[key] = snapshot
+        return snapshot
+
+
+def invalidate_snapshot(kubeconfig):
+    """Forces the snapshot of the kubeconfig, if any, to fetch the state of the
+    cluster on the next query (e.g. after applying changes to the cluster)"""
+    with _snapshots_lock:
+        snapshots = [snapshot for key, snapshot in _snapshots.items() if key[0] == kubeconfig]
+    for snapshot in snapshots:
+        snapshot.invalidate()
@@ -0,0 +1,126 @@
+import json
+import threading
+from http.server import (BaseHTTPRequestHandler, ThreadingHTTPServer)
+from types import SimpleNamespace
+
+import pytest
+
+from kubectl.kubectl import (Kubectl, pods_ready)
+
+NODE = {"metadata": {"name": "master-0", "resourceVersion": "1",
+                     "labels": {"node-role.kubernetes.io/master": ""}},
+        "status": {"conditions": [{"type": "Ready", "status": "False"}],
+                   "nodeInfo": {"kubeletVersion": "v1.18.6"}}}
+
+READY_NODE = {**NODE,
+              "metadata": {**NODE["metadata"], "resourceVersion": "2"},
+              "status": {**NODE["status"], "conditions": [{"type": "Ready", "status": "True"}]}}
+
+KUBECONFIG = """
+apiVersion: v1
+kind: Config
+current-context: admin
+contexts:
+- name: admin
+  context:
+    cluster: test-cluster
+    user: admin
+clusters:
+- name: test-cluster
+  cluster:
+    server: http://127.0.0.1:{port}
+users:
+- name: admin
+  user:
+    token: secret
+"""
+
+
+class FakeApiserver(BaseHTTPRequestHandler):
+
+    paths = []
+
+    def do_GET(self):
+        FakeApiserver.paths.append(self.path)
+        if self.headers.get("Authorization") != "Bearer secret":
+            self.send_response(401)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        if "watch=true" in self.path:
+            event = {"type": "MODIFIED", "object": READY_NODE}
+            self.wfile.write(json.dumps(event).encode() + b"\n")
+        elif self.path.startswith("/api/v1/nodes/master-0"):
+            self.wfile.write(json.dumps(NODE).encode())
+        else:
+            nodes = {"metadata": {"resourceVersion": "1"}, "items": [NODE]}
+            self.wfile.write(json.dumps(nodes).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def kubectl(tmp_path):
+    FakeApiserver.paths = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeApiserver)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    kubeconfig = tmp_path / "admin.conf"
+    kubeconfig.write_text(KUBECONFIG.format(port=server.server_address[1]))
+    conf = SimpleNamespace(
+        kubectl=SimpleNamespace(binpath="/usr/bin/kubectl", kubeconfig=str(kubeconfig),
+                                backend="api", api_timeout=5, snapshot_max_age=1),
+        utils=SimpleNamespace(ssh_sock="/tmp/testrunner_ssh_sock"))
+    yield Kubectl(conf)
+    server.shutdown()
+
+
+def test_typed_objects(kubectl):
+    """Test objects are returned as typed resources using the kubeconfig credentials
+    """
+    nodes = kubectl.get_nodes()
+    assert [n.name for n in nodes] == ["master-0"]
+    assert nodes[0].is_master
+    assert not nodes[0].ready
+    assert kubectl.get_node("master-0").kubelet_version == "v1.18.6"
+    assert kubectl.get_node_names_by_role("master") == ["master-0"]
+
+
+def test_watch(kubectl):
+    """Test waiting for a condition uses the watch stream of the api backend
+    """
+    nodes = kubectl.wait_for_node_ready("master-0", timeout=5)
+    assert nodes[0]["metadata"]["resourceVersion"] == "2"
+
+
+def test_watch_without_timeout(kubectl):
+    """Test waiting without a timeout watches without a server side timeout,
+    and errors of the predicate are not taken as disconnections of the watch
+    """
+    def ready(nodes):
+        return nodes[0]["status"]["conditions"][0]["status"] == "True"
+
+    kubectl.wait_for("nodes", ready, timeout=None)
+    watches = [p for p in FakeApiserver.paths if "watch=true" in p]
+    assert watches and "timeoutSeconds" not in watches[0]
+
+    with pytest.raises(KeyError):
+        kubectl.wait_for("nodes", lambda nodes: nodes[0]["missing"], timeout=5)
+
+
+def test_wait_for_pods_ready(kubectl, monkeypatch):
+    """Test pods are waited for in the default namespace and there must be at least one pod
+    """
+    waits = []
+    monkeypatch.setattr(kubectl, "wait_for", lambda kind, predicate, **kwargs: waits.append((kind, kwargs)))
+    kubectl.wait_for_pods_ready(node="worker-0")
+    assert waits == [("pods", {"namespace": "default", "field_selector": "spec.nodeName=worker-0",
+                               "timeout": 300})]
+
+    ready = pods_ready()
+    assert not ready([])
+    assert not ready([{"status": {"phase": "Running"}}, {"status": {"phase": "Pending"}}])
+    assert ready([{"status": {"phase": "Running"}}, {"status": {"phase": "Succeeded"}}])
@@ -0,0 +1,103 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from kubectl import snapshot as snapshots
+from kubectl.kubectl import Kubectl
+from kubectl.snapshot import (ClusterSnapshot, shared_snapshot)
+
+
+class FakeKubectl:
+    def __init__(self):
+        self.requests = 0
+        self.paths = []
+
+    def get_raw(self, path):
+        self.requests += 1
+        self.paths.append(path)
+        if path == "/api/v1/nodes":
+            return {"items": [{"metadata": {"name": f"node-{i}"},
+                               "status": {"conditions": [{"type": "Ready", "status": "True"}]}}
+                              for i in range(10)]}
+        return {"items": [{"metadata": {"name": f"pod-{i}", "namespace": "kube-system"},
+                           "spec": {"nodeName": f"node-{i}"},
+                           "status": {"phase": "Running"}}
+                          for i in range(10)]}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def clock(self):
+        return self.now
+
+
+def test_snapshot_shared_by_concurrent_checks():
+    """Test checks for all the nodes evaluated concurrently are answered by a single refresh
+    """
+    kubectl = FakeKubectl()
+    clock = FakeClock()
+    snapshot = ClusterSnapshot(kubectl.get_raw, max_age=1, clock=clock.clock)
+
+    def check(i):
+        node = f"node-{i % 10}"
+        return snapshot.node(node).ready and all(p.phase == "Running" for p in snapshot.pods(node=node))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert all(executor.map(check, range(50)))
+    assert kubectl.requests == 2
+    assert len(snapshot.pods()) == 10
+
+    clock.now = 1
+    snapshot.nodes()
+    assert kubectl.requests == 3
+
+    snapshot.invalidate()
+    snapshot.nodes()
+    assert kubectl.requests == 4
+
+
+def test_snapshot_pods_in_namespace():
+    """Test only the pods of the namespace are fetched when one is given
+    """
+    kubectl = FakeKubectl()
+    snapshot = ClusterSnapshot(kubectl.get_raw, max_age=60)
+
+    snapshot.pods(namespace="kube-system", node="node-1")
+    snapshot.pods(namespace="kube-system")
+    assert kubectl.paths == ["/api/v1/namespaces/kube-system/pods"]
+    snapshot.pods()
+    assert kubectl.paths[-1] == "/api/v1/pods"
+
+
+def test_shared_snapshot(tmp_path, monkeypatch):
+    """Test the snapshot is shared for the same kubeconfig, replaced when the
+    kubeconfig changes and invalidated after changing the cluster
+    """
+    monkeypatch.setattr(snapshots, "_snapshots", {})
+    kubeconfig = tmp_path / "admin.conf"
+    kubeconfig.write_text("cluster")
+    first, second = FakeKubectl(), FakeKubectl()
+
+    snapshot = shared_snapshot(str(kubeconfig), first.get_raw, max_age=60)
+    assert shared_snapshot(str(kubeconfig), second.get_raw, max_age=60) is snapshot
+
+    os.utime(kubeconfig, (0, 0))
+    replaced = shared_snapshot(str(kubeconfig), second.get_raw, max_age=60)
+    assert replaced is not snapshot
+    assert list(snapshots._snapshots.values()) == [replaced]
+
+    conf = SimpleNamespace(
+        kubectl=SimpleNamespace(binpath="true", kubeconfig=str(kubeconfig), backend="kubectl",
+                                api_timeout=5, snapshot_max_age=60),
+        utils=SimpleNamespace(ssh_sock="/tmp/testrunner_ssh_sock"))
+    kubectl = Kubectl(conf)
+    monkeypatch.setattr(kubectl, "get_raw", second.get_raw)
+    kubectl.snapshot().nodes()
+    kubectl.run_kubectl("get nodes")
+    kubectl.snapshot().nodes()
+    assert second.requests == 1
+    kubectl.run_kubectl("apply -f deployment.yaml")
+    kubectl.snapshot().nodes()
+    assert second.requests == 2
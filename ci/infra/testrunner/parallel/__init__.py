@@ -0,0 +1,3 @@
+from parallel.junit import junit_durations, junit_key, merge_junit
+from parallel.runner import ParallelRunner, collect
+from parallel.scheduler import TestItem, estimate_durations, schedule, shard
@@ -0,0 +1,66 @@
+import logging
+import os
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger('testrunner')
+
+COUNTERS = ("tests", "errors", "failures", "skipped")
+
+
+def junit_key(nodeid):
+    """Returns the key identifying a test in a JUnit report, given its pytest node id
+    (e.g. test_upgrade.py::TestUpgrade::test_plan[1] -> test_upgrade.TestUpgrade::test_plan[1])"""
+    parts = nodeid.split("::")
+    module = parts[0][:-3] if parts[0].endswith(".py") else parts[0]
+    classname = ".".join([module.replace("/", ".")] + parts[1:-1])
+    return f"{classname}::{parts[-1]}"
+
+
+def _testcases(path):
+    root = ET.parse(path).getroot()
+    suites = [root] if root.tag == "testsuite" else root.findall("testsuite")
+    for suite in suites:
+        yield from suite.findall("testcase")
+
+
+def junit_durations(paths):
+    """Returns the duration in seconds of each test recorded in the JUnit reports,
+    keyed by junit_key. Reports which don't exist or can't be parsed are ignored"""
+    durations = {}
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        try:
+            for case in _testcases(path):
+                key = f"{case.get('classname')}::{case.get('name')}"
+                durations[key] = float(case.get("time", 0))
+        except (ET.ParseError, ValueError) as ex:
+            logger.warning(f"Ignoring test durations from {path}: {ex}")
+    return durations
+
+
+def merge_junit(paths, output, elapsed=None):
+    """Merges the test cases of several JUnit reports into a single test suite.
+       elapsed: wall time of the whole run. Defaults to the longest of the reports
+    """
+    suite = ET.Element("testsuite", name="pytest")
+    counters = dict.fromkeys(COUNTERS, 0)
+    longest = 0.0
+    for path in paths:
+        if not os.path.isfile(path):
+            logger.warning(f"JUnit report {path} not found")
+            continue
+        root = ET.parse(path).getroot()
+        for src in [root] if root.tag == "testsuite" else root.findall("testsuite"):
+            for counter in COUNTERS:
+                counters[counter] += int(src.get(counter, 0))
+            longest = max(longest, float(src.get("time", 0)))
+            suite.extend(src.findall("testcase"))
+
+    for counter, value in counters.items():
+        suite.set(counter, str(value))
+    suite.set("time", "{:.3f}".format(longest if elapsed is None else elapsed))
+
+    root = ET.Element("testsuites")
+    root.append(suite)
+    ET.ElementTree(root).write(output, encoding="utf-8", xml_declaration=True)
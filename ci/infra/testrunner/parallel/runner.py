@@ -0,0 +1,159 @@
+"""Parallel execution of the tests against several clusters.
+
+The tests are collected once, distributed among the workers by their expected
+duration (see scheduler.schedule) and executed by a pytest process for each
+worker. Each worker uses its own cluster:
+
+* stack mode: a terraform stack named w<N>-<stack name>, with all its files under
+  <workers dir>/w<N>, set up and destroyed by the tests of the worker as usual.
+* pool mode: clusters leased from the cluster pool. Disruptive tests get a cluster
+  for each of them, as a leased cluster can't be set up again by the tests.
+
+The output of each worker goes to <workers dir>/w<N>.log and the JUnit reports of
+all the workers are merged into a single one.
+"""
+
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+import pytest
+
+from parallel.junit import junit_durations, merge_junit
+from parallel.scheduler import TestItem, batches, estimate_durations, schedule
+from pool import copy_terraform_files, stack_conf, stack_env
+
+logger = logging.getLogger('testrunner')
+
+
+class _Collector:
+    """Pytest plugin which records the collected tests"""
+
+    def __init__(self, rootdir):
+        self.rootdir = rootdir
+        self.items = []
+
+    def pytest_collection_finish(self, session):
+        for item in session.items:
+            selector = item.nodeid.partition("::")[2]
+            arg = os.path.relpath(str(item.fspath), self.rootdir)
+            markers = [m.name for m in item.iter_markers()]
+            # tests skipped because they already passed (see --reuse-results)
+            markers += [name for name, _ in item.user_properties if name == "cached"]
+            self.items.append(TestItem(item.nodeid, arg=f"{arg}::{selector}" if selector else arg, markers=markers))
+
+
+def collect(opts, test_path, rootdir):
+    """Returns the tests selected by the pytest options and test path. The output
+    of pytest goes to stderr, so the output of the testrunner can be parsed"""
+    collector = _Collector(rootdir)
+    with redirect_stdout(sys.stderr):
+        result = pytest.main(args=opts + ["--collect-only", "-qq", test_path], plugins=[collector])
+    if result not in (0, 5):
+        raise Exception(f"error collecting tests: pytest returned {result}")
+    return collector.items
+
+
+def _combine(results):
+    """Returns the pytest return code for the results of several pytest runs"""
+    errors = [rc for rc in results if rc not in (0, 1, 5)]
+    if errors:
+        return errors[0]
+    if all(rc == 5 for rc in results):
+        return 5
+    return max(rc for rc in results if rc != 5)
+
+
+class ParallelRunner:
+    """Runs the tests with several pytest workers, each one using its own cluster.
+       conf: testrunner configuration
+       platform: name of the platform
+       workers: number of workers
+       pool: ClusterPool the clusters are leased from. If None, each worker
+             sets up its own stack
+       rootdir: directory pytest is executed from
+    """
+
+    def __init__(self, conf, platform, workers, rootdir, pool=None):
+        self.conf = conf
+        self.platform = platform
+        self.workers = workers
+        self.rootdir = rootdir
+        self.pool = pool
+        self.dir = conf.test.workers_dir
+
+    def plan(self, opts, test_path, durations_from=()):
+        """Collects the tests and returns the tests of each worker"""
+        items = collect(opts, test_path, self.rootdir)
+        estimate_durations(items, junit_durations(durations_from), default=self.conf.test.default_duration)
+        return schedule(items, self.workers)
+
+    def run(self, opts, test_path, junit, durations_from=()):
+        """Runs the tests and merges the results of the workers into the junit file.
+        Returns the pytest return code"""
+        plan = self.plan(opts, test_path, durations_from=durations_from)
+        os.makedirs(self.dir, exist_ok=True)
+        for n, tests in enumerate(plan):
+            logger.info(f"Worker w{n}: {len(tests)} tests, estimated {sum(t.duration for t in tests):.0f}s")
+
+        if self.pool is not None:
+            self.pool.refill()
+
+        start = time.time()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="test-worker") as executor:
+                futures = [executor.submit(self._worker, n, tests, opts)
+                           for n, tests in enumerate(plan) if tests]
+                runs = [run for future in futures for run in future.result()]
+        except BaseException:
+            # don't leave clusters being provisioned in the background when aborting
+            if self.pool is not None:
+                self.pool.wait_refill(cancel=True)
+            raise
+
+        if self.pool is not None:
+            self.pool.wait_refill()
+
+        merge_junit([report for report, _ in runs], junit, elapsed=time.time() - start)
+        return _combine([rc for _, rc in runs]) if runs else 5
+
+    def _worker(self, n, tests, opts):
+        """Runs the tests of a worker. Returns the report and return code of each pytest run"""
+        name = f"w{n}"
+        runs = []
+        open(os.path.join(self.dir, f"{name}.log"), "w").close()
+        if self.pool is None:
+            workdir = os.path.join(self.dir, name)
+            conf = stack_conf(self.conf, name, workdir)
+            shutil.rmtree(conf.terraform.tfdir, ignore_errors=True)
+            copy_terraform_files(self.conf, conf, self.platform)
+            env = stack_env(conf)
+            for i, batch in enumerate(batches(tests)):
+                runs.append(self._pytest(name, i, batch, opts, env))
+            return runs
+
+        skip_setup = "deployed" if self.pool.bootstrap else "provisioned"
+        for i, batch in enumerate(batches(tests, isolate_disruptive=True)):
+            lease = self.pool.acquire()
+            try:
+                runs.append(self._pytest(name, i, batch, opts + [f"--skip-setup={skip_setup}"], lease.env()))
+            finally:
+                self.pool.release(lease)
+        return runs
+
+    def _pytest(self, name, batch_nr, tests, opts, env):
+        report = os.path.join(self.dir, f"{name}-{batch_nr}.xml")
+        if os.path.exists(report):
+            os.remove(report)
+        args = [sys.executable, "-m", "pytest"] + opts + [f"--junitxml={report}"] + [t.arg for t in tests]
+        logger.info(f"Worker {name}: running {len(tests)} tests")
+        with open(os.path.join(self.dir, f"{name}.log"), "a") as log:
+            rc = subprocess.run(args, cwd=self.rootdir, env={**os.environ, **env, "TESTRUNNER_WORKER": name},
+                                stdout=log, stderr=subprocess.STDOUT).returncode
+        logger.info(f"Worker {name}: pytest returned {rc}")
+        return report, rc
@@ -0,0 +1,139 @@
+import statistics
+
+from parallel.junit import junit_key
+
+DEFAULT_DURATION = 300
+
+# Order of the tests of a worker: PR tests first, for an early signal, then the rest,
+# flaky tests and finally disruptive tests, which leave the cluster dirty.
+ORDER = ("pr", None, "flaky", "disruptive")
+
+
+class TestItem:
+    """Test to be scheduled.
+       nodeid: pytest node id, relative to the rootdir of the tests
+       arg: argument for selecting the test from the testrunner directory
+       markers: names of the markers of the test
+       duration: expected duration in seconds
+    """
+
+    __test__ = False
+
+    def __init__(self, nodeid, arg=None, markers=(), duration=None):
+        self.nodeid = nodeid
+        self.arg = arg or nodeid
+        self.markers = set(markers)
+        self.duration = duration
+
+    @property
+    def module(self):
+        return self.nodeid.split("::")[0]
+
+    @property
+    def disruptive(self):
+        return "disruptive" in self.markers
+
+    def rank(self):
+        for i, marker in enumerate(ORDER):
+            if marker in self.markers:
+                return i
+        return ORDER.index(None)
+
+    def __repr__(self):
+        return f"TestItem({self.nodeid!r})"
+
+
+def estimate_durations(items, durations, default=None):
+    """Sets the duration of the tests from the durations recorded in previous runs,
+    keyed by junit_key. Tests without a recorded duration get the median of the
+    recorded tests of the same module (e.g. other parameters of the test), or of
+    all the recorded tests, or the default if there are none. Tests whose result
+    is cached take no time"""
+    if durations:
+        default = statistics.median(durations.values())
+    elif default is None:
+        default = DEFAULT_DURATION
+
+    modules = {}
+    for item in items:
+        if junit_key(item.nodeid) in durations:
+            modules.setdefault(item.module, []).append(durations[junit_key(item.nodeid)])
+
+    for item in items:
+        known = modules.get(item.module)
+        item.duration = durations.get(junit_key(item.nodeid), statistics.median(known) if known else default)
+        if "cached" in item.markers:
+            item.duration = 0
+    return items
+
+
+def schedule(items, workers):
+    """Distributes the tests among the workers, assigning the longest tests first
+    to the least loaded worker. Disruptive tests are distributed first, so they are
+    spread evenly. Returns the list of tests of each worker, in execution order"""
+    plan = [[] for _ in range(workers)]
+    load = [0.0] * workers
+
+    def assign(tests):
+        for item in sorted(tests, key=lambda t: -t.duration):
+            worker = min(range(workers), key=lambda w: (load[w], w))
+            plan[worker].append(item)
+            load[worker] += item.duration
+
+    assign([item for item in items if item.disruptive])
+    assign([item for item in items if not item.disruptive])
+    _rebalance(plan, load)
+    return [sorted(tests, key=lambda t: t.rank()) for tests in plan]
+
+
+def _rebalance(plan, load, max_rounds=1000):
+    """Improves the distribution by moving tests from the most loaded worker to
+    another, or swapping them, while that reduces the load of the most loaded one.
+    Disruptive tests are only swapped with each other, so they stay spread"""
+    workers = range(len(plan))
+    for _ in range(max_rounds):
+        heavy = max(workers, key=lambda w: (load[w], -w))
+        if not _improve(plan, load, heavy, workers):
+            return
+
+
+def _improve(plan, load, heavy, workers):
+    for other in sorted(workers, key=lambda w: load[w]):
+        gap = load[heavy] - load[other]
+        for item in plan[heavy]:
+            if not item.disruptive and 0 < item.duration < gap:
+                _move(plan, load, item, heavy, other)
+                return True
+        for item in plan[heavy]:
+            for swap in plan[other]:
+                if item.disruptive == swap.disruptive and 0 < item.duration - swap.duration < gap:
+                    _move(plan, load, item, heavy, other)
+                    _move(plan, load, swap, other, heavy)
+                    return True
+    return False
+
+
+def _move(plan, load, item, src, dst):
+    plan[src].remove(item)
+    plan[dst].append(item)
+    load[src] -= item.duration
+    load[dst] += item.duration
+
+
+def shard(items, index, total):
+    """Returns the tests of the shard index (0 based) of total shards. The tests are
+    distributed as among parallel workers, so all the shards take about the same time.
+    The distribution only depends on the tests and their durations, so the shards
+    computed independently by each CI agent don't overlap"""
+    if not 0 <= index < total:
+        raise ValueError(f"Shard index must be between 0 and {total - 1}")
+    return schedule(items, total)[index]
+
+
+def batches(tests, isolate_disruptive=False):
+    """Splits the tests of a worker into the groups executed in a pytest session.
+    If isolate_disruptive is True, each disruptive test runs in its own session"""
+    if not isolate_disruptive:
+        return [tests] if tests else []
+    shared = [item for item in tests if not item.disruptive]
+    return ([shared] if shared else []) + [[item] for item in tests if item.disruptive]
@@ -0,0 +1,82 @@
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from parallel.junit import junit_durations, junit_key, merge_junit
+from parallel.scheduler import TestItem, batches, estimate_durations, schedule, shard
+
+REPORT = """<?xml version="1.0" encoding="utf-8"?>
+<testsuites><testsuite errors="0" failures="{failures}" name="pytest" skipped="0" tests="{tests}" time="{time}">
+{cases}
+</testsuite></testsuites>"""
+
+
+def _report(path, cases, failures=0):
+    path.write_text(REPORT.format(
+        failures=failures, tests=len(cases), time=sum(t for _, _, t in cases),
+        cases="\n".join(f'<testcase classname="{c}" name="{n}" time="{t}"/>' for c, n, t in cases)))
+    return str(path)
+
+
+def test_schedule():
+    """Test the tests are balanced by duration, disruptive tests are spread among
+    the workers and each worker runs PR tests first and disruptive tests last
+    """
+    items = [TestItem("test_a.py::test_long", duration=100),
+             TestItem("test_a.py::test_pr", markers=["pr"], duration=10),
+             TestItem("test_b.py::test_upgrade", markers=["disruptive"], duration=50),
+             TestItem("test_b.py::test_reboot", markers=["disruptive"], duration=40),
+             TestItem("test_c.py::test_flaky", markers=["flaky"], duration=30),
+             TestItem("test_c.py::test_short", duration=20)]
+
+    plan = schedule(items, 2)
+    assert [sum(t.duration for t in tests) for tests in plan] == [110, 140]
+    assert [[t.nodeid.split("::")[1] for t in tests] for tests in plan] == [
+        ["test_pr", "test_short", "test_flaky", "test_upgrade"], ["test_long", "test_reboot"]]
+
+    assert len(batches(plan[0])) == 1
+    assert [len(b) for b in batches(plan[0], isolate_disruptive=True)] == [3, 1]
+
+
+def test_durations(tmp_path):
+    """Test the durations of previous runs are matched to the collected tests
+    and unknown tests get the median duration
+    """
+    assert junit_key("test_upgrade.py::TestUpgrade::test_plan[1]") == "test_upgrade.TestUpgrade::test_plan[1]"
+    report = _report(tmp_path / "previous.xml", [("test_a", "test_one", 10), ("test_a", "test_two", 30),
+                                                 ("test_b", "test_three", 50)])
+    durations = junit_durations([report, str(tmp_path / "missing.xml")])
+    assert durations["test_a::test_two"] == 30
+
+    items = estimate_durations([TestItem("test_a.py::test_one"), TestItem("test_a.py::test_new"),
+                                TestItem("test_c.py::test_new")], durations)
+    assert [item.duration for item in items] == [10, 10, 30]
+
+
+def test_shard():
+    """Test the shards don't overlap, cover all the tests and are balanced
+    beyond what assigning the longest tests first achieves
+    """
+    items = [TestItem(f"test_a.py::test_{n}", duration=d) for n, d in enumerate([3, 3, 2, 2, 2])]
+    shards = [shard(items, index, 2) for index in range(2)]
+    assert sorted(t.nodeid for tests in shards for t in tests) == sorted(t.nodeid for t in items)
+    assert [sum(t.duration for t in tests) for tests in shards] == [6, 6]
+
+    with pytest.raises(ValueError):
+        shard(items, 2, 2)
+
+
+def test_merge_junit(tmp_path):
+    """Test the reports of the workers are merged into a single test suite
+    """
+    first = _report(tmp_path / "w0.xml", [("test_a", "test_one", 10), ("test_a", "test_two", 20)], failures=1)
+    second = _report(tmp_path / "w1.xml", [("test_b", "test_three", 25)])
+    output = tmp_path / "merged.xml"
+    merge_junit([first, second, str(tmp_path / "crashed.xml")], str(output))
+
+    suite = ET.parse(str(output)).getroot().find("testsuite")
+    assert suite.get("tests") == "3"
+    assert suite.get("failures") == "1"
+    assert float(suite.get("time")) == 30
+    assert [case.get("name") for case in suite.findall("testcase")] == ["test_one", "test_two", "test_three"]
+    assert junit_durations([str(output)])["test_b::test_three"] == 25
@@ -0,0 +1 @@
+from perf.history import PerfHistory, record_run, report
@@ -0,0 +1,218 @@
+"""History of the duration of the steps and tests of each run.
+
+Every run appends its metadata (command, commit, platform, node counts) and the
+duration of its steps and tests, taken from the trace of the run (see
+utils.tracing), to a SQLite database. Steps executed several times in a run
+(e.g. node_join) are recorded once per execution and compared by their total.
+
+A run is compared against a baseline made of the previous runs of the same
+command, platform and topology. A step or test regressed if it took longer than
+the given fraction over the median of the baseline and longer than the slowest
+of the baseline runs (ignoring the slowest tenth), so normal variations are not
+reported.
+"""
+
+import logging
+import os
+import socket
+import sqlite3
+import statistics
+import time
+from contextlib import closing
+
+from results import git_commit
+
+logger = logging.getLogger('testrunner')
+
+REPO_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), "..", "..", "..", ".."))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started REAL NOT NULL,
+    command TEXT NOT NULL,
+    git_commit TEXT,
+    platform TEXT,
+    masters INTEGER,
+    workers INTEGER,
+    host TEXT
+);
+CREATE TABLE IF NOT EXISTS timings (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    duration REAL NOT NULL,
+    outcome TEXT
+);
+CREATE INDEX IF NOT EXISTS timings_run ON timings(run_id);
+CREATE INDEX IF NOT EXISTS runs_key ON runs(command, platform, masters, workers);
+"""
+
+
+def percentile(values, p):
+    """Returns the p-th percentile of the values, interpolating between the closest ranks"""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = (len(values) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+class Comparison:
+    """Duration of a step or test in a run compared to the baseline.
+       kind: step or test
+       duration: total duration in the run (seconds)
+       baseline: durations in the baseline runs which executed it
+    """
+
+    def __init__(self, kind, name, duration, baseline, threshold):
+        self.kind = kind
+        self.name = name
+        self.duration = duration
+        self.baseline = baseline
+        self.median = statistics.median(baseline) if baseline else None
+        self.p90 = percentile(baseline, 90)
+        self.threshold = threshold
+
+    def change(self):
+        """Returns the change over the median of the baseline, as a fraction"""
+        if not self.median:
+            return None
+        return self.duration / self.median - 1
+
+    def regressed(self):
+        change = self.change()
+        return change is not None and change > self.threshold and self.duration > self.p90
+
+
+class PerfHistory:
+    """SQLite database with the timings of the runs.
+       path: path of the database file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as db, db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        # concurrent runs (e.g. parallel workers) wait for each other's writes
+        return sqlite3.connect(self.path, timeout=60)
+
+    def record(self, command, timings, platform=None, masters=None, workers=None,
+               commit=None, started=None, host=None):
+        """Records a run. timings is a list of (kind, name, duration, outcome).
+        Returns the id of the run"""
+        with closing(self._connect()) as db, db:
+            cursor = db.execute(
+                "INSERT INTO runs (started, command, git_commit, platform, masters, workers, host) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (started if started is not None else time.time(), command, commit, platform,
+                 masters, workers, host or socket.gethostname()))
+            run_id = cursor.lastrowid
+            db.executemany("INSERT INTO timings (run_id, kind, name, duration, outcome) VALUES (?, ?, ?, ?, ?)",
+                           [(run_id, kind, name, duration, outcome) for kind, name, duration, outcome in timings])
+        return run_id
+
+    def run(self, run_id=None):
+        """Returns the metadata of a run as a dict, by default the last one"""
+        with closing(self._connect()) as db:
+            db.row_factory = sqlite3.Row
+            if run_id is None:
+                row = db.execute("SELECT * FROM runs ORDER BY id DESC LIMIT 1").fetchone()
+            else:
+                row = db.execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"Run {run_id if run_id is not None else ''} not found in {self.path}")
+        return dict(row)
+
+    def totals(self, run_ids, passed_only=False):
+        """Returns the total duration of each (kind, name) in each run, as {(kind, name): {run_id: total}}"""
+        if not run_ids:
+            return {}
+        marks = ", ".join("?" * len(run_ids))
+        query = f"SELECT run_id, kind, name, SUM(duration) FROM timings WHERE run_id IN ({marks})"
+        if passed_only:
+            query += " AND outcome IN ('ok', 'passed')"
+        with closing(self._connect()) as db:
+            rows = db.execute(query + " GROUP BY run_id, kind, name", list(run_ids)).fetchall()
+        totals = {}
+        for run_id, kind, name, total in rows:
+            totals.setdefault((kind, name), {})[run_id] = total
+        return totals
+
+    def baseline_runs(self, run, size):
+        """Returns the ids of the size runs previous to the run with the same command,
+        platform and topology"""
+        with closing(self._connect()) as db:
+            rows = db.execute(
+                "SELECT id FROM runs WHERE id < ? AND command = ? AND platform IS ? AND masters IS ? "
+                "AND workers IS ? ORDER BY id DESC LIMIT ?",
+                (run["id"], run["command"], run["platform"], run["masters"], run["workers"], size)).fetchall()
+        return [row[0] for row in rows]
+
+    def compare(self, run_id=None, baseline=10, threshold=0.2, min_duration=5):
+        """Compares the steps and tests of a run (by default, the last one) with the
+        previous baseline runs. Steps and tests which failed in the baseline, or
+        took less than min_duration seconds, are not compared.
+        Returns the run and the list of comparisons"""
+        run = self.run(run_id)
+        baseline_ids = self.baseline_runs(run, baseline)
+        current = self.totals([run["id"]])
+        previous = self.totals(baseline_ids, passed_only=True)
+
+        comparisons = []
+        for (kind, name), totals in sorted(current.items()):
+            duration = totals[run["id"]]
+            if duration < min_duration:
+                continue
+            comparisons.append(Comparison(kind, name, duration,
+                                          list(previous.get((kind, name), {}).values()), threshold))
+        return run, comparisons
+
+
+def report(run, comparisons, regressions_only=False):
+    """Returns a table with the comparison of a run against its baseline"""
+    lines = [f"Run {run['id']}: {run['command']} on {run['platform']} "
+             f"({run['masters']} masters, {run['workers']} workers) "
+             f"commit {(run['git_commit'] or 'unknown')[:12]} at "
+             f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(run['started']))}",
+             "{:<6} {:<60} {:>9} {:>9} {:>9} {:>8} {:>5}".format(
+                 "kind", "name", "duration", "median", "p90", "change", "runs")]
+    for c in comparisons:
+        if regressions_only and not c.regressed():
+            continue
+        change = c.change()
+        lines.append("{:<6} {:<60} {:>8.0f}s {:>9} {:>9} {:>8} {:>5}{}".format(
+            c.kind, c.name[-60:], c.duration,
+            f"{c.median:.0f}s" if c.median is not None else "-",
+            f"{c.p90:.0f}s" if c.p90 is not None else "-",
+            f"{change * 100:+.0f}%" if change is not None else "-",
+            len(c.baseline), "  REGRESSION" if c.regressed() else ""))
+    regressions = sum(1 for c in comparisons if c.regressed())
+    lines.append(f"{regressions} regression(s) over {len(comparisons)} steps and tests")
+    return "\n".join(lines)
+
+
+def record_run(conf, command, platform, tracer):
+    """Records the steps and tests of the spans collected by the tracer in the history
+    configured in conf.perf. Errors are only logged, as they must not fail the run"""
+    if not conf.perf.db:
+        return None
+    spans = tracer.snapshot()
+    timings = [(s.category, s.name, s.duration, s.outcome) for s in spans if s.category in ("step", "test")]
+    if not timings:
+        return None
+    try:
+        return PerfHistory(conf.perf.db).record(
+            command, timings, platform=platform, masters=conf.terraform.master.count,
+            workers=conf.terraform.worker.count, commit=git_commit(REPO_DIR),
+            started=min(s.start for s in spans))
+    except sqlite3.Error as ex:
+        logger.warning(f"Error recording the timings of the run in {conf.perf.db}: {ex}")
+        return None
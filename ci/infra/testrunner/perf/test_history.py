@@ -0,0 +1,52 @@
+import pytest
+
+from perf.history import PerfHistory, percentile, report
+
+
+def test_percentile():
+    """Test the percentile interpolates between the closest ranks
+    """
+    assert percentile([], 90) is None
+    assert percentile([5], 90) == 5
+    assert percentile([1, 2, 3, 4, 5], 50) == 3
+    assert percentile(list(range(11)), 90) == pytest.approx(9)
+
+
+def test_compare(tmp_path):
+    """Test a step is reported as a regression when it is slower than the
+    baseline of previous runs with the same command, platform and topology
+    """
+    history = PerfHistory(str(tmp_path / "perf.db"))
+    for n in range(5):
+        history.record("provision", [("step", "Skuba.cluster_deploy", 100 + n, "ok"),
+                                     ("step", "Skuba.node_join", 20, "ok"),
+                                     ("step", "Skuba.node_join", 20, "ok"),
+                                     ("step", "Utils.setup_ssh", 1, "ok")],
+                       platform="openstack", masters=1, workers=2)
+    # failed runs and runs on other topologies are not part of the baseline
+    history.record("provision", [("step", "Skuba.cluster_deploy", 500, "error: Exception")],
+                   platform="openstack", masters=1, workers=2)
+    history.record("provision", [("step", "Skuba.node_join", 400, "ok")],
+                   platform="openstack", masters=3, workers=2)
+    run_id = history.record("provision", [("step", "Skuba.cluster_deploy", 150, "ok"),
+                                          ("step", "Skuba.node_join", 21, "ok"),
+                                          ("step", "Skuba.node_join", 22, "ok"),
+                                          ("step", "Utils.setup_ssh", 3, "ok")],
+                            platform="openstack", masters=1, workers=2)
+
+    run, comparisons = history.compare(baseline=10, threshold=0.2, min_duration=5)
+    assert run["id"] == run_id
+    result = {c.name: c for c in comparisons}
+    assert set(result) == {"Skuba.cluster_deploy", "Skuba.node_join"}
+
+    deploy = result["Skuba.cluster_deploy"]
+    assert deploy.median == 102
+    assert len(deploy.baseline) == 5
+    assert deploy.regressed()
+
+    join = result["Skuba.node_join"]
+    assert join.median == 40
+    assert not join.regressed()
+
+    assert "1 regression(s) over 2 steps and tests" in report(run, comparisons)
+    assert "Skuba.node_join" not in report(run, comparisons, regressions_only=True)
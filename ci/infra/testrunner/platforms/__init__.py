@@ -1,9 +1,15 @@
 from platforms.openstack import Openstack
 from platforms.vmware import VMware
 from platforms.libvirt import Libvirt
+from platforms.platform import Platform
 
 
 def get_platform(conf, platform):
+    # allow sharing an already created platform, which avoids setting up
+    # ssh again (e.g. when running checks from multiple threads)
+    if isinstance(platform, Platform):
+        return platform
+
     if platform.lower() == "openstack":
         platform = Openstack(conf)
     elif platform.lower() == "vmware":
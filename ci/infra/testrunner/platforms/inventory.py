@@ -0,0 +1,140 @@
+"""Inventory of the nodes deployed by terraform.
+
+The inventory is built from the outputs in terraform.tfstate (v3 or v4), or
+from the output of `terraform output -json` when there is no state, and saved
+to a cache file keyed by the modification time and hash of its source. Other
+processes (checks, fixtures, cli commands) load the small cache instead of
+parsing the state again, and within a process the inventory is reused while
+its source does not change.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger('testrunner')
+
+ROLES = ("master", "worker")
+
+
+class Inventory:
+    """Nodes and load balancers of a deployment.
+       nodes: dictionary with the list of (name, ip) of the nodes for each role
+       load_balancers: dictionary with the ip of each load balancer, by name
+       internal_lb: ip of the internal load balancer, if any
+    """
+
+    def __init__(self, nodes, load_balancers, internal_lb=None):
+        self.nodes = nodes
+        self.load_balancers = load_balancers
+        self.internal_lb = internal_lb
+
+    def ipaddrs(self, role):
+        if role not in ROLES:
+            raise ValueError("Invalid role: {}".format(role))
+        return [ip for _, ip in self.nodes[role]]
+
+    def names(self, role):
+        if role not in ROLES:
+            raise ValueError("Invalid role: {}".format(role))
+        return [name for name, _ in self.nodes[role]]
+
+    def lb_ipaddr(self, name):
+        return self.load_balancers.get(name)
+
+    @staticmethod
+    def from_outputs(outputs):
+        """Builds the inventory from terraform outputs, as found in the state or
+        printed by terraform output -json"""
+        def value(key):
+            output = outputs.get(key)
+            return output["value"] if output else None
+
+        nodes = {role: list((value(f"ip_{role}s") or {}).items()) for role in ROLES}
+        return Inventory(nodes, value("ip_load_balancer") or {}, value("ip_internal_load_balancer"))
+
+    @staticmethod
+    def from_tfstate(state):
+        if state["version"] == 3:
+            return Inventory.from_outputs(state["modules"][0]["outputs"])
+        elif state["version"] == 4:
+            return Inventory.from_outputs(state["outputs"])
+        raise ValueError(f"Unsupported tfstate version {state['version']}")
+
+    def to_dict(self):
+        return {"nodes": self.nodes, "load_balancers": self.load_balancers, "internal_lb": self.internal_lb}
+
+    @staticmethod
+    def from_dict(data):
+        nodes = {role: [tuple(n) for n in data["nodes"][role]] for role in ROLES}
+        return Inventory(nodes, data["load_balancers"], data["internal_lb"])
+
+
+_inventories = {}
+_inventories_lock = threading.Lock()
+
+
+def load_inventory(tfstate_path, tfjson_path, cache_path):
+    """Returns the inventory of the deployment.
+    The source is the tfstate if it exists, otherwise the terraform output json.
+    """
+    source = tfstate_path if os.path.exists(tfstate_path) else tfjson_path
+    st = os.stat(source)
+    key = (source, st.st_mtime_ns, st.st_size)
+
+    with _inventories_lock:
+        inventory = _inventories.get(key)
+        if inventory is None:
+            inventory = _load_cached(source, st, cache_path)
+            _inventories[key] = inventory
+        return inventory
+
+
+def _load_cached(source, st, cache_path):
+    cache = None
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    if cache is not None and cache["source"] == source and cache["mtime_ns"] == st.st_mtime_ns \
+            and cache["size"] == st.st_size:
+        return Inventory.from_dict(cache["inventory"])
+
+    with open(source, "rb") as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()
+
+    if cache is not None and cache["source"] == source and cache["sha256"] == digest:
+        # the source was touched but its content did not change
+        inventory = Inventory.from_dict(cache["inventory"])
+    else:
+        logger.debug("Building node inventory from {}".format(source))
+        data = json.loads(content)
+        if source.endswith(".tfstate"):
+            inventory = Inventory.from_tfstate(data)
+        else:
+            inventory = Inventory.from_outputs(data)
+
+    _save_cache(cache_path, {"source": source,
+                             "mtime_ns": st.st_mtime_ns,
+                             "size": st.st_size,
+                             "sha256": digest,
+                             "inventory": inventory.to_dict()})
+    return inventory
+
+
+def _save_cache(cache_path, cache):
+    """Writes the cache atomically, so concurrent processes never read a partial file"""
+    cache_dir = os.path.dirname(cache_path) or "."
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=".inventory-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(cache, f, separators=(",", ":"))
+        os.replace(tmp_path, cache_path)
+    except OSError as ex:
+        logger.warning(f"Could not save node inventory cache {cache_path}: {ex}")
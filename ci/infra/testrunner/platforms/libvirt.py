@@ -1,5 +1,18 @@
-from timeout_decorator import timeout
+import json
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from platforms.terraform import Terraform
+from utils import step
+from utils.deadline import timeout
+from utils.tracing import propagate_context
+
+logger = logging.getLogger('testrunner')
+
+SNAPSHOT_STAGES = ("provisioned", "bootstrapped", "deployed")
 
 
 class Libvirt(Terraform):
@@ -9,10 +22,103 @@ class Libvirt(Terraform):
             "libvirt_uri": self.conf.libvirt.uri,
             "libvirt_keyfile": self.conf.libvirt.keyfile,
         }
+        self.snapshots_dir = os.path.join(self.conf.terraform.workdir, "snapshots")
 
     def _env_setup_cmd(self):
         return ":"
 
     @timeout(600)
     def _cleanup_platform(self):
+        # domains with snapshots cannot be undefined by terraform
+        self._delete_snapshots()
+        shutil.rmtree(self.snapshots_dir, ignore_errors=True)
         self.destroy()
+
+    def _virsh(self, cmd, ignore_errors=False):
+        return self.utils.runshellcommand(f"virsh -c {self.conf.libvirt.uri} {cmd}",
+                                          ignore_errors=ignore_errors)
+
+    def _domains(self):
+        """Returns the names of the domains of the stack"""
+        stack_name = self.stack_name()
+        domains = [f"{stack_name}-{role}-domain-{i}"
+                   for role in ("master", "worker") for i in range(self.get_num_nodes(role))]
+        if self.inventory().load_balancers:
+            domains.append(f"{stack_name}-lb-domain")
+        return domains
+
+    @staticmethod
+    def _snapshot_name(stage):
+        if stage not in SNAPSHOT_STAGES:
+            raise ValueError(f"Invalid snapshot stage {stage}")
+        return f"testrunner-{stage}"
+
+    def _on_domains(self, func, domains):
+        with ThreadPoolExecutor(max_workers=len(domains)) as executor:
+            list(executor.map(propagate_context(func), domains))
+
+    def has_snapshot(self, stage):
+        return os.path.exists(os.path.join(self.snapshots_dir, f"{stage}.json"))
+
+    @step
+    def snapshot(self, stage):
+        """Saves a snapshot of all the domains, including their memory, for restoring the cluster to the stage.
+        Domains are paused while the snapshots are taken, so all nodes are saved at the same point in time."""
+        name = self._snapshot_name(stage)
+        domains = self._domains()
+        start = time.time()
+
+        self._on_domains(lambda d: self._virsh(f"suspend {d}"), domains)
+        try:
+            def create(domain):
+                self._virsh(f"snapshot-delete {domain} {name}", ignore_errors=True)
+                self._virsh(f"snapshot-create-as {domain} {name} --atomic")
+            self._on_domains(create, domains)
+        finally:
+            self._on_domains(lambda d: self._virsh(f"resume {d}"), domains)
+
+        # the cluster dir created by skuba (certificates, kubeconfig) must match the nodes
+        stage_dir = os.path.join(self.snapshots_dir, stage)
+        shutil.rmtree(stage_dir, ignore_errors=True)
+        cluster_dir = os.path.join(self.conf.skuba.workdir, self.conf.skuba.cluster)
+        if stage != "provisioned" and os.path.isdir(cluster_dir):
+            shutil.copytree(cluster_dir, os.path.join(stage_dir, self.conf.skuba.cluster))
+
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        with open(os.path.join(self.snapshots_dir, f"{stage}.json"), "w") as f:
+            json.dump({"stage": stage, "domains": domains, "created": time.time()}, f)
+        logger.info(f"Saved snapshot {stage} of {len(domains)} domains in {time.time() - start:.0f}s")
+
+    @step
+    def restore(self, stage):
+        """Reverts all the domains to the snapshot of the stage. The snapshots of the later
+        stages are deleted, as the cluster diverges from them once it is changed again"""
+        name = self._snapshot_name(stage)
+        if not self.has_snapshot(stage):
+            raise ValueError(f"No snapshot found for stage {stage}")
+
+        with open(os.path.join(self.snapshots_dir, f"{stage}.json")) as f:
+            domains = json.load(f)["domains"]
+
+        start = time.time()
+        self._on_domains(lambda d: self._virsh(f"snapshot-revert {d} {name} --running --force"), domains)
+
+        cluster_dir = os.path.join(self.conf.skuba.workdir, self.conf.skuba.cluster)
+        shutil.rmtree(cluster_dir, ignore_errors=True)
+        saved_cluster_dir = os.path.join(self.snapshots_dir, stage, self.conf.skuba.cluster)
+        if os.path.isdir(saved_cluster_dir):
+            shutil.copytree(saved_cluster_dir, cluster_dir)
+        self._delete_snapshots(SNAPSHOT_STAGES[SNAPSHOT_STAGES.index(stage) + 1:])
+        logger.info(f"Restored snapshot {stage} of {len(domains)} domains in {time.time() - start:.0f}s")
+
+    def _delete_snapshots(self, stages=SNAPSHOT_STAGES):
+        for stage in stages:
+            if not self.has_snapshot(stage):
+                continue
+            with open(os.path.join(self.snapshots_dir, f"{stage}.json")) as f:
+                domains = json.load(f)["domains"]
+            name = self._snapshot_name(stage)
+            for domain in domains:
+                self._virsh(f"snapshot-delete {domain} {name}", ignore_errors=True)
+            os.remove(os.path.join(self.snapshots_dir, f"{stage}.json"))
+            shutil.rmtree(os.path.join(self.snapshots_dir, stage), ignore_errors=True)
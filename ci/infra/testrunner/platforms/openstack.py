@@ -1,9 +1,9 @@
 import os
 import stat
 
-from timeout_decorator import timeout
 from platforms.terraform import Terraform
 from utils import Format
+from utils.deadline import timeout
 
 
 class Openstack(Terraform):
@@ -1,10 +1,10 @@
 import logging
 import os
 
-import requests
-from timeout_decorator import timeout
-
 from utils import (step, Utils)
+from utils.deadline import timeout
+from utils.httpprobe import HttpProber
+from utils.journal import JournalStreamer
 
 logger = logging.getLogger('testrunner')
 
@@ -25,6 +25,13 @@ class Platform:
         # Files that will be deleted during the cleanup stage
         self.tmp_files = []
 
+        # Journal streamed while the tests run, and nodes whose journal was streamed
+        # by a previous streamer. Nodes without entries streamed are not included
+        self.journal = None
+        self.journal_nodes = set()
+
+        self.apiserver_prober = HttpProber(timeout=conf.platform.apiserver_probe_timeout)
+
     @step
     def cleanup(self):
         """Clean up"""
@@ -36,12 +43,21 @@ class Platform:
         finally:
             self.utils.cleanup_files(self.tmp_files)
             self.utils.ssh_cleanup()
+            self.journal_nodes.clear()
 
     @timeout(600)
     @step
-    def gather_logs(self):
+    def gather_logs(self, label=None):
+        """Collect logs from nodes.
+        label identifies the test or step the logs belong to in incremental log mode.
+        Defaults to the current test, if any.
+        """
         logging_errors = False
 
+        if label is None:
+            # the test without the phase, e.g. "test_a.py::test_b (call)"
+            label = os.environ.get("PYTEST_CURRENT_TEST", "manual").rsplit(" (", 1)[0]
+
         node_ips = {
             "master": self.get_nodes_ipaddrs("master"),
             "worker": self.get_nodes_ipaddrs("worker")
@@ -54,7 +70,7 @@ class Platform:
         for node_type in node_ips:
             for ip_address in node_ips[node_type]:
                 node_log_dir = self._create_node_log_dir(ip_address, node_type, self.conf.platform.log_dir)
-                logging_error = self.utils.collect_remote_logs(ip_address, self.logs, node_log_dir)
+                logging_error = self._collect_node_logs(ip_address, self.logs, node_log_dir, label=label)
 
                 if logging_error:
                     logging_errors = logging_error
@@ -66,6 +82,62 @@ class Platform:
 
         return logging_errors
 
+    def stream_journal(self, since=None):
+        """Starts streaming the journal of the services of the nodes to their log dir.
+        Without since (seconds since the epoch), the whole journal of the services is streamed.
+        The journal of the nodes which received entries is not collected by gather_logs"""
+        self.stop_journal()
+        if not os.path.isdir(self.conf.platform.log_dir):
+            os.mkdir(self.conf.platform.log_dir)
+
+        nodes = {}
+        for node_type in ("master", "worker"):
+            for ip_address in self.get_nodes_ipaddrs(node_type):
+                nodes[ip_address] = self._create_node_log_dir(ip_address, node_type, self.conf.platform.log_dir)
+
+        self.journal = JournalStreamer(self.utils, nodes, services=self.logs["services"],
+                                       max_bytes=self.conf.platform.journal_max_bytes,
+                                       backups=self.conf.platform.journal_backups)
+        self.journal.start(since=since)
+
+    def stop_journal(self):
+        """Stops streaming the journal of the nodes, if it is being streamed"""
+        if self.journal is not None:
+            self.journal.stop()
+            self.journal_nodes.update(ip for ip, entries in self.journal.entries.items() if entries > 0)
+            self.journal = None
+
+    def _journal_streamed(self, ip_address):
+        """Returns whether entries of the journal of the node were streamed to its log dir"""
+        if ip_address in self.journal_nodes:
+            return True
+        return self.journal is not None and self.journal.entries.get(ip_address, 0) > 0
+
+    def _collect_node_logs(self, ip_address, logs, node_log_dir, label="manual"):
+        """
+        Collect logs from a node using the configured log mode
+        :param ip_address: (str) IP of the node to collect the logs from
+        :param logs: (dict: list) The different logs to collect {"files": [], "dirs": [], ""services": []}
+        :param node_log_dir: (str) Path to store the logs to
+        :param label: (str) Test or step the logs belong to. Used in incremental log mode
+        :return: (bool) True if there was an error while collecting the logs
+        """
+        if self._journal_streamed(ip_address):
+            # already streamed to the node log dir
+            logs = {**logs, "services": []}
+
+        log_mode = self.conf.platform.log_mode
+        if log_mode == "copy":
+            return self.utils.collect_remote_logs(ip_address, logs, node_log_dir)
+        if log_mode == "bundle":
+            return self.utils.collect_remote_logs_bundle(ip_address, logs, node_log_dir,
+                                                         compression=self.conf.platform.log_compression,
+                                                         extract=self.conf.platform.log_extract)
+        if log_mode == "incremental":
+            return self.utils.collect_remote_logs_incremental(ip_address, logs, node_log_dir, label)
+
+        raise ValueError(f"Invalid log mode '{log_mode}'")
+
     def get_lb_ipaddr(self):
         """
         Get the IP of the Load Balancer
@@ -110,12 +182,12 @@ class Platform:
 
         self._provision_platform(num_master, num_worker)
 
-    def ssh_run(self, role, nr, cmd):
+    def ssh_run(self, role, nr, cmd, stdin=None):
         ip_addrs = self.get_nodes_ipaddrs(role)
         if nr >= len(ip_addrs):
             raise ValueError(f'Node {role}-{nr} not deployed in platform')
 
-        return self.utils.ssh_run(ip_addrs[nr], cmd)
+        return self.utils.ssh_run(ip_addrs[nr], cmd, stdin=stdin)
 
     @staticmethod
     def _create_node_log_dir(ip_address, node_type, log_dir_path):
@@ -143,15 +215,25 @@ class Platform:
 
     def all_apiservers_responsive(self):
         """Check if all apiservers are responsive to make sure the load balancer can function correctly"""
-        ip_addrs = self.get_nodes_ipaddrs("master")
-        for ip in ip_addrs:
-            try:
-                response = requests.get("https://{}:6443/healthz".format(ip), verify=False)
-            except requests.exceptions.RequestException:
-                return False
-            if response.status_code != 200:
-                return False
-        return True
+        urls = [self._apiserver_healthz_url(ip) for ip in self.get_nodes_ipaddrs("master")]
+        return all(self.apiserver_prober.probe_all(urls).values())
+
+    def apiserver_stats(self, role, nr):
+        """Returns the EndpointStats of the probes to the apiserver of a master node"""
+        ip = self.get_nodes_ipaddrs(role)[nr]
+        return self.apiserver_prober.stats(self._apiserver_healthz_url(ip))
+
+    @staticmethod
+    def _apiserver_healthz_url(ip):
+        return "https://{}:6443/healthz".format(ip)
 
     def setup_cloud_provider(self):
         raise ValueError("Cloud provider is not supported for this platform")
+
+    def snapshot(self, stage):
+        """Saves the state of all the nodes, for restoring the cluster to the given stage"""
+        raise ValueError("Snapshots are not supported for this platform")
+
+    def restore(self, stage):
+        """Restores all the nodes to the snapshot saved for the given stage"""
+        raise ValueError("Snapshots are not supported for this platform")
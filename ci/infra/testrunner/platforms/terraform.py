@@ -5,6 +5,7 @@ from urllib.parse import urlparse
 
 import hcl
 
+from platforms.inventory import load_inventory
 from platforms.platform import Platform
 from utils import (Format, step, Utils)
 
@@ -20,15 +21,16 @@ class Terraform(Platform):
         self.tfdir = os.path.join(self.conf.terraform.tfdir, platform)
         self.tfjson_path = os.path.join(self.conf.terraform.workdir, "tfout.json")
         self.tfout_path = os.path.join(self.conf.terraform.workdir, "tfout")
+        self.inventory_path = os.path.join(self.conf.terraform.workdir, "inventory.json")
         self.utils = Utils(conf)
-        self.state = None
 
         self.logs["files"] += ["/var/run/cloud-init/status.json",
                                "/var/log/cloud-init-output.log",
                                "/var/log/cloud-init.log"]
 
         self.tmp_files = [self.tfout_path,
-                          self.tfjson_path]
+                          self.tfjson_path,
+                          self.inventory_path]
 
     def destroy(self, variables=[]):
         self._tf_init()
@@ -83,19 +85,13 @@ class Terraform(Platform):
         if exception:
             raise exception
 
-    def _load_tfstate(self):
-        if self.state is None:
-            fn = os.path.join(self.tfdir, "terraform.tfstate")
-            logger.debug("Reading configuration from {}".format(fn))
-            with open(fn) as f:
-                self.state = json.load(f)
+    def inventory(self):
+        """Returns the inventory of the deployed nodes (see platforms.inventory)"""
+        return load_inventory(os.path.join(self.tfdir, "terraform.tfstate"), self.tfjson_path,
+                              self.inventory_path)
 
     def get_lb_ipaddr(self):
-        self._load_tfstate()
-        if self.state["version"] == 3:
-            return self.state["modules"][0]["outputs"]["ip_load_balancer"]["value"]["{}-lb".format(self.stack_name())]
-        elif self.state["version"] == 4:
-            return self.state["outputs"]["ip_load_balancer"]["value"]["{}-lb".format(self.stack_name())]
+        return self.inventory().lb_ipaddr("{}-lb".format(self.stack_name()))
 
     def get_num_nodes(self, role):
         return len(self.get_nodes_ipaddrs(role))
@@ -105,22 +101,7 @@ class Terraform(Platform):
         return [f'caasp-{role}-{stack_name}-{i}' for i in range(self.get_num_nodes(role))]
 
     def get_nodes_ipaddrs(self, role):
-        self._load_tfstate()
-
-        if role not in ("master", "worker"):
-            raise ValueError("Invalid role: {}".format(role))
-
-        role_key = "ip_" + role + "s"
-        if self.state["version"] == 3:
-            # check if output actually contains the role's values
-            if not self.state["modules"][0]["outputs"][role_key]:
-                return []
-            return list(self.state["modules"][0]["outputs"][role_key]["value"].values())
-        elif self.state["version"] == 4:
-            # check if output actually contains the role's values
-            if not self.state["outputs"][role_key]:
-                return []
-            return list(self.state["outputs"][role_key]["value"].values())
+        return self.inventory().ipaddrs(role)
 
     @step
     def _fetch_terraform_output(self):
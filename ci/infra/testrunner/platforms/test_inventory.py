@@ -0,0 +1,53 @@
+import json
+import os
+
+from platforms import inventory
+from platforms.inventory import load_inventory
+
+OUTPUTS = {
+    "ip_masters": {"value": {"caasp-master-0": "10.0.0.1"}},
+    "ip_workers": {"value": {"caasp-worker-0": "10.0.0.2", "caasp-worker-1": "10.0.0.3"}},
+    "ip_load_balancer": {"value": {"stack-lb": "10.0.0.10"}},
+}
+
+
+def test_inventory_from_tfstate(tmp_path):
+    """Test the inventory is built from v3 and v4 states
+    """
+    for state in ({"version": 3, "modules": [{"outputs": OUTPUTS}]},
+                  {"version": 4, "outputs": OUTPUTS}):
+        tfstate = tmp_path / f"v{state['version']}.tfstate"
+        tfstate.write_text(json.dumps(state))
+        inv = load_inventory(str(tfstate), str(tmp_path / "tfout.json"), str(tmp_path / "inventory.json"))
+        assert inv.ipaddrs("master") == ["10.0.0.1"]
+        assert inv.names("worker") == ["caasp-worker-0", "caasp-worker-1"]
+        assert inv.lb_ipaddr("stack-lb") == "10.0.0.10"
+
+
+def test_inventory_cache(tmp_path):
+    """Test the cache is used by other processes and invalidated when the state changes
+    """
+    tfstate = tmp_path / "terraform.tfstate"
+    cache = tmp_path / "inventory.json"
+    tfstate.write_text(json.dumps({"version": 4, "outputs": OUTPUTS}))
+    args = (str(tfstate), str(tmp_path / "tfout.json"), str(cache))
+
+    load_inventory(*args)
+    assert load_inventory(*args) is load_inventory(*args)
+
+    # a new process loads the cache, without parsing the state
+    inventory._inventories.clear()
+    saved = json.loads(cache.read_text())
+    saved["inventory"]["nodes"]["master"] = [["from-cache", "10.0.0.99"]]
+    cache.write_text(json.dumps(saved))
+    assert load_inventory(*args).ipaddrs("master") == ["10.0.0.99"]
+
+    # touching the state without changing it keeps the cache
+    st = os.stat(tfstate)
+    os.utime(tfstate, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert load_inventory(*args).ipaddrs("master") == ["10.0.0.99"]
+
+    outputs = {**OUTPUTS, "ip_workers": {"value": {}}}
+    tfstate.write_text(json.dumps({"version": 4, "outputs": outputs}))
+    assert load_inventory(*args).ipaddrs("worker") == []
+    assert load_inventory(*args).ipaddrs("master") == ["10.0.0.1"]
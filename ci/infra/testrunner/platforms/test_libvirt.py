@@ -0,0 +1,95 @@
+import json
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from platforms.libvirt import Libvirt
+from utils import BaseConfig, Utils
+
+
+@pytest.fixture
+def libvirt(tmp_path, monkeypatch):
+    """Libvirt platform with 1 master, 2 workers and a load balancer, recording
+    the virsh commands instead of executing them"""
+    commands = []
+    lock = threading.Lock()
+
+    def runshellcommand(self, cmd, ignore_errors=False):
+        with lock:
+            commands.append(cmd)
+
+    monkeypatch.setattr(Utils, "setup_ssh", lambda self: None)
+    monkeypatch.setattr(Utils, "runshellcommand", runshellcommand)
+
+    vars_yaml = tmp_path / "vars.yaml"
+    vars_yaml.write_text(f"libvirt:\n  uri: qemu:///system\n"
+                         f"skuba:\n  workdir: {tmp_path}\n"
+                         f"terraform:\n  stack_name: ci\n  workdir: {tmp_path}\n")
+    platform = Libvirt(BaseConfig(str(vars_yaml)))
+    platform.get_num_nodes = lambda role: {"master": 1, "worker": 2}[role]
+    platform.inventory = lambda: SimpleNamespace(load_balancers=["ci-lb"])
+    platform.commands = commands
+    return platform
+
+
+def virsh(platform, cmd):
+    return [c.split(" ", 4)[4] for c in platform.commands if c.startswith("virsh") and f" {cmd} " in c]
+
+
+def test_snapshot(libvirt, tmp_path):
+    """Test all the domains are paused while they are saved, and the stage
+    is recorded with the domains and the cluster dir
+    """
+    cluster_dir = tmp_path / libvirt.conf.skuba.cluster
+    cluster_dir.mkdir()
+    (cluster_dir / "admin.conf").write_text("bootstrapped")
+
+    assert not libvirt.has_snapshot("bootstrapped")
+    libvirt.snapshot("bootstrapped")
+
+    domains = ["ci-master-domain-0", "ci-worker-domain-0", "ci-worker-domain-1", "ci-lb-domain"]
+    assert sorted(virsh(libvirt, "snapshot-create-as")) == sorted(
+        f"{d} testrunner-bootstrapped --atomic" for d in domains)
+    assert libvirt.commands[0].startswith("virsh -c qemu:///system suspend ")
+    assert libvirt.commands[-1].startswith("virsh -c qemu:///system resume ")
+    assert sorted(virsh(libvirt, "resume")) == sorted(domains)
+
+    assert libvirt.has_snapshot("bootstrapped")
+    with open(os.path.join(libvirt.snapshots_dir, "bootstrapped.json")) as f:
+        assert json.load(f)["domains"] == domains
+    saved = os.path.join(libvirt.snapshots_dir, "bootstrapped", libvirt.conf.skuba.cluster, "admin.conf")
+    assert open(saved).read() == "bootstrapped"
+
+    with pytest.raises(ValueError):
+        libvirt.snapshot("upgraded")
+
+
+def test_restore(libvirt, tmp_path):
+    """Test restoring a stage reverts the domains and the cluster dir, and deletes
+    the snapshots of the later stages
+    """
+    cluster_dir = tmp_path / libvirt.conf.skuba.cluster
+    cluster_dir.mkdir()
+    for stage in ("provisioned", "bootstrapped", "deployed"):
+        (cluster_dir / "admin.conf").write_text(stage)
+        libvirt.snapshot(stage)
+
+    libvirt.commands.clear()
+    libvirt.restore("bootstrapped")
+
+    assert len(virsh(libvirt, "snapshot-revert")) == 4
+    assert all(c.endswith(" testrunner-bootstrapped --running --force")
+               for c in virsh(libvirt, "snapshot-revert"))
+    assert (cluster_dir / "admin.conf").read_text() == "bootstrapped"
+
+    assert sorted(virsh(libvirt, "snapshot-delete")) == sorted(
+        f"{d} testrunner-deployed" for d in ("ci-master-domain-0", "ci-worker-domain-0",
+                                             "ci-worker-domain-1", "ci-lb-domain"))
+    assert [s for s in ("provisioned", "bootstrapped", "deployed") if libvirt.has_snapshot(s)] == [
+        "provisioned", "bootstrapped"]
+    assert not os.path.exists(os.path.join(libvirt.snapshots_dir, "deployed"))
+
+    with pytest.raises(ValueError):
+        libvirt.restore("deployed")
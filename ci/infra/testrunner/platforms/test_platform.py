@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+
+from platforms.platform import Platform
+
+
+class FakeUtils:
+    """Records the services of the logs collected from each node"""
+
+    def __init__(self):
+        self.collected = {}
+
+    def collect_remote_logs(self, ip_address, logs, node_log_dir):
+        self.collected[ip_address] = logs["services"]
+
+    def cleanup_files(self, files):
+        pass
+
+    def ssh_cleanup(self):
+        pass
+
+
+class FakeJournal:
+    def __init__(self, entries):
+        self.entries = entries
+
+    def stop(self):
+        pass
+
+
+def test_journal_of_nodes_without_entries_collected():
+    """Test the journal is only excluded from the logs of the nodes whose journal was
+    streamed, and streaming is forgotten when the platform is cleaned up
+    """
+    platform = Platform.__new__(Platform)
+    platform.conf = SimpleNamespace(platform=SimpleNamespace(log_mode="copy"))
+    platform.utils = FakeUtils()
+    platform.logs = {"files": [], "dirs": [], "services": ["kubelet"]}
+    platform.tmp_files = []
+    platform.journal_nodes = set()
+    platform._cleanup_platform = lambda: None
+
+    def collect():
+        for ip_address in ("10.0.0.1", "10.0.0.2"):
+            platform._collect_node_logs(ip_address, platform.logs, "/logs")
+        return platform.utils.collected
+
+    # the stream of 10.0.0.2 never connected
+    platform.journal = FakeJournal({"10.0.0.1": 5})
+    assert collect() == {"10.0.0.1": [], "10.0.0.2": ["kubelet"]}
+
+    platform.stop_journal()
+    assert platform.journal_nodes == {"10.0.0.1"}
+    assert collect() == {"10.0.0.1": [], "10.0.0.2": ["kubelet"]}
+
+    platform.cleanup()
+    assert collect() == {"10.0.0.1": ["kubelet"], "10.0.0.2": ["kubelet"]}
@@ -1,9 +1,8 @@
 import os
 
-from timeout_decorator import timeout
-
 from platforms.terraform import Terraform
 from utils import Format
+from utils.deadline import timeout
 
 
 class VMware(Terraform):
@@ -36,13 +35,9 @@ class VMware(Terraform):
         }
 
         node_log_dir = self._create_node_log_dir(node_ip, "load_balancer", self.conf.platform.log_dir)
-        logging_error = self.utils.collect_remote_logs(node_ip, logs, node_log_dir)
+        logging_error = self._collect_node_logs(node_ip, logs, node_log_dir)
 
         return logging_error
 
     def get_lb_ipaddr(self):
-        self._load_tfstate()
-        if self.state["version"] == 3:
-            return self.state["modules"][0]["outputs"]["ip_load_balancer"]["value"]["{}-lb-0".format(self.stack_name())]
-        elif self.state["version"] == 4:
-            return self.state["outputs"]["ip_load_balancer"]["value"]["{}-lb-0".format(self.stack_name())]
+        return self.inventory().lb_ipaddr("{}-lb-0".format(self.stack_name()))
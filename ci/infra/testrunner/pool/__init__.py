@@ -0,0 +1 @@
+from pool.pool import ClusterPool, Lease, copy_terraform_files, stack_conf, stack_env
@@ -0,0 +1,501 @@
+"""Pool of pre-provisioned clusters.
+
+The pool keeps a number of provisioned (and optionally bootstrapped) stacks
+for each platform and topology, so jobs don't have to wait for provisioning
+before running their tests. All the state is kept in files under the pool
+directory, which can be shared by testrunner processes in the same host:
+
+    <pool dir>/<platform>-<masters>m<workers>w[-bootstrapped]/
+        metrics.jsonl        acquire, release and provisioning events
+        <cluster id>/
+            state.json       provisioning, ready or failed
+            lease.json       present while the cluster is leased
+            tf/              copy of the terraform files for the stack
+            test-cluster/    skuba cluster dir, if bootstrapped
+
+A lease is taken by creating lease.json exclusively, and expires after
+lease_ttl seconds unless renewed. Clusters are destroyed when released
+(unless they are returned clean), when their lease expires or if their
+provisioning failed, and the pool is refilled in the background.
+
+The provisioning of a cluster holds a lock on provision.lock in its
+directory, so it is never reaped while in flight. The process waits for the
+background provisioning before exiting, and cancelling it kills the
+commands it runs (see wait_refill).
+"""
+
+import fcntl
+import json
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import platforms
+from skuba import Skuba
+from utils import BaseConfig
+from utils import deadline
+from utils.deadline import DeadlineExceeded
+
+logger = logging.getLogger('testrunner')
+
+PROVISIONING = "provisioning"
+READY = "ready"
+FAILED = "failed"
+DESTROYING = "destroying"
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _deploy(conf, platform):
+    Skuba(conf, platform).cluster_deploy()
+
+
+def stack_conf(conf, prefix, workdir, masters=None, workers=None):
+    """Returns a copy of the configuration for a separate stack, named after the
+    configured one with the given prefix, with all its files under workdir"""
+    conf = BaseConfig.copy(conf)
+    conf.terraform.stack_name = f"{prefix}-{conf.terraform.stack_name}"
+    conf.terraform.workdir = workdir
+    conf.terraform.tfdir = os.path.join(workdir, "tf")
+    if masters is not None:
+        conf.terraform.master.count = masters
+    if workers is not None:
+        conf.terraform.worker.count = workers
+    conf.skuba.workdir = workdir
+    conf.kubectl.kubeconfig = os.path.join(workdir, conf.skuba.cluster, "admin.conf")
+    conf.platform.log_dir = os.path.join(workdir, "platform_logs")
+    # each stack runs its own ssh-agent. The socket is kept next to the configured one,
+    # as the path of a unix socket under the workdir may exceed its maximum length
+    conf.utils.ssh_sock = f"{conf.utils.ssh_sock}-{conf.terraform.stack_name}"
+    return conf
+
+
+def stack_env(conf):
+    """Returns the environment variables which point the testrunner
+    configuration to the stack of the configuration"""
+    return {
+        "TERRAFORM_STACK_NAME": conf.terraform.stack_name,
+        "TERRAFORM_WORKDIR": conf.terraform.workdir,
+        "TERRAFORM_TFDIR": conf.terraform.tfdir,
+        "SKUBA_WORKDIR": conf.skuba.workdir,
+        "KUBECTL_KUBECONFIG": conf.kubectl.kubeconfig,
+        "PLATFORM_LOG_DIR": conf.platform.log_dir,
+        "UTILS_SSH_SOCK": conf.utils.ssh_sock,
+    }
+
+
+def copy_terraform_files(conf, stack, platform):
+    """Copies the terraform files of the platform to the tfdir of a stack configuration,
+    without the state and variables of the stack they were copied from"""
+    tf_source = os.path.join(conf.terraform.tfdir, platform)
+    if os.path.isdir(tf_source):
+        shutil.copytree(tf_source, os.path.join(stack.terraform.tfdir, platform),
+                        ignore=shutil.ignore_patterns(".terraform", "*.tfstate*", "terraform.tfvars.json"))
+
+
+class Lease:
+    """Lease of a cluster of the pool.
+       cluster_id: id of the leased cluster
+       token: secret identifying the lease holder
+       conf: configuration for using the cluster (stack name, workdirs, kubeconfig)
+    """
+
+    def __init__(self, cluster_id, token, conf, acquired, expires):
+        self.cluster_id = cluster_id
+        self.token = token
+        self.conf = conf
+        self.acquired = acquired
+        self.expires = expires
+
+    def __str__(self):
+        return f"{self.cluster_id}:{self.token}"
+
+    def env(self):
+        """Returns the environment variables which point the testrunner
+        configuration to the leased cluster"""
+        return {**stack_env(self.conf), "POOL_LEASE": str(self)}
+
+
+class PoolStats:
+    """Metrics of a pool.
+       hits: leases obtained without waiting for a cluster to be provisioned
+       misses: leases which had to wait for a cluster
+       timeouts: acquisitions which did not obtain a cluster in time
+       waits: time waited by each acquisition
+       clusters: number of clusters in each state (provisioning, ready, leased, failed)
+    """
+
+    def __init__(self, hits, misses, timeouts, waits, clusters):
+        self.hits = hits
+        self.misses = misses
+        self.timeouts = timeouts
+        self.waits = waits
+        self.clusters = clusters
+
+    def hit_rate(self):
+        total = self.hits + self.misses + self.timeouts
+        return self.hits / total if total else None
+
+    def mean_wait(self):
+        return sum(self.waits) / len(self.waits) if self.waits else 0
+
+    def __str__(self):
+        hit_rate = self.hit_rate()
+        return ("clusters: {}\nacquired: {} (hits: {}, misses: {}, timeouts: {})\n"
+                "hit rate: {}\nwait: mean {:.0f}s, max {:.0f}s").format(
+            ", ".join(f"{status}={count}" for status, count in sorted(self.clusters.items())),
+            self.hits + self.misses, self.hits, self.misses, self.timeouts,
+            f"{hit_rate * 100:.0f}%" if hit_rate is not None else "-",
+            self.mean_wait(), max(self.waits, default=0))
+
+
+class ClusterPool:
+    """Pool of clusters for a platform and topology.
+       conf: testrunner configuration. The pool section sets the defaults
+       platform: name of the platform (e.g. openstack)
+       masters, workers: number of nodes of the clusters
+       bootstrap: deploy the clusters with skuba after provisioning them
+       size: number of clusters kept available (ready or being provisioned)
+       lease_ttl: seconds after which a lease expires if not renewed
+       platform_factory: function returning the platform for a configuration.
+                         Defaults to platforms.get_platform
+       deployer: function deploying the cluster given the configuration and platform.
+                 Defaults to Skuba.cluster_deploy
+    """
+
+    def __init__(self, conf, platform, masters=1, workers=1, bootstrap=None, size=None, lease_ttl=None,
+                 platform_factory=None, deployer=None, clock=time.time, sleep=time.sleep):
+        self.conf = conf
+        self.platform = platform
+        self.masters = masters
+        self.workers = workers
+        self.bootstrap = conf.pool.bootstrap if bootstrap is None else bootstrap
+        self.size = conf.pool.size if size is None else size
+        self.lease_ttl = conf.pool.lease_ttl if lease_ttl is None else lease_ttl
+        self.platform_factory = platform_factory or (lambda c: platforms.get_platform(c, platform))
+        self.deployer = deployer or _deploy
+        self.clock = clock
+        self.sleep = sleep
+        self.key = f"{platform}-{masters}m{workers}w{'-bootstrapped' if self.bootstrap else ''}"
+        self.dir = os.path.join(conf.pool.dir, self.key)
+        self._threads = []
+        self._threads_lock = threading.Lock()
+        # deadline of the provisioning in background, cancelled to abort it
+        self._refill_deadline = deadline.Deadline()
+        os.makedirs(self.dir, exist_ok=True)
+
+    def _cluster_dir(self, cluster_id):
+        return os.path.join(self.dir, cluster_id)
+
+    def _state_path(self, cluster_id):
+        return os.path.join(self._cluster_dir(cluster_id), "state.json")
+
+    def _lease_path(self, cluster_id):
+        return os.path.join(self._cluster_dir(cluster_id), "lease.json")
+
+    def _provision_lock_path(self, cluster_id):
+        return os.path.join(self._cluster_dir(cluster_id), "provision.lock")
+
+    @contextmanager
+    def _locked(self):
+        """Serializes changes to the set of clusters among processes"""
+        with open(os.path.join(self.dir, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _in_flight(self, cluster_id):
+        """Marks the cluster as being provisioned by this process"""
+        with open(self._provision_lock_path(cluster_id), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _is_in_flight(self, cluster_id):
+        """Returns whether a process in this host is provisioning the cluster"""
+        try:
+            with open(self._provision_lock_path(cluster_id)) as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        except FileNotFoundError:
+            return False
+        except BlockingIOError:
+            return True
+        return False
+
+    def cluster_conf(self, cluster_id):
+        """Returns the configuration for the stack of a cluster of the pool"""
+        return stack_conf(self.conf, f"pool{cluster_id}", self._cluster_dir(cluster_id),
+                          masters=self.masters, workers=self.workers)
+
+    def clusters(self):
+        """Returns the state of the clusters in the pool, including whether they are leased"""
+        clusters = []
+        for cluster_id in sorted(os.listdir(self.dir)):
+            state = _read_json(self._state_path(cluster_id))
+            if state is None:
+                continue
+            state["leased"] = os.path.exists(self._lease_path(cluster_id))
+            clusters.append(state)
+        return clusters
+
+    def _record(self, event, **fields):
+        line = json.dumps({"event": event, "time": self.clock(), **fields})
+        with open(os.path.join(self.dir, "metrics.jsonl"), "a") as f:
+            f.write(line + "\n")
+
+    def refill(self, wait=False):
+        """Provisions clusters until size clusters are available. Provisioning runs in
+        background threads, unless wait is True. Returns the ids of the new clusters"""
+        with self._locked():
+            available = [c for c in self.clusters() if c["status"] in (PROVISIONING, READY) and not c["leased"]]
+            new_ids = []
+            for _ in range(self.size - len(available)):
+                cluster_id = uuid.uuid4().hex[:6]
+                os.makedirs(self._cluster_dir(cluster_id))
+                _write_json(self._state_path(cluster_id), {
+                    "id": cluster_id, "status": PROVISIONING, "created": self.clock(),
+                    "host": socket.gethostname(), "pid": os.getpid()})
+                new_ids.append(cluster_id)
+
+        # not daemon threads: the process waits for the provisioning before exiting,
+        # instead of leaving terraform running on a stack a later reap destroys
+        threads = [threading.Thread(target=self._provision, args=(cluster_id, self._refill_deadline),
+                                    name=f"pool-provision-{cluster_id}")
+                   for cluster_id in new_ids]
+        with self._threads_lock:
+            for thread in threads:
+                thread.start()
+            self._threads += threads
+        if wait:
+            self.wait_refill()
+        return new_ids
+
+    def wait_refill(self, cancel=False):
+        """Waits for the clusters being provisioned by this process. If cancel is True,
+        or the wait is interrupted, the provisioning is cancelled, killing the commands
+        it runs, and the clusters are left failed for reap to destroy them"""
+        with self._threads_lock:
+            threads, self._threads = self._threads, []
+        if cancel:
+            self._cancel_refill()
+        try:
+            for thread in threads:
+                thread.join()
+        except BaseException:
+            self._cancel_refill()
+            for thread in threads:
+                thread.join()
+            raise
+
+    def _cancel_refill(self):
+        logger.warning(f"Cancelling the provisioning of clusters for pool {self.key}")
+        self._refill_deadline.cancel()
+        self._refill_deadline = deadline.Deadline()
+
+    def _provision(self, cluster_id, refill_deadline):
+        with self._in_flight(cluster_id), deadline.using(refill_deadline):
+            self._provision_cluster(cluster_id)
+
+    def _provision_cluster(self, cluster_id):
+        start = self.clock()
+        state = _read_json(self._state_path(cluster_id))
+        logger.info(f"Provisioning cluster {cluster_id} for pool {self.key}")
+        try:
+            # the provisioning is not started if the refill was cancelled meanwhile
+            deadline.current().check()
+            conf = self.cluster_conf(cluster_id)
+            copy_terraform_files(self.conf, conf, self.platform)
+            platform = self.platform_factory(conf)
+            platform.provision(num_master=self.masters, num_worker=self.workers)
+            if self.bootstrap:
+                self.deployer(conf, platform)
+            state.update(status=READY, ready=self.clock())
+            self._record("provisioned", cluster=cluster_id, elapsed=self.clock() - start)
+        except Exception as ex:
+            logger.error(f"Failed provisioning cluster {cluster_id} for pool {self.key}: {ex}")
+            state.update(status=FAILED, error=str(ex))
+            self._record("failed", cluster=cluster_id, elapsed=self.clock() - start)
+        _write_json(self._state_path(cluster_id), state)
+
+    def _try_lease(self, cluster_id, owner):
+        now = self.clock()
+        lease = {"owner": owner, "token": uuid.uuid4().hex, "acquired": now, "expires": now + self.lease_ttl}
+        try:
+            fd = os.open(self._lease_path(cluster_id), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return None
+        with os.fdopen(fd, "w") as f:
+            json.dump(lease, f)
+        return Lease(cluster_id, lease["token"], self.cluster_conf(cluster_id), now, lease["expires"])
+
+    def acquire(self, timeout=3600, owner=None, refill=True, poll_interval=None):
+        """Leases a ready cluster, waiting up to timeout seconds for one to be provisioned.
+        If refill is True, missing clusters are provisioned in the background.
+        Raises DeadlineExceeded if no cluster is available in time.
+        """
+        if poll_interval is None:
+            poll_interval = self.conf.pool.poll_interval
+        if owner is None:
+            owner = f"{socket.gethostname()}:{os.getpid()}"
+
+        start = self.clock()
+        self.reap()
+        first = True
+        while True:
+            lease = self._lease_ready(owner)
+            if lease is not None:
+                waited = self.clock() - start
+                self._record("acquire", cluster=lease.cluster_id, hit=first, wait=waited)
+                logger.info(f"Leased cluster {lease.cluster_id} from pool {self.key} after {waited:.0f}s")
+                if refill:
+                    self.refill()
+                return lease
+
+            if refill and first:
+                self.refill()
+            first = False
+
+            if self.clock() - start >= timeout:
+                self._record("timeout", wait=self.clock() - start)
+                raise DeadlineExceeded(f"no cluster available in pool {self.key} after {timeout}s")
+            self.sleep(poll_interval)
+
+    def _lease_ready(self, owner):
+        """Leases a ready cluster, if any. The lock keeps reap from marking the
+        cluster as destroyed while it is being leased"""
+        with self._locked():
+            for cluster in self.clusters():
+                if cluster["status"] == READY and not cluster["leased"]:
+                    lease = self._try_lease(cluster["id"], owner)
+                    if lease is not None:
+                        return lease
+        return None
+
+    def _check_lease(self, lease):
+        current = _read_json(self._lease_path(lease.cluster_id))
+        if current is None or current["token"] != lease.token:
+            raise ValueError(f"lease {lease.cluster_id} expired or held by another owner")
+        return current
+
+    def renew(self, lease):
+        """Extends the lease for another lease_ttl seconds"""
+        current = self._check_lease(lease)
+        current["expires"] = lease.expires = self.clock() + self.lease_ttl
+        _write_json(self._lease_path(lease.cluster_id), current)
+
+    def release(self, lease, destroy=True, refill=True):
+        """Returns the cluster to the pool. Clusters are destroyed unless destroy
+        is False, which must only be used if the tests left the cluster clean"""
+        self._check_lease(lease)
+        self._record("release", cluster=lease.cluster_id, held=self.clock() - lease.acquired, destroyed=destroy)
+        if destroy:
+            self._destroy(lease.cluster_id)
+        else:
+            os.remove(self._lease_path(lease.cluster_id))
+        if refill:
+            self.refill()
+
+    def lease_from_string(self, value):
+        """Returns the lease for a string as printed by str(lease)"""
+        cluster_id, token = value.split(":", 1)
+        current = _read_json(self._lease_path(cluster_id))
+        if current is None or current["token"] != token:
+            raise ValueError(f"lease {cluster_id} expired or held by another owner")
+        return Lease(cluster_id, token, self.cluster_conf(cluster_id), current["acquired"], current["expires"])
+
+    def _destroy(self, cluster_id):
+        logger.info(f"Destroying cluster {cluster_id} from pool {self.key}")
+        try:
+            self.platform_factory(self.cluster_conf(cluster_id)).cleanup()
+        except Exception as ex:
+            logger.warning(f"Error destroying cluster {cluster_id}: {ex}")
+        shutil.rmtree(self._cluster_dir(cluster_id), ignore_errors=True)
+
+    def reap(self):
+        """Destroys the clusters with an expired lease, a failed provisioning or
+        whose provisioning was interrupted. Returns the ids of the destroyed clusters"""
+        now = self.clock()
+        host = socket.gethostname()
+        reaped = []
+        with self._locked():
+            # mark the clusters while holding the lock and destroy them after
+            # releasing it, so other processes are not blocked meanwhile
+            for cluster in self.clusters():
+                lease = _read_json(self._lease_path(cluster["id"])) if cluster["leased"] else None
+                if lease is not None and lease["expires"] < now:
+                    reason = "lease expired"
+                elif cluster["status"] == FAILED:
+                    reason = "provisioning failed"
+                elif (cluster["status"] == PROVISIONING and cluster["host"] == host
+                      and not _pid_alive(cluster["pid"]) and not self._is_in_flight(cluster["id"])):
+                    reason = "provisioning interrupted"
+                else:
+                    continue
+                logger.info(f"Reaping cluster {cluster['id']} from pool {self.key}: {reason}")
+                cluster.pop("leased")
+                cluster.update(status=DESTROYING, reason=reason)
+                _write_json(self._state_path(cluster["id"]), cluster)
+                reaped.append(cluster["id"])
+
+        for cluster_id in reaped:
+            self._destroy(cluster_id)
+        return reaped
+
+    def stats(self):
+        """Returns the PoolStats computed from the recorded events"""
+        hits, misses, timeouts, waits = 0, 0, 0, []
+        try:
+            with open(os.path.join(self.dir, "metrics.jsonl")) as f:
+                events = [json.loads(line) for line in f if line.strip()]
+        except OSError:
+            events = []
+        for event in events:
+            if event["event"] == "acquire":
+                if event["hit"]:
+                    hits += 1
+                else:
+                    misses += 1
+                waits.append(event["wait"])
+            elif event["event"] == "timeout":
+                timeouts += 1
+                waits.append(event["wait"])
+
+        clusters = {}
+        for cluster in self.clusters():
+            status = "leased" if cluster["leased"] else cluster["status"]
+            clusters[status] = clusters.get(status, 0) + 1
+        return PoolStats(hits, misses, timeouts, waits, clusters)
@@ -0,0 +1,166 @@
+import threading
+
+import pytest
+
+from pool.pool import ClusterPool, stack_conf, stack_env
+from utils import BaseConfig
+from utils import deadline
+from utils.deadline import DeadlineExceeded
+
+
+class FakePlatform:
+    """Platform which records the stacks provisioned and destroyed"""
+
+    provisioned = []
+    destroyed = []
+    fail = False
+    gate = None
+
+    def __init__(self, conf):
+        self.conf = conf
+
+    def provision(self, num_master=-1, num_worker=-1):
+        if FakePlatform.gate is not None:
+            # waits like a command, which is killed if the provisioning is cancelled
+            while not FakePlatform.gate.wait(0.01):
+                deadline.current().check()
+        if FakePlatform.fail:
+            raise Exception("quota exceeded")
+        FakePlatform.provisioned.append(self.conf.terraform.stack_name)
+
+    def cleanup(self):
+        FakePlatform.destroyed.append(self.conf.terraform.stack_name)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def pool(tmp_path):
+    FakePlatform.provisioned, FakePlatform.destroyed = [], []
+    FakePlatform.fail, FakePlatform.gate = False, None
+    vars_yaml = tmp_path / "vars.yaml"
+    vars_yaml.write_text(f"pool:\n  dir: {tmp_path}/pool\nterraform:\n  stack_name: ci\n")
+    conf = BaseConfig(str(vars_yaml))
+
+    def make_pool(**kwargs):
+        clock = FakeClock()
+        return ClusterPool(conf, "openstack", masters=1, workers=2, size=2, lease_ttl=3600,
+                           platform_factory=FakePlatform, clock=clock.clock, sleep=clock.sleep, **kwargs)
+    return make_pool
+
+
+def test_acquire_and_release(pool):
+    """Test clusters are leased exclusively and replaced after being released
+    """
+    p = pool()
+    p.refill(wait=True)
+    assert len(FakePlatform.provisioned) == 2
+
+    first = p.acquire(refill=False)
+    # another process sharing the pool dir gets the other cluster
+    second = pool().acquire(refill=False)
+    assert first.cluster_id != second.cluster_id
+    assert first.conf.terraform.stack_name == f"pool{first.cluster_id}-ci"
+    assert first.env()["KUBECTL_KUBECONFIG"].endswith(f"{first.cluster_id}/test-cluster/admin.conf")
+
+    p.release(first, refill=False)
+    assert FakePlatform.destroyed == [first.conf.terraform.stack_name]
+    p.release(second, destroy=False, refill=False)
+    assert [c["id"] for c in p.clusters() if not c["leased"]] == [second.cluster_id]
+
+    p.refill(wait=True)
+    assert len(p.clusters()) == 2
+
+    stats = p.stats()
+    assert stats.hits == 2
+    assert stats.hit_rate() == 1
+    assert stats.clusters == {"ready": 2}
+
+
+def test_acquire_waits_for_provisioning(pool):
+    """Test a miss is recorded when the pool is empty and the acquisition
+    times out if no cluster becomes ready
+    """
+    FakePlatform.gate = threading.Event()
+    p = pool()
+    with pytest.raises(DeadlineExceeded):
+        p.acquire(timeout=60, poll_interval=10)
+
+    FakePlatform.gate.set()
+    p.wait_refill()
+    lease = p.acquire(timeout=60, poll_interval=10, refill=False)
+    assert lease is not None
+    stats = p.stats()
+    assert stats.timeouts == 1
+    assert stats.hits == 1
+    assert stats.waits == [60, 0]
+
+
+def test_reap(pool):
+    """Test expired leases and failed clusters are destroyed
+    """
+    p = pool()
+    p.refill(wait=True)
+    lease = p.acquire(refill=False)
+    p.clock.__self__.now += 3601
+    assert p.reap() == [lease.cluster_id]
+    with pytest.raises(ValueError):
+        p.release(lease)
+
+    FakePlatform.fail = True
+    failed = p.refill(wait=True)
+    assert [c["status"] for c in p.clusters() if c["id"] in failed] == ["failed"]
+    assert sorted(p.reap()) == sorted(failed)
+    assert len(p.clusters()) == 1
+
+
+def test_provisioning_in_flight(pool, monkeypatch):
+    """Test clusters being provisioned are not reaped, even if the process which
+    started the provisioning is gone, and cancelling the refill leaves them failed
+    """
+    FakePlatform.gate = threading.Event()
+    p = pool()
+    new_ids = p.refill()
+    assert all(not t.daemon for t in p._threads)
+
+    monkeypatch.setattr("pool.pool._pid_alive", lambda pid: False)
+    assert p.reap() == []
+    # the lease is taken while holding the lock of the pool
+    monkeypatch.setattr(p, "_try_lease", lambda cluster_id, owner: None)
+    with p._locked():
+        thread = threading.Thread(target=p._lease_ready, args=("owner",))
+        thread.start()
+        thread.join(0.2)
+        assert thread.is_alive()
+    thread.join()
+
+    p.wait_refill(cancel=True)
+    assert FakePlatform.provisioned == []
+    assert [c["status"] for c in p.clusters()] == ["failed", "failed"]
+    assert sorted(p.reap()) == sorted(new_ids)
+    assert p.clusters() == []
+
+    # later refills are not cancelled
+    FakePlatform.gate = None
+    p.refill(wait=True)
+    assert len(FakePlatform.provisioned) == 2
+
+
+def test_stack_conf(pool):
+    """Test each stack has its own files and ssh-agent socket, exported to the workers
+    """
+    conf = pool().conf
+    stacks = [stack_conf(conf, f"w{n}", f"/work/w{n}-stack") for n in range(2)]
+    assert stacks[0].terraform.stack_name == "w0-ci"
+    assert stacks[0].utils.ssh_sock != stacks[1].utils.ssh_sock != conf.utils.ssh_sock
+    assert stack_env(stacks[1])["UTILS_SSH_SOCK"] == stacks[1].utils.ssh_sock
+    assert conf.utils.ssh_sock == "/tmp/testrunner_ssh_sock"
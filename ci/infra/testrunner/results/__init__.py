@@ -0,0 +1 @@
+from results.cache import ResultCache, cache_key, file_hash, git_commit, sources_hash
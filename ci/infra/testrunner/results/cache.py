@@ -0,0 +1,133 @@
+"""Cache of the tests which passed.
+
+Each test is identified by a key computed from the inputs which determine its
+outcome: the skuba commit and binary, which determine the kubernetes version,
+the platform and topology of the cluster, the source of the test and the
+sources of the testrunner libraries it uses. A test which passed is not
+executed again under the same key, e.g. when a job is retried after a failure of
+the infrastructure.
+
+Entries are json files under the cache directory, named after their key. When
+the number of entries exceeds the size of the cache, the least recently used
+ones are evicted by calling evict, once all the results of a session are put.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import time
+
+logger = logging.getLogger('testrunner')
+
+
+def file_hash(*paths):
+    """Returns the sha256 of the contents of the files, or None if any of them doesn't exist"""
+    digest = hashlib.sha256()
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+        except OSError:
+            return None
+    return digest.hexdigest()
+
+
+def sources_hash(root, exclude=()):
+    """Returns the sha256 of the names and contents of the python sources under root,
+    except the unit tests (test_*.py) and the directories in exclude"""
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames
+                             if d != "__pycache__" and os.path.join(dirpath, d) not in exclude)
+        for name in sorted(filenames):
+            if not name.endswith(".py") or name.startswith("test_"):
+                continue
+            path = os.path.join(dirpath, name)
+            digest.update(os.path.relpath(path, root).encode())
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def git_commit(repo_dir):
+    """Returns the commit checked out in the repository, or None if it is not a git checkout"""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo_dir, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, check=True, universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def cache_key(fields, nodeid):
+    """Returns the key of a test given the fields describing its inputs"""
+    data = json.dumps({"fields": fields, "test": nodeid}, sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class ResultCache:
+    """Results of the tests which passed, stored in a directory.
+       directory: where the entries are stored
+       size: maximum number of entries kept
+    """
+
+    def __init__(self, directory, size=5000, clock=time.time):
+        self.directory = directory
+        self.size = size
+        self.clock = clock
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """Returns the entry of the key, or None if the test did not pass under the key"""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # entries are evicted by their access time
+        os.utime(path)
+        return entry
+
+    def put(self, key, nodeid, duration, fields=None):
+        """Records that the test passed under the key"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"test": nodeid, "duration": duration, "passed": self.clock(), "fields": fields}, f)
+        os.replace(tmp_path, path)
+
+    def entries(self):
+        """Returns the paths of the entries, with the time they were last used"""
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith(".json"):
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.path))
+                    except FileNotFoundError:
+                        pass
+        return entries
+
+    def evict(self):
+        """Removes the least recently used entries exceeding the size of the cache"""
+        entries = self.entries()
+        if len(entries) <= self.size:
+            return 0
+        evicted = sorted(entries)[:len(entries) - self.size]
+        for _, path in evicted:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        logger.debug(f"Evicted {len(evicted)} entries from the test result cache")
+        return len(evicted)
@@ -0,0 +1,55 @@
+import os
+
+from results.cache import ResultCache, cache_key, file_hash, sources_hash
+
+FIELDS = {"skuba_commit": "abc123", "skuba_binary": "f00", "platform": "openstack", "masters": 1, "workers": 2, "source": "beef"}
+
+
+def test_cache_key(tmp_path):
+    """Test the key changes with any of the inputs of the test
+    """
+    key = cache_key(FIELDS, "test_a.py::test_one")
+    assert key == cache_key(dict(FIELDS), "test_a.py::test_one")
+    assert key != cache_key(FIELDS, "test_a.py::test_two")
+    assert key != cache_key({**FIELDS, "workers": 3}, "test_a.py::test_one")
+
+    source = tmp_path / "test_a.py"
+    source.write_text("def test_one(): pass\n")
+    digest = file_hash(str(source))
+    source.write_text("def test_one(): assert False\n")
+    assert file_hash(str(source)) != digest
+    assert file_hash(str(tmp_path / "missing")) is None
+
+    lib = tmp_path / "utils"
+    lib.mkdir()
+    (lib / "utils.py").write_text("TIMEOUT = 300\n")
+    digest = sources_hash(str(tmp_path), exclude=(str(tmp_path / "tests"),))
+    # changes to the excluded directories and to the unit tests of the libraries are ignored
+    (tmp_path / "tests").mkdir()
+    (tmp_path / "tests" / "conftest.py").write_text("import pytest\n")
+    (lib / "test_utils.py").write_text("def test_timeout(): pass\n")
+    assert sources_hash(str(tmp_path), exclude=(str(tmp_path / "tests"),)) == digest
+    (lib / "utils.py").write_text("TIMEOUT = 600\n")
+    assert sources_hash(str(tmp_path), exclude=(str(tmp_path / "tests"),)) != digest
+
+
+def test_get_put_evict(tmp_path):
+    """Test passed results are found under their key and the least recently
+    used entries are evicted when the cache is full
+    """
+    cache = ResultCache(str(tmp_path), size=2)
+    keys = [cache_key(FIELDS, f"test_a.py::test_{n}") for n in range(3)]
+    assert cache.get(keys[0]) is None
+
+    cache.put(keys[0], "test_a.py::test_0", 12.5, fields=FIELDS)
+    cache.put(keys[1], "test_a.py::test_1", 30)
+    for age, key in zip((300, 200), keys[:2]):
+        os.utime(cache._path(key), (0, os.path.getmtime(cache._path(key)) - age))
+    assert cache.get(keys[0])["duration"] == 12.5
+
+    cache.put(keys[2], "test_a.py::test_2", 1)
+    assert len(cache.entries()) == 3
+    assert cache.evict() == 1
+    assert len(cache.entries()) == 2
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0])["fields"] == FIELDS
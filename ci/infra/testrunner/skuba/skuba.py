@@ -1,14 +1,32 @@
 import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import toml
 
 import platforms
 from checks import Checker
+from utils.tracing import propagate_context
 from utils.utils import (step, Utils)
 
 logger = logging.getLogger('testrunner')
 
 
+class NodeResult:
+    """Outcome of an action executed in a node"""
+
+    def __init__(self, role, nr, elapsed, output=None, error=None):
+        self.role = role
+        self.nr = nr
+        self.elapsed = elapsed
+        self.output = output
+        self.error = error
+
+    def status(self):
+        return "failed" if self.error is not None else "succeeded"
+
+
 class Skuba:
 
     def __init__(self, conf, platform):
@@ -20,7 +38,7 @@ class Skuba:
         self.cluster = self.conf.skuba.cluster
         self.cluster_dir = os.path.join(self.workdir, self.cluster)
         self.utils.setup_ssh()
-        self.checker = Checker(conf, platform)
+        self.checker = Checker(conf, self.platform)
 
     def _verify_skuba_bin_dependency(self):
         if not os.path.isfile(self.binpath):
@@ -132,17 +150,23 @@ class Skuba:
 
         self.checker.check_node(role, nr, stage="joined", timeout=timeout)
 
-    def join_nodes(self, masters=None, workers=None, timeout=None):
+    @step
+    def join_nodes(self, masters=None, workers=None, timeout=None, concurrency=None):
+        """Join masters one at a time, as etcd requires, and workers concurrently"""
         if masters is None:
             masters = self.platform.get_num_nodes("master")
         if workers is None:
             workers = self.platform.get_num_nodes("worker")
+        if concurrency is None:
+            concurrency = self.conf.skuba.join_concurrency
 
-        for node in range(1, masters):
-            self.node_join("master", node, timeout=timeout)
+        results = self._run_on_nodes([("master", n) for n in range(1, masters)],
+                                     self.node_join, concurrency=1, timeout=timeout)
+        results += self._run_on_nodes([("worker", n) for n in range(0, workers)],
+                                      self.node_join, concurrency=concurrency, timeout=timeout)
 
-        for node in range(0, workers):
-            self.node_join("worker", node, timeout=timeout)
+        self._report_node_results("join", results)
+        return results
 
     @step
     def node_remove(self, role="worker", nr=0):
@@ -192,6 +216,47 @@ class Skuba:
 
         return self._run_skuba(cmd, ignore_errors=ignore_errors)
 
+    @step
+    def rolling_upgrade(self, max_unavailable=1, timeout=None, prepare=None):
+        """Upgrade masters one at a time and workers in batches of max_unavailable nodes.
+        Each node must become ready after the upgrade and the system pods must be
+        ready after each batch before the next one starts. The rollout stops at
+        the first batch with a failed node.
+        prepare(role, nr), if given, is called for each node before upgrading it
+        (e.g. for migrating its OS).
+        Returns a list of NodeResult with the output of the upgrade of each node.
+        """
+        try:
+            max_unavailable = int(max_unavailable)
+        except ValueError:
+            raise ValueError(f"max_unavailable '{max_unavailable}' is not an int")
+        if max_unavailable < 1:
+            raise ValueError("max_unavailable must be at least 1")
+
+        batches = [[("master", n)] for n in range(self.platform.get_num_nodes("master"))]
+        workers = [("worker", n) for n in range(self.platform.get_num_nodes("worker"))]
+        batches += [workers[i:i + max_unavailable] for i in range(0, len(workers), max_unavailable)]
+
+        results = []
+        for batch in batches:
+            batch_results = self._run_on_nodes(batch, self._upgrade_node, concurrency=len(batch),
+                                               timeout=timeout, prepare=prepare)
+            results += batch_results
+            if any(r.error is not None for r in batch_results):
+                break
+            self.checker.check_cluster(stage="joined", timeout=timeout)
+
+        self._report_node_results("upgrade", results)
+        return results
+
+    def _upgrade_node(self, role, nr, timeout=None, prepare=None):
+        """Apply the upgrade to a node and wait until it is ready again"""
+        if prepare is not None:
+            prepare(role, nr)
+        output = self.node_upgrade("apply", role, nr)
+        self.checker.check_node(role, nr, stage="joined", timeout=timeout)
+        return output
+
     @step
     def cluster_upgrade(self, action):
         self._verify_bootstrap_dependency()
@@ -230,6 +295,47 @@ class Skuba:
         output = self._run_skuba(cmd)
         return output.count(role)
 
+    def _run_on_nodes(self, nodes, func, concurrency=1, **kwargs):
+        """Run func(role, nr, **kwargs) for the given (role, nr) nodes
+        with up to concurrency nodes at a time. A failure in a node does not
+        stop the others.
+        Returns a list of NodeResult in the same order as the nodes.
+        """
+        try:
+            concurrency = int(concurrency)
+        except ValueError:
+            raise ValueError(f"concurrency '{concurrency}' is not an int")
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+
+        def run(node):
+            role, nr = node
+            start = time.time()
+            try:
+                output = func(role, nr, **kwargs)
+            except Exception as ex:
+                logger.error(f"{func.__name__} failed for node {role}-{nr}: {ex}")
+                return NodeResult(role, nr, time.time() - start, error=ex)
+            return NodeResult(role, nr, time.time() - start, output=output)
+
+        if not nodes:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(nodes))) as executor:
+            return list(executor.map(propagate_context(run), nodes))
+
+    @staticmethod
+    def _report_node_results(action, results):
+        """Log the outcome and duration of an action for each node and raise
+        an exception listing the nodes that failed, if any"""
+        for result in results:
+            logger.info(f"{action} {result.role}-{result.nr}: {result.status()} in {result.elapsed:.0f}s")
+
+        failed = [r for r in results if r.error is not None]
+        if failed:
+            nodes = ", ".join(f"{r.role}-{r.nr}" for r in failed)
+            raise Exception(f"Error executing {action} in nodes: {nodes}")
+
     def _run_skuba(self, cmd, cwd=None, verbosity=None, ignore_errors=False):
         """Running skuba command.
         The cwd defautls to cluster_dir but can be overrided
@@ -0,0 +1,129 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from skuba.skuba import Skuba
+
+
+class FakeChecker:
+    """Records the order of the node and cluster checks"""
+
+    def __init__(self, events):
+        self.events = events
+
+    def check_node(self, role, nr, stage=None, timeout=None):
+        self.events.append(("check", role, nr))
+
+    def check_cluster(self, stage=None, timeout=None):
+        self.events.append(("cluster",))
+
+
+@pytest.fixture
+def skuba():
+    """Skuba for a cluster of 3 masters and 5 workers, recording the nodes being
+    joined or upgraded at the same time. Each action takes 0.05 seconds"""
+    skuba = Skuba.__new__(Skuba)
+    skuba.conf = SimpleNamespace(skuba=SimpleNamespace(join_concurrency=2))
+    skuba.platform = SimpleNamespace(get_num_nodes=lambda role: {"master": 3, "worker": 5}[role])
+    skuba.events = []
+    skuba.checker = FakeChecker(skuba.events)
+    skuba.failing = set()
+    skuba.active = set()
+    skuba.max_active = {"master": 0, "worker": 0}
+    lock = threading.Lock()
+
+    def run_node(action, role, nr, done):
+        with lock:
+            skuba.active.add((role, nr))
+            skuba.max_active[role] = max(skuba.max_active[role], len(skuba.active))
+            skuba.events.append((action, role, nr))
+        time.sleep(0.05)
+        with lock:
+            skuba.active.discard((role, nr))
+        if (role, nr) in skuba.failing:
+            raise Exception(f"{action} failed")
+        return f"{role}-{nr} successfully {done}"
+
+    def node_join(role, nr, timeout=None):
+        output = run_node("join", role, nr, "joined")
+        skuba.checker.check_node(role, nr)
+        return output
+
+    skuba.node_join = node_join
+    skuba.node_upgrade = lambda action, role, nr: run_node("upgrade", role, nr, "upgraded")
+    return skuba
+
+
+def test_join_nodes(skuba):
+    """Test masters are joined one at a time before the workers, which are joined
+    with up to join_concurrency nodes at a time
+    """
+    results = skuba.join_nodes()
+
+    assert [(r.role, r.nr) for r in results] == [("master", 1), ("master", 2)] + [("worker", n) for n in range(5)]
+    assert all(r.output.endswith("successfully joined") for r in results)
+    assert skuba.max_active == {"master": 1, "worker": 2}
+    joined = [event[1] for event in skuba.events if event[0] == "join"]
+    assert joined == ["master"] * 2 + ["worker"] * 5
+
+    skuba.events.clear()
+    skuba.max_active["worker"] = 0
+    skuba.join_nodes(masters=1, concurrency=4)
+    assert skuba.max_active["worker"] == 4
+
+
+def test_join_nodes_failure(skuba):
+    """Test a node failing to join is reported, without stopping the other nodes
+    """
+    skuba.failing = {("master", 1), ("worker", 2)}
+    with pytest.raises(Exception, match="master-1, worker-2"):
+        skuba.join_nodes()
+
+    joined = [event[1:] for event in skuba.events if event[0] == "join"]
+    assert sorted(joined) == [("master", 1), ("master", 2)] + [("worker", n) for n in range(5)]
+    checked = [event[1:] for event in skuba.events if event[0] == "check"]
+    assert ("master", 1) not in checked and ("worker", 2) not in checked
+    assert len(checked) == 5
+
+
+def test_rolling_upgrade(skuba):
+    """Test masters are upgraded one at a time, workers in batches of max_unavailable
+    nodes, and the cluster is checked after each batch
+    """
+    prepared = []
+    results = skuba.rolling_upgrade(max_unavailable=2, prepare=lambda role, nr: prepared.append((role, nr)))
+
+    assert [(r.role, r.nr) for r in results] == [("master", n) for n in range(3)] + [("worker", n) for n in range(5)]
+    assert all(r.output.endswith("successfully upgraded") for r in results)
+    assert sorted(prepared) == sorted((r.role, r.nr) for r in results)
+    assert skuba.max_active == {"master": 1, "worker": 2}
+
+    # 3 master batches and 3 worker batches ([0, 1], [2, 3], [4])
+    assert skuba.events.count(("cluster",)) == 6
+    batches = [[]]
+    for event in skuba.events:
+        if event == ("cluster",):
+            batches.append([])
+        elif event[0] == "upgrade":
+            batches[-1].append(event[1:])
+    assert [sorted(b) for b in batches[3:-1]] == [[("worker", 0), ("worker", 1)],
+                                                   [("worker", 2), ("worker", 3)],
+                                                   [("worker", 4)]]
+
+
+def test_rolling_upgrade_stops_at_failed_batch(skuba):
+    """Test the rollout stops after the batch with a failed node, and the failure
+    is reported
+    """
+    skuba.failing = {("worker", 2)}
+    with pytest.raises(Exception, match="worker-2"):
+        skuba.rolling_upgrade(max_unavailable=2)
+
+    upgraded = [event[1:] for event in skuba.events if event[0] == "upgrade"]
+    assert ("worker", 3) in upgraded
+    assert ("worker", 4) not in upgraded
+
+    with pytest.raises(ValueError):
+        skuba.rolling_upgrade(max_unavailable=0)
@@ -7,15 +7,18 @@
 
 import io
 import logging
+import os
 import sys
 from argparse import REMAINDER, ArgumentParser
 
 import platforms
 from skuba import Skuba
-from kubectl import Kubectl
+from kubectl import Kubectl, benchmark
 from tests import TestDriver
-from utils import BaseConfig, Logger, Utils
+from utils import BaseConfig, Logger, Utils, tracing
 from checks import Checker
+from perf import PerfHistory, record_run, report
+from pool import ClusterPool
 
 __version__ = "0.0.3"
 
@@ -69,7 +72,7 @@ def cluster_upgrade(options):
 
 def get_logs(options):
     platform_logging_errors = platforms.get_platform(
-        options.conf, options.platform).gather_logs()
+        options.conf, options.platform).gather_logs(label=options.label)
 
     if platform_logging_errors:
         raise Exception("Failure(s) while collecting logs")
@@ -85,7 +88,8 @@ def join_nodes(options):
     skuba.join_nodes(
         masters=options.masters,
         workers=options.workers,
-        timeout=options.timeout
+        timeout=options.timeout,
+        concurrency=options.concurrency
     )
 
 
@@ -99,6 +103,13 @@ def node_upgrade(options):
         action=options.upgrade_action, role=options.role, nr=options.node)
 
 
+def rolling_upgrade(options):
+    results = Skuba(options.conf, options.platform).rolling_upgrade(
+        max_unavailable=options.max_unavailable, timeout=options.timeout)
+    for result in results:
+        print(f"{result.role}-{result.nr}: {result.status()} in {result.elapsed:.0f}s")
+
+
 def node_check(options):
     Checker(options.conf, options.platform).check_node(
         role=options.role, node=options.node,
@@ -110,11 +121,44 @@ def cluster_check(options):
         checks=options.checks, stage=options.stage)
 
 
+def all_check(options):
+    Checker(options.conf, options.platform).check_all(
+        checks=options.checks, stage=options.stage, timeout=options.timeout)
+
+
+def kubectl_benchmark(options):
+    results = benchmark.benchmark(options.conf, iterations=options.iterations)
+    print(benchmark.report(results))
+
+
 def test(options):
+    pool = None
+    if options.pool:
+        pool = ClusterPool(options.conf, options.platform, masters=options.conf.terraform.master.count,
+                           workers=options.conf.terraform.worker.count)
     test_driver = TestDriver(options.conf, options.platform)
     test_driver.run(module=options.module, test_suite=options.test_suite, test=options.test,
                     verbose=options.verbose, collect=options.collect, skip_setup=options.skip_setup,
-                    mark=options.mark, traceback=options.traceback, junit=options.junit)
+                    mark=options.mark, traceback=options.traceback, junit=options.junit,
+                    restore=options.restore, snapshot=options.snapshot,
+                    workers=options.workers, pool=pool, durations_from=options.durations_from,
+                    changed_files=options.changed_files, reuse_results=options.reuse_results,
+                    stream_journal=options.stream_journal)
+
+
+def shard(options):
+    test_driver = TestDriver(options.conf, options.platform)
+    for arg in test_driver.shard(options.index, options.total, options.durations_from,
+                                 module=options.module, test_suite=options.test_suite, mark=options.mark):
+        print(arg)
+
+
+def snapshot(options):
+    platforms.get_platform(options.conf, options.platform).snapshot(options.stage)
+
+
+def restore(options):
+    platforms.get_platform(options.conf, options.platform).restore(options.stage)
 
 
 def ssh(options):
@@ -122,6 +166,44 @@ def ssh(options):
         role=options.role, nr=options.node, cmd=" ".join(options.cmd))
 
 
+def _cluster_pool(options):
+    return ClusterPool(options.conf, options.platform, masters=options.master_count,
+                       workers=options.worker_count, bootstrap=options.bootstrap or None)
+
+
+def pool_refill(options):
+    pool = _cluster_pool(options)
+    pool.reap()
+    pool.refill(wait=True)
+
+
+def pool_acquire(options):
+    lease = _cluster_pool(options).acquire(timeout=options.timeout, refill=False)
+    for name, value in lease.env().items():
+        print(f"export {name}={value}")
+
+
+def pool_release(options):
+    pool = _cluster_pool(options)
+    pool.release(pool.lease_from_string(options.lease), destroy=not options.keep, refill=False)
+
+
+def pool_status(options):
+    print(_cluster_pool(options).stats())
+
+
+def perf_report(options):
+    conf = options.conf
+    history = PerfHistory(conf.perf.db)
+    run, comparisons = history.compare(
+        run_id=options.run, baseline=options.baseline or conf.perf.baseline,
+        threshold=conf.perf.threshold if options.threshold is None else options.threshold,
+        min_duration=conf.perf.min_duration)
+    print(report(run, comparisons, regressions_only=options.regressions))
+    if options.fail and any(c.regressed() for c in comparisons):
+        raise SystemExit(1)
+
+
 def inhibit_kured(options):
     Kubectl(options.conf).inhibit_kured()
 
@@ -157,6 +239,8 @@ def main():
     cmd_config.set_defaults(func=config)
 
     cmd_log = commands.add_parser("get_logs", help="gather logs from nodes")
+    cmd_log.add_argument("--label", dest="label", default=None,
+                         help="test or step the logs belong to, used for indexing incremental logs")
     cmd_log.set_defaults(func=get_logs)
 
     cmd_cleanup = commands.add_parser(
@@ -236,6 +320,14 @@ def main():
                                   help="action: plan or apply upgrade", choices=["plan", "apply"])
     cmd_node_upgrade.set_defaults(func=node_upgrade)
 
+    cmd_rolling_upgrade = commands.add_parser("rolling-upgrade",
+                                              help="upgrade kubernetes version in all nodes")
+    cmd_rolling_upgrade.add_argument("-u", "--max-unavailable", dest="max_unavailable", type=int, default=1,
+                                     help="maximum number of workers upgraded at the same time. Default is 1")
+    cmd_rolling_upgrade.add_argument("-t", "--timeout", type=int, default=300,
+                                     help="timeout for waiting a node to become ready after the upgrade (seconds)")
+    cmd_rolling_upgrade.set_defaults(func=rolling_upgrade)
+
     cmd_check_node = commands.add_parser(
         "check-node", parents=[node_args], help="check node health")
     cmd_check_node.add_argument("-c", "--check", dest="checks", nargs='+',
@@ -253,6 +345,9 @@ def main():
                                 help="Specify how many workers to join. Default is all")
     cmd_join_nodes.add_argument("-t", "--timeout", type=int, default=180,
                                 help="timeout for waiting the master nodes to become ready (seconds)")
+    cmd_join_nodes.add_argument("-c", "--concurrency", type=int, default=None,
+                                help="maximum number of workers joined at the same time."
+                                     " Default is skuba.join_concurrency")
     cmd_join_nodes.set_defaults(func=join_nodes)
     # End Join Nodes
 
@@ -279,10 +374,59 @@ def main():
                                 "'deployed' For when you already have a fully deployed cluster.")
     test_args.add_argument("--traceback", default="short", choices=['long', 'short', 'line', 'no'],
                            help="level of detail in traceback for test failure")
+    test_args.add_argument("--restore",
+                           choices=['provisioned', 'bootstrapped', 'deployed'],
+                           help="Restore the cluster from the snapshot of the given setup step "
+                                "before each test, instead of executing the setup up to that step")
+    test_args.add_argument("--snapshot", action="store_true", default=False,
+                           help="Save a snapshot of the cluster after each setup step")
+    test_args.add_argument("-n", "--workers", type=int, default=1,
+                           help="number of tests executed in parallel, each worker using its own cluster")
+    test_args.add_argument("--pool", action="store_true", default=False,
+                           help="use clusters from the cluster pool for the workers, even with a single "
+                                "worker, instead of a stack for each worker")
+    test_args.add_argument("--durations-from", dest="durations_from", nargs="+",
+                           help="JUnit files with the durations of the tests, for distributing them "
+                                "among the workers. Defaults to the JUnit file of the previous run")
+    test_args.add_argument("--changed-files", dest="changed_files",
+                           help="file with the paths changed, relative to the repository root, one per line "
+                                "(e.g. the output of git diff --name-only). Only the tests impacted by the "
+                                "changes and the smoke tests are executed")
+    test_args.add_argument("--reuse-results", dest="reuse_results", action="store_true", default=False,
+                           help="skip the tests which already passed with the same skuba build, kubernetes "
+                                "version, platform, topology and test sources")
+    test_args.add_argument("--stream-journal", dest="stream_journal", action="store_true", default=False,
+                           help="stream the journal of the nodes to their log dir while the tests run, "
+                                "instead of collecting it at the end")
     cmd_test = commands.add_parser(
         "test", parents=[test_args], help="execute tests")
     cmd_test.set_defaults(func=test)
 
+    cmd_shard = commands.add_parser(
+        "shard", help="print the tests of a shard, for splitting the tests among CI agents")
+    cmd_shard.add_argument("-i", "--index", type=int, required=True, help="shard to print, starting from 0")
+    cmd_shard.add_argument("-n", "--total", type=int, required=True, help="number of shards")
+    cmd_shard.add_argument("-f", "--filter", dest="mark", help="Filter the tests based on markers")
+    cmd_shard.add_argument("-m", "--module", dest="module", help="folder with the tests")
+    cmd_shard.add_argument("-s", "--suite", dest="test_suite", help="test file name")
+    cmd_shard.add_argument("--durations-from", dest="durations_from", nargs="+", required=True,
+                           help="JUnit files with the durations of the tests. "
+                                "Must be the same files on every agent")
+    cmd_shard.set_defaults(func=shard)
+
+    snapshot_args = ArgumentParser(add_help=False)
+    snapshot_args.add_argument("-s", "--stage", required=True,
+                               choices=['provisioned', 'bootstrapped', 'deployed'],
+                               help="setup stage the snapshot corresponds to")
+
+    cmd_snapshot = commands.add_parser(
+        "snapshot", parents=[snapshot_args], help="save a snapshot of all the nodes (libvirt only)")
+    cmd_snapshot.set_defaults(func=snapshot)
+
+    cmd_restore = commands.add_parser(
+        "restore", parents=[snapshot_args], help="restore all the nodes from a snapshot (libvirt only)")
+    cmd_restore.set_defaults(func=restore)
+
     cmd_inhibit_kured = commands.add_parser(
         "inhibit_kured", help="Prevent kured to reboot nodes")
     cmd_inhibit_kured.set_defaults(func=inhibit_kured)
@@ -297,7 +441,78 @@ def main():
         help="only execute checks that apply to this stage")
     cmd_check_cluster.set_defaults(func=cluster_check)
 
+    cmd_check_all = commands.add_parser(
+        "check-all", help="check health of all nodes and the cluster concurrently")
+    cmd_check_all.add_argument(
+        "-c", "--check", dest="checks", nargs='+',
+        help="check to be executed (multiple checks can be specified")
+    cmd_check_all.add_argument(
+        "-s", "--stage", dest="stage",
+        help="only execute checks that apply to this stage")
+    cmd_check_all.add_argument(
+        "-t", "--timeout", type=int, default=180,
+        help="timeout for all the checks to succeed (seconds)")
+    cmd_check_all.set_defaults(func=all_check)
+
+    cmd_kubectl_benchmark = commands.add_parser(
+        "kubectl-benchmark", help="compare the kubectl and api backends for querying the cluster")
+    cmd_kubectl_benchmark.add_argument(
+        "-n", "--iterations", type=int, default=20,
+        help="number of requests for each backend")
+    cmd_kubectl_benchmark.set_defaults(func=kubectl_benchmark)
+
+    # common parameters for the cluster pool
+    pool_args = ArgumentParser(add_help=False)
+    pool_args.add_argument("-m", "--master-count", dest="master_count", type=int, default=1,
+                           help="number of masters of the pooled clusters")
+    pool_args.add_argument("-w", "--worker-count", dest="worker_count", type=int, default=1,
+                           help="number of workers of the pooled clusters")
+    pool_args.add_argument("-b", "--bootstrap", action="store_true",
+                           help="use pooled clusters which are already deployed")
+
+    cmd_pool_refill = commands.add_parser(
+        "pool-refill", parents=[pool_args],
+        help="provision clusters until the pool is full, destroying expired and failed ones")
+    cmd_pool_refill.set_defaults(func=pool_refill)
+
+    cmd_pool_acquire = commands.add_parser(
+        "pool-acquire", parents=[pool_args],
+        help="lease a cluster from the pool and print the environment for using it")
+    cmd_pool_acquire.add_argument("-t", "--timeout", type=int, default=3600,
+                                  help="timeout for a cluster to become available (seconds)")
+    cmd_pool_acquire.set_defaults(func=pool_acquire)
+
+    cmd_pool_release = commands.add_parser(
+        "pool-release", parents=[pool_args], help="return a leased cluster to the pool")
+    cmd_pool_release.add_argument("--lease", default=os.getenv("POOL_LEASE"),
+                                  required=os.getenv("POOL_LEASE") is None,
+                                  help="lease printed by pool-acquire. Defaults to $POOL_LEASE")
+    cmd_pool_release.add_argument("--keep", action="store_true",
+                                  help="keep the cluster in the pool instead of destroying it. "
+                                       "Only if the tests left it clean")
+    cmd_pool_release.set_defaults(func=pool_release)
+
+    cmd_perf_report = commands.add_parser(
+        "perf-report", help="compare the duration of the steps and tests of a run with the previous runs")
+    cmd_perf_report.add_argument("-r", "--run", type=int, help="id of the run. Defaults to the last one")
+    cmd_perf_report.add_argument("-b", "--baseline", type=int,
+                                 help="number of previous runs with the same command, platform and "
+                                      "topology used as baseline. Defaults to perf.baseline")
+    cmd_perf_report.add_argument("-t", "--threshold", type=float,
+                                 help="increase over the median of the baseline reported as a regression, "
+                                      "as a fraction (e.g. 0.2). Defaults to perf.threshold")
+    cmd_perf_report.add_argument("--regressions", action="store_true",
+                                 help="only show the steps and tests which regressed")
+    cmd_perf_report.add_argument("--fail", action="store_true",
+                                 help="exit with an error if there are regressions")
+    cmd_perf_report.set_defaults(func=perf_report)
+
+    cmd_pool_status = commands.add_parser(
+        "pool-status", parents=[pool_args], help="print the clusters and metrics of the pool")
+    cmd_pool_status.set_defaults(func=pool_status)
+
     options = parser.parse_args()
+    conf = None
     try:
         conf = BaseConfig(options.yaml_path)
         Logger.config_logger(conf, level=options.log_level)
@@ -307,7 +522,8 @@ def main():
             BaseConfig.print(conf, out=out)
             logger.debug(f'Configuration\n{out.getvalue()}')
 
-        options.func(options)
+        with tracing.span(options.command, category="command"):
+            options.func(options)
     except SystemExit as ex:
         if ex.code > 0:
             logger.error(f'Command {options.command} ended with error code {ex.code}')
@@ -315,6 +531,11 @@ def main():
     except Exception as ex:
         logger.error(f'Exception {ex} executing command {options.command}', exc_info=True)
         sys.exit(255)
+    finally:
+        if conf is not None:
+            tracing.write_run(conf.log.trace_dir, options.command)
+            if options.command != "perf-report":
+                record_run(conf, options.command, options.platform, tracing.tracer())
 
     sys.exit(0)
 
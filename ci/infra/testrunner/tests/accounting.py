@@ -0,0 +1,64 @@
+"""pytest plugin attributing the wall time of each test to what it was spent on:
+sleeps, polling backoffs, commands by binary and setup of fixtures (see
+utils.accounting). The breakdown of each test is attached to the JUnit report
+as properties (time:<category>, in seconds) and summarized at the end of the
+session.
+"""
+
+import time
+
+import pytest
+
+from utils import accounting
+
+
+class TimeAccounting:
+    """Accounts the time of each test.
+       top: number of tests with their breakdown in the summary
+    """
+
+    def __init__(self, top=10):
+        self.top = top
+        self.results = {}
+        self._sleep = None
+
+    def _accounted_sleep(self, seconds):
+        with accounting.measure_sleep():
+            self._sleep(seconds)
+
+    def pytest_sessionstart(self, session):
+        # tests call time.sleep directly
+        self._sleep = time.sleep
+        time.sleep = self._accounted_sleep
+
+    def pytest_unconfigure(self, config):
+        if self._sleep is not None:
+            time.sleep = self._sleep
+            self._sleep = None
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_protocol(self, item):
+        with accounting.account():
+            yield
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self):
+        with accounting.measure(accounting.FIXTURE_SETUP):
+            yield
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(self, item, call):
+        # the properties are written to the JUnit report with the teardown report
+        acc = accounting.current()
+        if call.when == "teardown" and acc is not None:
+            acc.close()
+            totals = acc.totals()
+            self.results[item.nodeid] = (acc.wall(), totals)
+            for category, seconds in sorted(totals.items()):
+                item.user_properties.append((f"time:{category}", f"{seconds:.1f}"))
+        yield
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if self.results:
+            terminalreporter.write_sep("=", "time accounting summary")
+            terminalreporter.write_line(accounting.report(self.results, self.top))
@@ -0,0 +1,130 @@
+import logging
+import time
+
+from skuba import Skuba
+
+logger = logging.getLogger('testrunner')
+
+STAGES = ("provisioned", "bootstrapped", "deployed")
+
+
+class SharedCluster:
+    """Cluster shared by all the tests of a session.
+
+    The cluster is set up once, up to the stage required by each test, and reused
+    by the following tests. Tests which leave the cluster dirty (marked as
+    disruptive) get a clean cluster when they start and mark it dirty when they
+    end, so the next test gets a clean cluster as well. A clean cluster is
+    obtained by restoring a snapshot of the stage, if there is one (see the
+    --snapshot and --restore options), or otherwise by deploying it again.
+
+       skip_setup: stage the existing cluster is already at. It is never destroyed
+       restore: stage to restore the cluster from when the session starts
+       snapshot: save a snapshot of the cluster after each setup stage
+       stream_journal: stream the journal of the nodes to their log dir while the cluster is up
+    """
+
+    def __init__(self, conf, platform, skuba, kubectl, skip_setup=None, restore=None, snapshot=False,
+                 stream_journal=False):
+        self.conf = conf
+        self.platform = platform
+        self.skuba = skuba
+        self.kubectl = kubectl
+        self.skip_setup = skip_setup
+        self.restore = restore
+        self.snapshot = snapshot
+        self.stream_journal = stream_journal
+        self.stage = None
+        self.dirty = False
+        self.snapshots = set()
+        self.owned = False
+
+    def keep(self):
+        """Returns True if the cluster must not be destroyed at the end of the session"""
+        return bool(self.skip_setup or self.restore or self.snapshot)
+
+    def require(self, stage, clean=False):
+        """Brings the cluster to the stage. If the cluster is dirty, or clean is True and
+        the cluster is past the stage, a clean cluster at the stage is obtained first"""
+        target = STAGES.index(stage)
+        if self.stage is not None:
+            past = STAGES.index(self.stage) > target
+            if self.dirty or (clean and past):
+                self._reset(stage)
+
+        if self.stage is None:
+            self._start()
+
+        while STAGES.index(self.stage) < target:
+            self._advance(STAGES[STAGES.index(self.stage) + 1])
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def _start(self):
+        if self.skip_setup:
+            self.stage = self.skip_setup
+        elif self.restore:
+            self.platform.restore(self.restore)
+            self.snapshots.update(s for s in STAGES if self.platform.has_snapshot(s))
+            self.stage = self.restore
+        else:
+            self.owned = True
+            self.platform.provision()
+            self._reached("provisioned")
+        if self.stream_journal:
+            self.platform.stream_journal()
+
+    def _advance(self, stage):
+        if stage == "bootstrapped":
+            self.skuba.cluster_init()
+            self.skuba.node_bootstrap()
+        elif stage == "deployed":
+            self.skuba.join_nodes()
+            self.kubectl.wait_for_pods_ready(namespace="kube-system", timeout=60 * 30)
+        self._reached(stage)
+
+    def _reached(self, stage):
+        self.stage = stage
+        if self.snapshot:
+            self.platform.snapshot(stage)
+            self.snapshots.add(stage)
+
+    def _reset(self, stage):
+        """Obtains a clean cluster at the stage, or at an earlier one"""
+        self.dirty = False
+        target = STAGES.index(stage)
+        for s in reversed(STAGES[:target + 1]):
+            if s in self.snapshots:
+                logger.info(f"Restoring cluster from snapshot {s}")
+                self.platform.stop_journal()
+                restored = time.time()
+                self.platform.restore(s)
+                # the snapshots of the later stages are deleted by the restore
+                self.snapshots = {st for st in STAGES if self.platform.has_snapshot(st)}
+                self.stage = s
+                if self.stream_journal:
+                    # the journal of the nodes is restored as well, with the entries already streamed
+                    self.platform.stream_journal(since=restored)
+                return
+
+        if not self.owned:
+            raise Exception(f"cluster cannot be set up again at stage {stage}: it was not set up "
+                            f"by the tests and there is no snapshot for the stage")
+
+        logger.info("Deploying a new cluster")
+        self.teardown()
+        self.platform.utils.setup_ssh()
+        self.stage = None
+
+    def teardown(self):
+        """Destroys the cluster if it was created by the session"""
+        if not self.owned:
+            return
+        self.owned = False
+        self.platform.stop_journal()
+        try:
+            self.platform.gather_logs()
+        finally:
+            self.platform.cleanup()
+            Skuba.cleanup(self.conf)
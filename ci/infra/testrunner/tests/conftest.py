@@ -1,10 +1,18 @@
+import os
+import re
+import uuid
+
 import pytest
 
 import platforms
+from impact import REPO_DIR, ImpactTest, TestImpact, read_changed_files
 from kubectl import Kubectl
+from perf import record_run
+from results import ResultCache, cache_key, file_hash, git_commit, sources_hash
 from skuba import Skuba
-from utils import BaseConfig
-from tests.utils import (check_pods_ready, wait)
+from tests.accounting import TimeAccounting
+from tests.cluster import SharedCluster
+from utils import (BaseConfig, polling, tracing)
 
 
 def pytest_addoption(parser):
@@ -20,73 +28,117 @@ def pytest_addoption(parser):
                           "'provisioned' For when you have already provisioned the nodes.\n"
                           "'bootstrapped' For when you have already bootstrapped the cluster.\n"
                           "'deployed' For when you already have a fully deployed cluster.")
+    parser.addoption("--restore",
+                     choices=['provisioned', 'bootstrapped', 'deployed'],
+                     help="Restore the cluster from the snapshot of the given setup step, saved with "
+                          "--snapshot, instead of executing the setup up to that step. Disruptive "
+                          "tests restore the snapshots as well. The cluster is not destroyed after the tests.")
+    parser.addoption("--snapshot", action="store_true",
+                     help="Save a snapshot of the cluster after each setup step. The cluster "
+                          "is not destroyed after the tests.")
+    parser.addoption("--changed-files",
+                     help="File with the paths changed, relative to the repository root, one per line. "
+                          "Only the tests impacted by the changes and the smoke tests are executed.")
+    parser.addoption("--reuse-results", action="store_true",
+                     help="Skip the tests which already passed with the same skuba build, kubernetes "
+                          "version, platform, topology and test sources.")
+    parser.addoption("--stream-journal", action="store_true",
+                     help="Stream the journal of the nodes to their log dir while the tests run, "
+                          "instead of collecting it when the cluster is destroyed.")
 
 
-@pytest.fixture
-def provision(request, platform):
-    if request.config.getoption("skip_setup") in ['provisioned', 'bootstrapped', 'deployed']:
-        return
+def pytest_configure(config):
+    config.pluginmanager.register(TimeAccounting(), "time_accounting")
+    # the summary only covers the polling loops of this session
+    polling.reset_stats()
 
-    def cleanup():
-        platform.gather_logs()
-        platform.cleanup()
 
-    request.addfinalizer(cleanup)
+@pytest.fixture(scope="session")
+def cluster(request, conf, platform, skuba, kubectl):
+    """The cluster shared by the tests of the session"""
+    shared = SharedCluster(conf, platform, skuba, kubectl,
+                           skip_setup=request.config.getoption("skip_setup"),
+                           restore=request.config.getoption("restore"),
+                           snapshot=request.config.getoption("snapshot"),
+                           stream_journal=request.config.getoption("stream_journal"))
+
+    def teardown():
+        shared.platform.stop_journal()
+        if not shared.keep():
+            shared.teardown()
 
-    platform.provision()
+    request.addfinalizer(teardown)
+    return shared
+
+
+def _require(request, cluster, stage):
+    """Brings the shared cluster to the stage. Disruptive tests get a clean
+    cluster and leave it dirty, so the next test gets a clean one as well"""
+    disruptive = request.node.get_closest_marker("disruptive") is not None
+    cluster.require(stage, clean=disruptive)
+    if disruptive:
+        request.addfinalizer(cluster.mark_dirty)
 
 
 @pytest.fixture
-def bootstrap(request, provision, skuba):
+def provision(request, cluster):
+    _require(request, cluster, "provisioned")
 
-    if request.config.getoption("skip_setup") in ['bootstrapped', 'deployed']:
-        return
 
-    skuba.cluster_init()
-    skuba.node_bootstrap()
+@pytest.fixture
+def bootstrap(request, cluster):
+    _require(request, cluster, "bootstrapped")
 
 
 @pytest.fixture
-def deployment(request, bootstrap, skuba, kubectl):
-    if request.config.getoption("skip_setup") == 'deployed':
-        return
+def deployment(request, cluster):
+    _require(request, cluster, "deployed")
+
 
-    skuba.join_nodes()
-    wait(check_pods_ready,
-         kubectl,
-         namespace="kube-system",
-         wait_delay=60,
-         wait_timeout=10,
-         wait_backoff=60,
-         wait_elapsed=60 * 30,
-         wait_allow=(AssertionError))
+@pytest.fixture
+def namespace(request, deployment, kubectl):
+    """Creates a namespace for the test, deleted after the test"""
+    name = re.sub(r"[^a-z0-9-]", "-", request.node.name.lower())[:50].strip("-")
+    name = f"{name}-{uuid.uuid4().hex[:6]}"
+    kubectl.run_kubectl(f"create namespace {name}")
+    request.addfinalizer(lambda: kubectl.run_kubectl(f"delete namespace {name} --wait=false"))
+    return name
 
 
 @pytest.fixture
+def cleanup(request):
+    """Registers functions to be called after the test, even if it fails, in reverse order
+    of registration. Used for removing what the test created in the shared cluster"""
+    def register(func, *args, **kwargs):
+        request.addfinalizer(lambda: func(*args, **kwargs))
+    return register
+
+
+@pytest.fixture(scope="session")
 def conf(request):
     """Builds a conf object from a yaml file"""
     path = request.config.getoption("vars")
     return BaseConfig(path)
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def target(request):
     """Returns the target platform"""
     platform = request.config.getoption("platform")
     return platform
 
 
-@pytest.fixture
-def skuba(conf, target):
-    return Skuba(conf, target)
+@pytest.fixture(scope="session")
+def skuba(conf, platform):
+    return Skuba(conf, platform)
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def kubectl(conf):
     return Kubectl(conf)
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def platform(conf, target):
     platform = platforms.get_platform(conf, target)
     return platform
@@ -104,3 +156,145 @@ def setup(request, platform, skuba):
     request.addfinalizer(cleanup)
 
     platform.provision(num_master=3, num_worker=3)
+
+
+def _test_impact(config):
+    conf = BaseConfig(config.getoption("vars"))
+    return TestImpact(conf.test.impact_file, ignore=conf.test.impact_ignore)
+
+
+def pytest_collection_modifyitems(config, items):
+    _select_impacted(config, items)
+    _skip_cached(config, items)
+
+
+def _select_impacted(config, items):
+    """Deselects the tests not impacted by the changed files. Parallel workers
+    get the tests already selected, and only learn from the failures"""
+    changed_files = config.getoption("changed_files")
+    if not changed_files or os.environ.get("TESTRUNNER_WORKER"):
+        return
+
+    tests = {}
+    for item in items:
+        paths = [path for marker in item.iter_markers("impact") for path in marker.args]
+        tests[item.nodeid] = ImpactTest(item.nodeid, os.path.relpath(str(item.fspath), REPO_DIR), paths=paths,
+                                        smoke=item.get_closest_marker("smoke") is not None)
+    selected = {test.nodeid for test in _test_impact(config).select(list(tests.values()),
+                                                                    read_changed_files(changed_files))}
+
+    deselected = [item for item in items if item.nodeid not in selected]
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = [item for item in items if item.nodeid in selected]
+
+
+# Sources shared by all the tests, included in the key of the cached results
+SHARED_SOURCES = ("conftest.py", "utils.py", "cluster.py")
+
+_result_keys = {}
+
+
+def _result_cache(config):
+    conf = BaseConfig(config.getoption("vars"))
+    return ResultCache(conf.test.result_cache_dir, size=conf.test.result_cache_size)
+
+
+def _result_fields(config):
+    """Returns the inputs of the tests shared by all of them, or None if the skuba binary is not found"""
+    conf = BaseConfig(config.getoption("vars"))
+    binary = file_hash(conf.skuba.binpath)
+    if binary is None:
+        return None
+    return {
+        "skuba_commit": git_commit(REPO_DIR),
+        # the skuba binary determines the kubernetes version of the cluster
+        "skuba_binary": binary,
+        "platform": config.getoption("platform"),
+        "masters": conf.terraform.master.count,
+        "workers": conf.terraform.worker.count,
+    }
+
+
+def _skip_cached(config, items):
+    """Computes the key of the result of each test and, with --reuse-results,
+    skips the tests which already passed under the same key"""
+    fields = _result_fields(config)
+    if fields is None:
+        return
+
+    tests_dir = os.path.dirname(__file__)
+    shared = [os.path.join(tests_dir, source) for source in SHARED_SOURCES]
+    # the testrunner libraries used by the tests (checks, kubectl, platforms, skuba, utils...)
+    fields["testrunner"] = sources_hash(os.path.dirname(tests_dir), exclude=(tests_dir,))
+    sources = {}
+    cache = _result_cache(config)
+    for item in items:
+        module = str(item.fspath)
+        if module not in sources:
+            sources[module] = file_hash(module, *shared)
+        item_fields = {**fields, "source": sources[module]}
+        key = cache_key(item_fields, item.nodeid)
+        _result_keys[item.nodeid] = (key, item_fields)
+
+        if config.getoption("reuse_results"):
+            entry = cache.get(key)
+            if entry is not None:
+                item.user_properties.append(("cached", key))
+                item.add_marker(pytest.mark.skip(reason=f"cached: passed in {entry['duration']:.0f}s "
+                                                        f"with the same inputs ({key[:12]})"))
+
+
+_failed = set()
+_passed = {}
+
+
+def pytest_runtest_logreport(report):
+    current = tracing.current_span()
+    if current is not None and current.category == "test" and report.outcome != "passed":
+        current.outcome = report.outcome
+    if report.failed:
+        _passed.pop(report.nodeid, None)
+        if "flaky" not in report.keywords:
+            _failed.add(report.nodeid.split("::")[0])
+    elif report.when == "call" and report.passed:
+        _passed[report.nodeid] = report.duration
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_protocol(item):
+    """Records each test as a span, so the steps it executes, including the setup of
+    the cluster by its fixtures, are nested in it"""
+    with tracing.span(item.nodeid, category="test"):
+        yield
+
+
+def pytest_sessionfinish(session):
+    """Records the changed files as impacting the modules of the failed tests and the
+    results of the tests which passed. When pytest is not executed by the testrunner
+    (e.g. parallel workers), writes the trace of the steps and records their timings"""
+    if tracing.current_span() is None and tracing.tracer().spans:
+        name = f"test-{os.environ.get('TESTRUNNER_WORKER', 'pytest')}"
+        conf = BaseConfig(session.config.getoption("vars"))
+        tracing.write_run(conf.log.trace_dir, name)
+        record_run(conf, "test", session.config.getoption("platform"), tracing.tracer())
+
+    changed_files = session.config.getoption("changed_files")
+    if changed_files and _failed:
+        modules = {os.path.relpath(os.path.join(str(session.config.rootdir), path), REPO_DIR) for path in _failed}
+        _test_impact(session.config).learn(read_changed_files(changed_files), modules)
+
+    if _passed and _result_keys:
+        cache = _result_cache(session.config)
+        for nodeid, duration in _passed.items():
+            if nodeid in _result_keys:
+                key, fields = _result_keys[nodeid]
+                cache.put(key, nodeid, duration, fields=fields)
+        cache.evict()
+
+
+def pytest_terminal_summary(terminalreporter):
+    """Reports the attempts and time of the polling loops executed by the tests"""
+    if polling.stats():
+        terminalreporter.write_sep("=", "polling summary")
+        terminalreporter.write_line(polling.report())
@@ -1,7 +1,12 @@
+import logging
 import os
 
 import pytest
 
+from parallel import ParallelRunner, collect, estimate_durations, junit_durations, shard
+
+logger = logging.getLogger('testrunner')
+
 FILEPATH = os.path.realpath(__file__)
 TESTRUNNER_DIR = os.path.dirname(os.path.dirname(FILEPATH))
 
@@ -22,7 +27,71 @@ class TestDriver:
 
     def run(self, module=None, test_suite=None,
             test=None, verbose=False, collect=False,
-            skip_setup=None, mark=None, junit=None, traceback="short"):
+            skip_setup=None, mark=None, junit=None, traceback="short", restore=None, snapshot=False,
+            workers=1, pool=None, durations_from=None, changed_files=None, reuse_results=False,
+            stream_journal=False):
+        """Runs the tests with pytest.
+        With more than one worker, the tests are distributed among workers which use
+        their own stack or, if a ClusterPool is given, clusters leased from the pool.
+        With a ClusterPool, a single worker leases clusters from the pool as well.
+        durations_from: JUnit reports with the durations of the tests, used for
+                        distributing them. Defaults to the previous junit report
+        changed_files: file with the paths changed, for executing only the tests impacted
+        reuse_results: skip the tests which already passed with the same inputs
+        stream_journal: stream the journal of the nodes while the tests run
+        """
+        if (workers > 1 or pool is not None) and not collect:
+            if skip_setup is not None or restore is not None:
+                raise ValueError("Parallel workers set up their own clusters: "
+                                 "--skip-setup and --restore are not supported")
+            junit_path = f"{TESTRUNNER_DIR}/{junit or 'parallel'}.xml"
+            opts = self._opts(verbose=verbose, mark=mark, traceback=traceback, snapshot=snapshot,
+                              changed_files=changed_files, reuse_results=reuse_results,
+                              stream_journal=stream_journal)
+            test_path = self._test_path(module, test_suite, test)
+            os.chdir(TESTRUNNER_DIR)
+            runner = ParallelRunner(self.conf, self.platform, workers, TESTRUNNER_DIR, pool=pool)
+            result = runner.run(opts, test_path, junit_path, durations_from=durations_from or [junit_path])
+            self._exit(result)
+
+        opts = self._opts(verbose=verbose, collect=collect, skip_setup=skip_setup, mark=mark,
+                          junit=junit, traceback=traceback, restore=restore, snapshot=snapshot,
+                          changed_files=changed_files, reuse_results=reuse_results,
+                          stream_journal=stream_journal)
+
+        # Path must be the last argument
+        opts.append(self._test_path(module, test_suite, test))
+
+        # Before running the tests, switch to the directory of the testrunner.py
+        os.chdir(TESTRUNNER_DIR)
+
+        self._exit(pytest.main(args=opts))
+
+    def shard(self, index, total, durations_from, module=None, test_suite=None, mark=None):
+        """Returns the tests of a shard, as arguments for pytest executed from the
+        testrunner directory. The tests are distributed among the shards by their
+        durations in the JUnit files, which must be the same for all the shards, so
+        the shards computed by each agent don't overlap
+        """
+        missing = [path for path in durations_from if not os.path.isfile(path)]
+        if missing:
+            raise FileNotFoundError(f"JUnit files with the test durations not found: {', '.join(missing)}")
+
+        opts = self._opts(mark=mark)
+        test_path = self._test_path(module, test_suite, None)
+        os.chdir(TESTRUNNER_DIR)
+        items = collect(opts, test_path, TESTRUNNER_DIR)
+        estimate_durations(items, junit_durations(durations_from), default=self.conf.test.default_duration)
+
+        tests = shard(items, index, total)
+        average = sum(item.duration for item in items) / total
+        logger.info(f"Shard {index}/{total}: {len(tests)} of {len(items)} tests, estimated "
+                    f"{sum(item.duration for item in tests):.0f}s (average {average:.0f}s)")
+        return [item.arg for item in tests]
+
+    def _opts(self, verbose=False, collect=False, skip_setup=None, mark=None, junit=None,
+              traceback="short", restore=None, snapshot=False, changed_files=None, reuse_results=False,
+              stream_journal=False):
         opts = []
 
         vars_opt = "--vars={}".format(self.conf.yaml_path)
@@ -46,14 +115,32 @@ class TestDriver:
         if skip_setup is not None:
             opts.append(f"--skip-setup={skip_setup}")
 
+        if restore is not None:
+            opts.append(f"--restore={restore}")
+
+        if snapshot:
+            opts.append("--snapshot")
+
         if junit is not None:
             opts.append(f"--junitxml={TESTRUNNER_DIR}/{junit}.xml")
 
         if mark is not None:
             opts.append(f'-m {mark}')
 
+        if changed_files is not None:
+            opts.append(f"--changed-files={os.path.abspath(changed_files)}")
+
+        if reuse_results:
+            opts.append("--reuse-results")
+
+        if stream_journal:
+            opts.append("--stream-journal")
+
         opts.append(f'--tb={traceback}')
+        return opts
 
+    @staticmethod
+    def _test_path(module, test_suite, test):
         test_path = module if module is not None else "tests"
 
         if test_suite:
@@ -66,14 +153,10 @@ class TestDriver:
                 raise ValueError("Test suite is required for selecting a test")
             test_path = "{}::{}".format(test_path, test)
 
-        # Path must be the last argument
-        opts.append(test_path)
-
-        # Before running the tests, switch to the directory of the testrunner.py
-        os.chdir(TESTRUNNER_DIR)
-
-        result = pytest.main(args=opts)
+        return test_path
 
+    @staticmethod
+    def _exit(result):
         if result in [0, 1]:
             raise SystemExit(result)
 
@@ -5,6 +5,8 @@ import re
 
 from tests.utils import get_skuba_configuration_dict, replace_skuba_config
 
+pytestmark = pytest.mark.impact("internal/pkg/skuba/addons", "pkg/skuba/actions/addon")
+
 
 def addons_up_to_date(skuba):
     all_fine = re.compile(
@@ -44,6 +46,7 @@ def remove_one_addon(addons_dict, skip=None):
     raise Exception('Could not remove any addon!')
 
 
+@pytest.mark.disruptive
 def test_addon_upgrade_apply(deployment, kubectl, skuba):
     skubaconf_dict = get_skuba_configuration_dict(kubectl)
     addons_dict = skubaconf_dict['AddonsVersion']
@@ -63,7 +66,7 @@ def test_addon_upgrade_apply(deployment, kubectl, skuba):
     assert addons_up_to_date(skuba)
 
 
-def test_addon_upgrade_plan(deployment, kubectl, skuba):
+def test_addon_upgrade_plan(deployment, kubectl, skuba, cleanup):
     assert addons_up_to_date(skuba)
 
     skubaconf_dict = get_skuba_configuration_dict(kubectl)
@@ -80,13 +83,12 @@ def test_addon_upgrade_plan(deployment, kubectl, skuba):
     )
     n_addon_msg = '{0}: {1} (new addon)'.format(rm_addon[0], rm_addon[1])
 
+    cleanup(replace_skuba_config,
+            kubectl, "SkubaConfiguration='{0}'".format(yaml.dump(skubaconf_orig)))
     replace_skuba_config(
         kubectl, "SkubaConfiguration='{0}'".format(yaml.dump(skubaconf_dict))
     )
     out = skuba.addon_upgrade('plan')
-    replace_skuba_config(
-        kubectl, "SkubaConfiguration='{0}'".format(yaml.dump(skubaconf_orig))
-    )
 
     assert out.find(u_manif_msg) != -1
     assert out.find(u_img_msg) != -1
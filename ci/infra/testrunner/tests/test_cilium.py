@@ -6,19 +6,21 @@ import pytest
 
 from tests.utils import wait
 
+pytestmark = pytest.mark.impact("internal/pkg/skuba/addons/cilium*", "internal/pkg/skuba/cni")
+
+
 logger = logging.getLogger("testrunner")
 
 
 @pytest.mark.flaky
-def test_cillium(deployment, kubectl):
-    landing_req = 'curl -sm10 -XPOST deathstar.default.svc.cluster.local/v1/request-landing'
+def test_cillium(deployment, namespace, kubectl):
+    landing_req = f'curl -sm10 -XPOST deathstar.{namespace}.svc.cluster.local/v1/request-landing'
 
     logger.info("Deploy deathstar")
-    kubectl.run_kubectl("create -f https://raw.githubusercontent.com/cilium/cilium/v1.6/examples/minikube/http-sw-app.yaml")
+    kubectl.run_kubectl(f"create -f https://raw.githubusercontent.com/cilium/cilium/v1.6/examples/minikube/http-sw-app.yaml -n {namespace}")
 
-    # FIXME: This check should be only get the star wars application's pods
     wait(kubectl.run_kubectl,
-         "wait --for=condition=ready pods --all --timeout=0",
+         f"wait --for=condition=ready pods --all --timeout=0 -n {namespace}",
          wait_delay=30,
          wait_timeout=10,
          wait_backoff=30,
@@ -28,11 +30,11 @@ def test_cillium(deployment, kubectl):
     time.sleep(100)
 
     logger.info("Check with L3/L4 policy")
-    kubectl.run_kubectl("create -f https://raw.githubusercontent.com/cilium/cilium/v1.6/examples/minikube/sw_l3_l4_policy.yaml")
-    tie_out = kubectl.run_kubectl("exec tiefighter -- {}".format(landing_req))
+    kubectl.run_kubectl(f"create -f https://raw.githubusercontent.com/cilium/cilium/v1.6/examples/minikube/sw_l3_l4_policy.yaml -n {namespace}")
+    tie_out = kubectl.run_kubectl("exec tiefighter -n {} -- {}".format(namespace, landing_req))
     assert 'Ship landed' in tie_out
 
-    xwing_out = kubectl.run_kubectl("exec xwing -- {} 2>&1 || :".format(landing_req))
+    xwing_out = kubectl.run_kubectl("exec xwing -n {} -- {} 2>&1 || :".format(namespace, landing_req))
     assert 'terminated with exit code 28' in xwing_out
 
     logger.info("Check status (N/N)")
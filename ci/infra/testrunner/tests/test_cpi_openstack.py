@@ -4,6 +4,13 @@ from skuba import Skuba
 from utils import BaseConfig
 from tests.utils import (check_pods_ready, wait)
 
+pytestmark = pytest.mark.impact(
+    "ci/infra/openstack",
+    "pkg/skuba/actions/cluster/init",
+    "internal/pkg/skuba/deployments/ssh/kubelet.go",
+)
+
+
 CINDER_YAML = '''
 apiVersion: storage.k8s.io/v1
 kind: StorageClass
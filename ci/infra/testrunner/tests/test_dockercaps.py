@@ -4,6 +4,9 @@ import pytest
 
 from tests.utils import (check_pods_ready, wait)
 
+pytestmark = pytest.mark.impact("pkg/skuba/actions/cluster/init", "internal/pkg/skuba/deployments/ssh/cri.go")
+
+
 logger = logging.getLogger("testrunner")
 
 MANIFEST = """---
@@ -59,13 +62,14 @@ spec:
 
 
 @pytest.mark.flaky
-def test_dockercaps(deployment, kubectl):
+def test_dockercaps(deployment, namespace, kubectl):
     logger.info("Deploy testcases")
     kubectl.run_kubectl(
-        "apply -f -", stdin=MANIFEST.encode())
+        f"apply -f - -n {namespace}", stdin=MANIFEST.encode())
 
     wait(check_pods_ready,
          kubectl,
+         namespace=namespace,
          wait_delay=30,
          wait_timeout=10,
          wait_backoff=30,
@@ -76,15 +80,11 @@ def test_dockercaps(deployment, kubectl):
     pods = ["sle12sp4", "leap", "sle15", "sle15sp1", "sle15sp2"]
     for container in pods:
         output = kubectl.run_kubectl(
-            "exec -it {} -- su root -c id".format(container))
+            "exec -it {} -n {} -- su root -c id".format(container, namespace))
         assert 'uid=0' in output
 
     logger.info("Test: Add a new user to the containers")
     for container in pods:
         output = kubectl.run_kubectl(
-            "exec -it {} -- useradd panos".format(container))
+            "exec -it {} -n {} -- useradd panos".format(container, namespace))
         assert 'PAM' not in output
-
-    # Remove the testing pods
-    kubectl.run_kubectl(
-        "delete -f -", stdin=MANIFEST.encode())
@@ -4,6 +4,8 @@ import requests
 import tempfile
 import time
 
+pytestmark = pytest.mark.impact("internal/pkg/skuba/addons/cilium*", "internal/pkg/skuba/addons/psp.go")
+
 
 GATEWAY_HTTPBIN = ("""
 ---
@@ -11,7 +13,7 @@ apiVersion: networking.istio.io/v1beta1
 kind: Gateway
 metadata:
   name: httpbin-gateway
-  namespace: default
+  namespace: {namespace}
 spec:
   selector:
     istio: ingressgateway
@@ -31,7 +33,7 @@ apiVersion: networking.istio.io/v1beta1
 kind: Gateway
 metadata:
   name: httpbin-gateway
-  namespace: default
+  namespace: {namespace}
 spec:
   selector:
     istio: ingressgateway
@@ -77,7 +79,7 @@ ISTIO_VERSION = "1.5"
 ISTIO_VERSION_PATCH = ISTIO_VERSION + ".9"
 ISTIO_URL = "https://raw.githubusercontent.com/istio/istio/release-" + ISTIO_VERSION + "/samples"
 
-def _istio_httpbin_setup(kubectl):
+def _istio_httpbin_setup(kubectl, namespace):
     istioctl = ("""
                 istioctl --kubeconfig={config} manifest apply \
                          --set profile=default \
@@ -92,11 +94,12 @@ def _istio_httpbin_setup(kubectl):
     kubectl.utils.runshellcommand(istioctl)
     kubectl.run_kubectl("-n istio-system wait --for=condition=available deploy/istio-ingressgateway --timeout=3m")
 
-    kubectl.run_kubectl(f"apply -f {ISTIO_URL}/httpbin/httpbin.yaml")
+    kubectl.run_kubectl(f"apply -n {namespace} -f {ISTIO_URL}/httpbin/httpbin.yaml")
 
 
 def _cleanup(kubectl):
-    kubectl.run_kubectl(f"delete -f {ISTIO_URL}/httpbin/httpbin.yaml")
+    # httpbin and its istio config are removed with the namespace of the test
+    kubectl.run_kubectl("-n istio-system delete --ignore-not-found secret httpbin-credential")
     istioctl_delete = ("""
                        istioctl --kubeconfig={config} manifest generate \
                                 --set profile=default \
@@ -111,14 +114,14 @@ def _cleanup(kubectl):
     kubectl.utils.runshellcommand(istioctl_delete)
 
 
-def _test_non_TLS(kubectl, worker_ip, logger):
+def _test_non_TLS(kubectl, namespace, worker_ip, logger):
     """
     Verify that httpbin service can be accessed through the istio ingress
     """
 
     logger.info("Create the istio config")
-    kubectl.run_kubectl("apply -f - << EOF " + GATEWAY_HTTPBIN)
-    kubectl.run_kubectl("apply -f - << EOF " + VIRTUALSERVICE_HTTPBIN)
+    kubectl.run_kubectl("apply -f - << EOF " + GATEWAY_HTTPBIN.format(namespace=namespace))
+    kubectl.run_kubectl(f"apply -n {namespace} -f - << EOF " + VIRTUALSERVICE_HTTPBIN)
 
     # Wait for istio to digest the config
     time.sleep(100)
@@ -133,7 +136,7 @@ def _test_non_TLS(kubectl, worker_ip, logger):
     assert 200 == r.status_code
 
 
-def _test_TLS(kubectl, worker_ip, logger):
+def _test_TLS(kubectl, namespace, worker_ip, logger):
     """
     Verify that httpbin service can be accessed through the istio ingress using TLS
     """
@@ -151,7 +154,7 @@ def _test_TLS(kubectl, worker_ip, logger):
     kubectl.run_kubectl("-n istio-system create secret tls httpbin-credential --key=httpbin.example.com.key --cert=httpbin.example.com.crt")
 
     logger.info("Create the istio config")
-    kubectl.run_kubectl("apply -f - << EOF " + GATEWAY_HTTPBIN_SECURE)
+    kubectl.run_kubectl("apply -f - << EOF " + GATEWAY_HTTPBIN_SECURE.format(namespace=namespace))
  
     # Wait for istio to digest the config
     time.sleep(60)
@@ -170,19 +173,18 @@ def _test_TLS(kubectl, worker_ip, logger):
     assert "HTTP/2 200" in output
 
 
-def test_istio_ingress(deployment, platform, skuba, kubectl):
+def test_istio_ingress(deployment, namespace, platform, skuba, kubectl, cleanup):
     logger = logging.getLogger("testrunner")
     logger.info("Deploying istio and httpbin")
-    _istio_httpbin_setup(kubectl)
+    cleanup(_cleanup, kubectl)
+    _istio_httpbin_setup(kubectl, namespace)
 
     wrk_idx = 0
     ip_addresses = platform.get_nodes_ipaddrs("worker")
     worker_ip = ip_addresses[wrk_idx]
 
     logger.info("Testing the non-TLS use case")
-    _test_non_TLS(kubectl, worker_ip, logger)
+    _test_non_TLS(kubectl, namespace, worker_ip, logger)
 
     logger.info("Testing now the TLS use case")
-    _test_TLS(kubectl, worker_ip, logger)
-
-    _cleanup(kubectl)
+    _test_TLS(kubectl, namespace, worker_ip, logger)
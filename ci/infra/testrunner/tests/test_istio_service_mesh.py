@@ -2,6 +2,9 @@ import logging
 import pytest
 import time
 
+pytestmark = pytest.mark.impact("internal/pkg/skuba/addons/cilium*", "internal/pkg/skuba/addons/psp.go")
+
+
 CLUSTERROLEBINDING = ("""
 ---
 apiVersion: rbac.authorization.k8s.io/v1
@@ -15,25 +18,25 @@ roleRef:
 subjects:
 - kind: ServiceAccount
   name: default
-  namespace: default
+  namespace: {namespace}
 - kind: ServiceAccount
   name: httpbin
-  namespace: default
+  namespace: {namespace}
 - kind: ServiceAccount
   name: bookinfo-productpage
-  namespace: default
+  namespace: {namespace}
 - kind: ServiceAccount
   name: bookinfo-reviews
-  namespace: default
+  namespace: {namespace}
 - kind: ServiceAccount
   name: bookinfo-ratings 
-  namespace: default
+  namespace: {namespace}
 - kind: ServiceAccount
   name: bookinfo-details
-  namespace: default
+  namespace: {namespace}
 - kind: ServiceAccount
   name: sleep
-  namespace: default
+  namespace: {namespace}
 EOF
 """)
 
@@ -41,7 +44,7 @@ ISTIO_VERSION = "1.5"
 ISTIO_VERSION_PATCH = ISTIO_VERSION + ".9"
 ISTIO_URL = "https://raw.githubusercontent.com/istio/istio/release-" + ISTIO_VERSION + "/samples"
 
-def _istio_bookinfo_setup(kubectl):
+def _istio_bookinfo_setup(kubectl, namespace):
     istioctl = ("""
                 istioctl --kubeconfig={config} manifest apply \
                          --set profile=default \
@@ -56,33 +59,28 @@ def _istio_bookinfo_setup(kubectl):
     kubectl.utils.runshellcommand(istioctl)
     kubectl.run_kubectl("-n istio-system wait --for=condition=available deploy/istio-ingressgateway --timeout=3m")
 
-    # Activate service in namespace default
-    kubectl.run_kubectl("label namespace default istio-injection=enabled --overwrite")
+    # Activate service in the namespace of the test
+    kubectl.run_kubectl(f"label namespace {namespace} istio-injection=enabled --overwrite")
 
     # Create the clusterrolebinding to run everything
-    kubectl.run_kubectl("apply -f - << EOF " + CLUSTERROLEBINDING)
+    kubectl.run_kubectl("apply -f - << EOF " + CLUSTERROLEBINDING.format(namespace=namespace))
 
     # Deploy bookinfo application
-    kubectl.run_kubectl(f"apply -f {ISTIO_URL}/bookinfo/platform/kube/bookinfo.yaml")
-    kubectl.run_kubectl("-n default wait --for=condition=available deploy/productpage-v1 --timeout=3m")
+    kubectl.run_kubectl(f"apply -n {namespace} -f {ISTIO_URL}/bookinfo/platform/kube/bookinfo.yaml")
+    kubectl.run_kubectl(f"-n {namespace} wait --for=condition=available deploy/productpage-v1 --timeout=3m")
 
     # Deploy the gateway and destination rules
-    kubectl.run_kubectl(f"apply -f {ISTIO_URL}/bookinfo/networking/bookinfo-gateway.yaml")
-    kubectl.run_kubectl(f"apply -f {ISTIO_URL}/bookinfo/networking/destination-rule-all.yaml")
+    kubectl.run_kubectl(f"apply -n {namespace} -f {ISTIO_URL}/bookinfo/networking/bookinfo-gateway.yaml")
+    kubectl.run_kubectl(f"apply -n {namespace} -f {ISTIO_URL}/bookinfo/networking/destination-rule-all.yaml")
 
     # Deploy the sleep pod that we use as client
-    kubectl.run_kubectl(f"apply -f {ISTIO_URL}/sleep/sleep.yaml")
-    kubectl.run_kubectl("-n default wait --for=condition=available deploy/sleep --timeout=3m")
+    kubectl.run_kubectl(f"apply -n {namespace} -f {ISTIO_URL}/sleep/sleep.yaml")
+    kubectl.run_kubectl(f"-n {namespace} wait --for=condition=available deploy/sleep --timeout=3m")
 
 
 def _cleanup(kubectl):
-    kubectl.run_kubectl(f"delete -f {ISTIO_URL}/bookinfo/platform/kube/bookinfo.yaml")
-    kubectl.run_kubectl(f"delete -f {ISTIO_URL}/bookinfo/networking/bookinfo-gateway.yaml")
-    kubectl.run_kubectl(f"delete -f {ISTIO_URL}/bookinfo/networking/destination-rule-all.yaml")
-    kubectl.run_kubectl(f"delete -f {ISTIO_URL}/bookinfo/networking/virtual-service-reviews-v3.yaml")
-    kubectl.run_kubectl(f"delete -f {ISTIO_URL}/sleep/sleep.yaml")
-    kubectl.run_kubectl(f"delete -f {ISTIO_URL}/httpbin/httpbin.yaml")
-    kubectl.run_kubectl("label namespace default istio-injection-")
+    # the applications are removed with the namespace of the test
+    kubectl.run_kubectl("delete --ignore-not-found clusterrolebinding istio-test")
 
 
     istioctl_delete = ("""
@@ -99,7 +97,7 @@ def _cleanup(kubectl):
     kubectl.utils.runshellcommand(istioctl_delete)
 
 
-def _test_traffic_shift(kubectl, logger):
+def _test_traffic_shift(kubectl, namespace, logger):
     '''
     It tests the traffic shift feature of service mesh. There are two versions of the review service, v1 and v3. We will run three subtest:
     1 - All traffic goes to v1
@@ -111,26 +109,26 @@ def _test_traffic_shift(kubectl, logger):
     logger.info("Create the traffic shift config")
 
     v3_string = "glyphicon glyphicon-star"
-    sleep_pod = kubectl.run_kubectl("get pod -l app=sleep -n default -o 'jsonpath={.items..metadata.name}'")
+    sleep_pod = kubectl.run_kubectl(f"get pod -l app=sleep -n {namespace} -o 'jsonpath={{.items..metadata.name}}'")
 
     # Create the virtual service that sends 100% of traffic to v1
-    kubectl.run_kubectl(f"apply -f {ISTIO_URL}/bookinfo/networking/virtual-service-all-v1.yaml")
+    kubectl.run_kubectl(f"apply -n {namespace} -f {ISTIO_URL}/bookinfo/networking/virtual-service-all-v1.yaml")
     time.sleep(30)
 
     # We shouldn't find the v3 string because all traffic goes to v1
     for i in range(5):
-        output = kubectl.run_kubectl("exec {pod} -c sleep -n default -- curl -s http://istio-ingressgateway.istio-system/productpage".format(pod=sleep_pod))
+        output = kubectl.run_kubectl("exec {pod} -c sleep -n {namespace} -- curl -s http://istio-ingressgateway.istio-system/productpage".format(pod=sleep_pod, namespace=namespace))
         assert output.find(v3_string) == -1
         time.sleep(5)
 
     # Now v1 and v3 have 50% weight
-    kubectl.run_kubectl(f"apply -f {ISTIO_URL}/bookinfo/networking/virtual-service-reviews-50-v3.yaml")
+    kubectl.run_kubectl(f"apply -n {namespace} -f {ISTIO_URL}/bookinfo/networking/virtual-service-reviews-50-v3.yaml")
     time.sleep(60)
 
     v1 = 0
     v3 = 0
     for i in range(5):
-        output = kubectl.run_kubectl("exec {pod} -c sleep -n default -- curl -s http://istio-ingressgateway.istio-system/productpage".format(pod=sleep_pod))
+        output = kubectl.run_kubectl("exec {pod} -c sleep -n {namespace} -- curl -s http://istio-ingressgateway.istio-system/productpage".format(pod=sleep_pod, namespace=namespace))
         if output.find(v3_string) > 0:
             v3 += 1
         else:
@@ -142,40 +140,39 @@ def _test_traffic_shift(kubectl, logger):
     assert v3 > 0
 
     # Now v3 has 100% weight
-    kubectl.run_kubectl(f"apply -f {ISTIO_URL}/bookinfo/networking/virtual-service-reviews-v3.yaml")
+    kubectl.run_kubectl(f"apply -n {namespace} -f {ISTIO_URL}/bookinfo/networking/virtual-service-reviews-v3.yaml")
     time.sleep(60)
 
     for i in range(5):
-        output = kubectl.run_kubectl("exec {pod} -c sleep -n default -- curl -s http://istio-ingressgateway.istio-system/productpage".format(pod=sleep_pod))
+        output = kubectl.run_kubectl("exec {pod} -c sleep -n {namespace} -- curl -s http://istio-ingressgateway.istio-system/productpage".format(pod=sleep_pod, namespace=namespace))
         assert output.find(v3_string) != -1
         time.sleep(5)
 
-def _test_mTLS(kubectl, logger):
+def _test_mTLS(kubectl, namespace, logger):
     '''
     It tests that mTLS is active (default behaviour) and thus authentication is happening in the service mesh
 
     To do so, we check that there is a client certificate in the HTTP request
     '''
     logger.info("Add httpbin deployment")
-    kubectl.run_kubectl(f"apply -f {ISTIO_URL}/httpbin/httpbin.yaml")
-    kubectl.run_kubectl("-n default wait --for=condition=available deploy/httpbin --timeout=3m")
+    kubectl.run_kubectl(f"apply -n {namespace} -f {ISTIO_URL}/httpbin/httpbin.yaml")
+    kubectl.run_kubectl(f"-n {namespace} wait --for=condition=available deploy/httpbin --timeout=3m")
 
-    sleep_pod = kubectl.run_kubectl("get pod -l app=sleep -n default -o 'jsonpath={.items..metadata.name}'")
-    httpbin_port = kubectl.run_kubectl("get service -l app=httpbin -o 'jsonpath={.items..spec.ports..port}'")
-    output = kubectl.run_kubectl("exec {pod} -c sleep -n default -- curl -s http://httpbin.default:{port}/headers".format(pod=sleep_pod, port=httpbin_port))
+    sleep_pod = kubectl.run_kubectl(f"get pod -l app=sleep -n {namespace} -o 'jsonpath={{.items..metadata.name}}'")
+    httpbin_port = kubectl.run_kubectl(f"get service -l app=httpbin -n {namespace} -o 'jsonpath={{.items..spec.ports..port}}'")
+    output = kubectl.run_kubectl("exec {pod} -c sleep -n {namespace} -- curl -s http://httpbin.{namespace}:{port}/headers".format(pod=sleep_pod, namespace=namespace, port=httpbin_port))
 
     assert output.find("X-Forwarded-Client-Cert") != -1
 
 
-def test_istio_service_mesh(deployment, platform, skuba, kubectl):
+def test_istio_service_mesh(deployment, namespace, platform, skuba, kubectl, cleanup):
     logger = logging.getLogger("testrunner")
     logger.info("Deploying istio and the bookinfo app")
-    _istio_bookinfo_setup(kubectl)
+    cleanup(_cleanup, kubectl)
+    _istio_bookinfo_setup(kubectl, namespace)
 
     logger.info("Testing the traffic shifting")
-    _test_traffic_shift(kubectl, logger)
+    _test_traffic_shift(kubectl, namespace, logger)
 
     logger.info("Testing the authentication")
-    _test_mTLS(kubectl, logger)
-
-    _cleanup(kubectl)
+    _test_mTLS(kubectl, namespace, logger)
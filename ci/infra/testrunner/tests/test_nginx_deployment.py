@@ -1,19 +1,30 @@
 import pytest
 import requests
 
+pytestmark = pytest.mark.impact(
+    "ci/infra/openstack",
+    "ci/infra/vmware",
+    "ci/infra/libvirt",
+    "ci/infra/bare-metal",
+    "pkg/skuba/actions/cluster/init",
+    "pkg/skuba/actions/node/bootstrap",
+    "pkg/skuba/actions/node/join",
+)
+
 
 @pytest.mark.pr
-def test_nginx_deployment(deployment, platform, skuba, kubectl):
+@pytest.mark.smoke
+def test_nginx_deployment(deployment, namespace, platform, skuba, kubectl):
     workers = skuba.num_of_nodes("worker")
-    kubectl.run_kubectl("create deployment nginx --image=nginx:stable-alpine")
-    kubectl.run_kubectl("scale deployment nginx --replicas={replicas}".format(replicas=workers))
-    kubectl.run_kubectl("expose deployment nginx --port=80 --type=NodePort")
-    kubectl.run_kubectl("wait --for=condition=available deploy/nginx --timeout=3m")
-    readyReplicas = kubectl.run_kubectl("get deployment/nginx -o jsonpath='{ .status.readyReplicas }'")
+    kubectl.run_kubectl(f"create deployment nginx --image=nginx:stable-alpine -n {namespace}")
+    kubectl.run_kubectl("scale deployment nginx --replicas={replicas} -n {namespace}".format(replicas=workers, namespace=namespace))
+    kubectl.run_kubectl(f"expose deployment nginx --port=80 --type=NodePort -n {namespace}")
+    kubectl.run_kubectl(f"wait --for=condition=available deploy/nginx --timeout=3m -n {namespace}")
+    readyReplicas = kubectl.run_kubectl(f"get deployment/nginx -o jsonpath='{{ .status.readyReplicas }}' -n {namespace}")
 
     assert int(readyReplicas) == workers
 
-    nodePort = kubectl.run_kubectl("get service/nginx -o jsonpath='{ .spec.ports[0].nodePort }'")
+    nodePort = kubectl.run_kubectl(f"get service/nginx -o jsonpath='{{ .spec.ports[0].nodePort }}' -n {namespace}")
 
     wrk_idx = 0
     ip_addresses = platform.get_nodes_ipaddrs("worker")
@@ -24,11 +35,11 @@ def test_nginx_deployment(deployment, platform, skuba, kubectl):
     assert "Welcome to nginx" in r.text
 
     # Cleanup
-    kubectl.run_kubectl("delete --wait --timeout=60s service/nginx")
-    kubectl.run_kubectl("delete --wait --timeout=60s deployments/nginx")
+    kubectl.run_kubectl(f"delete --wait --timeout=60s service/nginx -n {namespace}")
+    kubectl.run_kubectl(f"delete --wait --timeout=60s deployments/nginx -n {namespace}")
 
     with pytest.raises(Exception):
-        kubectl.run_kubectl("get service/nginx")
+        kubectl.run_kubectl(f"get service/nginx -n {namespace}")
 
     with pytest.raises(Exception):
         kubectl.run_kubectl("get deployments/nginx")
@@ -3,14 +3,19 @@ import time
 
 import pytest
 
-from tests.utils import (check_pods_ready, check_node_is_ready, wait)
+pytestmark = pytest.mark.impact(
+    "skuba-update",
+    "internal/pkg/skuba/deployments/ssh/skuba-update.go",
+    "internal/pkg/skuba/kured",
+    "internal/pkg/skuba/addons/kured.go",
+)
 
-from timeout_decorator import timeout
 
 logger = logging.getLogger("testrunner")
 
 
 @pytest.mark.pr
+@pytest.mark.disruptive
 @pytest.mark.parametrize('role,node', [('master', 1), ('worker', 0)])
 def test_hard_reboot(deployment, platform, kubectl, role, node):
     """ Reboots master and worker nodes and checks they are back ready.
@@ -26,21 +31,8 @@ def test_hard_reboot(deployment, platform, kubectl, role, node):
     time.sleep(60)
 
     # wait the node to become ready
-    wait(check_node_is_ready,
-         platform,
-         kubectl,
-         role,
-         node,
-         wait_delay=30,
-         wait_timeout=10,
-         wait_backoff=30,
-         wait_elapsed=180,
-         wait_allow=(AssertionError))
+    node_name = platform.get_nodes_names(role)[node]
+    kubectl.wait_for_node_ready(node_name, timeout=210)
 
     # wait pods to become ready
-    wait(check_pods_ready,
-         kubectl,
-         wait_timeout=10,
-         wait_backoff=30,
-         wait_elapsed=180,
-         wait_allow=(AssertionError))
+    kubectl.wait_for_pods_ready(timeout=180)
@@ -1,6 +1,12 @@
 import pytest
 from tests.utils import wait
 
+pytestmark = pytest.mark.impact(
+    "pkg/skuba/actions/node/remove",
+    "internal/pkg/skuba/etcd",
+    "internal/pkg/skuba/kubernetes/nodes.go",
+)
+
 
 @pytest.mark.disruptive
 def test_remove_master(deployment, conf, platform, skuba, kubectl):
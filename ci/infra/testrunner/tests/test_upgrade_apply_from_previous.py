@@ -1,6 +1,13 @@
 import pytest
 
-from tests.utils import node_is_ready, node_is_upgraded
+from tests.utils import CURRENT_VERSION, check_node_version, node_is_ready
+
+pytestmark = pytest.mark.impact(
+    "internal/pkg/skuba/upgrade",
+    "pkg/skuba/actions/cluster/upgrade",
+    "pkg/skuba/actions/node/upgrade",
+    "internal/pkg/skuba/kubernetes/versions.go",
+)
 
 
 @pytest.mark.disruptive
@@ -13,6 +20,7 @@ def test_upgrade_apply_from_previous(deployment, platform, skuba, kubectl):
         num_nodes = platform.get_num_nodes(role)
         for n in range(0, num_nodes):
             assert node_is_ready(platform, kubectl, role, n)
-            result = skuba.node_upgrade("apply", role, n)
-            assert result.find("successfully upgraded") != -1
-            assert node_is_upgraded(kubectl, platform, role, n)
+
+    for result in skuba.rolling_upgrade():
+        assert result.output.find("successfully upgraded") != -1
+        check_node_version(platform, kubectl, result.role, result.nr, CURRENT_VERSION)
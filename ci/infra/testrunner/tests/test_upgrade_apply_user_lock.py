@@ -1,6 +1,14 @@
 import pytest
 
-from tests.utils import PREVIOUS_VERSION, node_is_ready, node_is_upgraded, wait
+from tests.utils import CURRENT_VERSION, check_node_version, node_is_ready, wait
+
+pytestmark = pytest.mark.impact(
+    "internal/pkg/skuba/upgrade",
+    "pkg/skuba/actions/cluster/upgrade",
+    "pkg/skuba/actions/node/upgrade",
+    "internal/pkg/skuba/kubernetes/versions.go",
+    "skuba-update",
+)
 
 
 @pytest.mark.disruptive
@@ -15,17 +23,15 @@ def test_upgrade_apply_user_lock(provision, platform, kubectl, skuba):
         "'{\"nodeID\":\"manual\"}'")
     kubectl.run_kubectl(kubectl_cmd)
 
-    for role in ("master", "worker"):
-        num_nodes = platform.get_num_nodes(role)
-        for n in range(0, num_nodes):
-            # disable skuba-update.timer
-            platform.ssh_run(role, n, "sudo systemctl disable --now skuba-update.timer")
-            assert node_is_ready(platform, kubectl, role, n)
-            result = skuba.node_upgrade("apply", role, n)
-            assert result.find("successfully upgraded") != -1
-            assert node_is_upgraded(kubectl, platform, role, n)
-            ssh_cmd = "sudo systemctl is-enabled skuba-update.timer || :"
-            assert platform.ssh_run(role, n, ssh_cmd).find("disabled") != -1
+    def disable_update_timer(role, n):
+        platform.ssh_run(role, n, "sudo systemctl disable --now skuba-update.timer")
+        assert node_is_ready(platform, kubectl, role, n)
+
+    for result in skuba.rolling_upgrade(prepare=disable_update_timer):
+        assert result.output.find("successfully upgraded") != -1
+        check_node_version(platform, kubectl, result.role, result.nr, CURRENT_VERSION)
+        ssh_cmd = "sudo systemctl is-enabled skuba-update.timer || :"
+        assert platform.ssh_run(result.role, result.nr, ssh_cmd).find("disabled") != -1
 
     kubectl_cmd = (r"-n kube-system get ds/kured -o jsonpath="
                    r"'{.metadata.annotations.weave\.works/kured-node-lock}'")
@@ -3,6 +3,14 @@ import pytest
 
 from tests.utils import (check_node_is_ready, check_node_version, CURRENT_VERSION, wait)
 
+pytestmark = pytest.mark.impact(
+    "internal/pkg/skuba/upgrade",
+    "pkg/skuba/actions/cluster/upgrade",
+    "pkg/skuba/actions/node/upgrade",
+    "internal/pkg/skuba/kubernetes/versions.go",
+)
+
+
 # Migrates a node to the upgrate option speficied in the option
 def migrate_node(platform, kubectl, role, node, regcode, option=1):
     platform.ssh_run(role, node, f'sudo SUSEConnect -r {regcode}')
@@ -26,6 +34,7 @@ def migrate_node(platform, kubectl, role, node, regcode, option=1):
         wait_elapsed=180,
         wait_allow=(RuntimeError))
 
+@pytest.mark.disruptive
 def test_upgrade_from_4_2(deployment, platform, skuba, kubectl):
 
     skuba.cluster_upgrade(action="localconfig")
@@ -34,21 +43,20 @@ def test_upgrade_from_4_2(deployment, platform, skuba, kubectl):
     reg_code = os.environ['REG_CODE']
     assert reg_code is not None
 
-    for role in ("master", "worker"):
-        num_nodes = platform.get_num_nodes(role)
-        for node in range(0, num_nodes):
-            migrate_node(platform, kubectl, role, node, reg_code)
-            result = skuba.node_upgrade("apply", role, node)
-            assert result.find("successfully upgraded") != -1
-
-            # check node version is update
-            wait(check_node_version,
-                platform,
-                kubectl,
-                role,
-                node,
-                CURRENT_VERSION,
-                wait_delay=60,
-                wait_backoff=30,
-                wait_elapsed=60 * 10,
-                wait_allow=(AssertionError))
+    def migrate(role, node):
+        migrate_node(platform, kubectl, role, node, reg_code)
+
+    for result in skuba.rolling_upgrade(prepare=migrate):
+        assert result.output.find("successfully upgraded") != -1
+
+        # check node version is update
+        wait(check_node_version,
+            platform,
+            kubectl,
+            result.role,
+            result.nr,
+            CURRENT_VERSION,
+            wait_delay=60,
+            wait_backoff=30,
+            wait_elapsed=60 * 10,
+            wait_allow=(AssertionError))
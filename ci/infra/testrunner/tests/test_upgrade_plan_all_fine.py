@@ -1,5 +1,12 @@
 import pytest
 
+pytestmark = pytest.mark.impact(
+    "internal/pkg/skuba/upgrade",
+    "pkg/skuba/actions/cluster/upgrade",
+    "pkg/skuba/actions/node/upgrade",
+    "internal/pkg/skuba/kubernetes/versions.go",
+)
+
 
 @pytest.mark.disruptive
 def test_upgrade_plan_all_fine(provision, skuba, kubectl, platform):
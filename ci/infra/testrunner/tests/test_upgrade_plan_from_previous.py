@@ -2,6 +2,13 @@ import pytest
 
 from tests.utils import PREVIOUS_VERSION, CURRENT_VERSION
 
+pytestmark = pytest.mark.impact(
+    "internal/pkg/skuba/upgrade",
+    "pkg/skuba/actions/cluster/upgrade",
+    "pkg/skuba/actions/node/upgrade",
+    "internal/pkg/skuba/kubernetes/versions.go",
+)
+
 
 @pytest.mark.disruptive
 def test_upgrade_plan_from_previous(deployment, skuba, kubectl, platform):
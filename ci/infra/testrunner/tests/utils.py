@@ -1,7 +1,9 @@
-import signal
-import time
 import yaml
 
+from kubectl import DEFAULT_NAMESPACE
+from utils.deadline import (DeadlineExceeded, run_with_timeout)
+from utils.polling import (PollingPolicy, poll)
+
 PREVIOUS_VERSION = "1.17.4"
 CURRENT_VERSION = "1.18.6"
 
@@ -10,38 +12,26 @@ def check_node_is_ready(platform, kubectl, role, nr):
     assert node_is_ready(platform, kubectl, role, nr)
 
 def check_nodes_ready(kubectl):
-    # Retrieve the node name and the Ready condition (True, or False)
-    cmd = ("get nodes -o jsonpath='{ range .items[*]}{@.metadata.name}{\":\"}"
-           "{range @.status.conditions[?(.type==\"Ready\")]}{@.status}{\" \"}'")
-
-    nodes = kubectl.run_kubectl(cmd).strip().split(" ")
-    for node in nodes:
-        node_name, node_status = node.split(":")
-        assert node_status == "True", f'Node {node_name} is not Ready'
+    for node in kubectl.snapshot().nodes():
+        assert node.ready, f'Node {node.name} is not Ready'
 
 
 def node_is_ready(platform, kubectl, role, nr):
     node_name = platform.get_nodes_names(role)[nr]
-    cmd = ("get nodes {} -o jsonpath='{{range @.status.conditions[*]}}"
-           "{{@.type}}={{@.status}};{{end}}'").format(node_name)
-
-    return kubectl.run_kubectl(cmd).find("Ready=True") != -1
+    return kubectl.snapshot().node(node_name).ready
 
 
 def node_is_upgraded(kubectl, platform, role, nr):
     node_name = platform.get_nodes_names(role)[nr]
-    for attempt in range(20):
-        if platform.all_apiservers_responsive():
-            # kubernetes might be a little bit slow with updating the NodeVersionInfo
-            cmd = ("get nodes {} -o jsonpath="
-                   "'{{.status.nodeInfo.kubeletVersion}}'").format(node_name)
-            version = kubectl.run_kubectl(cmd)
-            if version.find(PREVIOUS_VERSION) == 0:
-                time.sleep(2)
-            else:
-                break
-        else:
-            time.sleep(2)
+
+    def version_updated():
+        if not platform.all_apiservers_responsive():
+            return False, None
+        # kubernetes might be a little bit slow with updating the NodeVersionInfo
+        version = kubectl.snapshot().node(node_name).kubelet_version
+        return version.find(PREVIOUS_VERSION) != 0, version
+
+    poll(version_updated, timeout=40, policy=PollingPolicy(max_backoff=5))
 
     # allow system pods to come up again after the upgrade
     wait(check_pods_ready,
@@ -52,42 +42,36 @@ def node_is_upgraded(kubectl, platform, role, nr):
          wait_elapsed=60 * 10,
          wait_allow=(AssertionError))
 
-    cmd = "get nodes {} -o jsonpath='{{.status.nodeInfo.kubeletVersion}}'".format(node_name)
-    return kubectl.run_kubectl(cmd).find(CURRENT_VERSION) != -1
+    return kubectl.get_node(node_name).kubelet_version.find(CURRENT_VERSION) != -1
 
 
 def check_node_version(platform, kubectl, role, node, version):
     node_name = platform.get_nodes_names(role)[node]
-    cmd = "get nodes {} -o jsonpath='{{.status.nodeInfo.kubeletVersion}}'".format(node_name)
-    assert kubectl.run_kubectl(cmd).find(CURRENT_VERSION) != -1
+    assert kubectl.get_node(node_name).kubelet_version.find(CURRENT_VERSION) != -1
 
 
 def check_pods_ready(kubectl, namespace=None, node=None, pods=[], statuses=['Running', 'Succeeded']):
+    # like kubectl get pods, without a namespace only the default one is checked
+    found = kubectl.snapshot().pods(namespace=namespace or DEFAULT_NAMESPACE, node=node)
+    if pods:
+        found = [pod for pod in found if pod.name in pods]
+        missing = set(pods) - {pod.name for pod in found}
+        assert not missing, f'Pods not found: {", ".join(sorted(missing))}'
 
-    ns = f'{"--namespace="+namespace if namespace else ""}'
-    node_selector = f'{"--field-selector spec.nodeName="+node if node else ""}'
-    cmd = (f'get pods {" ".join(pods)} {ns} {node_selector} '
-           f'-o jsonpath="{{ range .items[*]}}{{@.metadata.name}}:'
-           f'{{@.status.phase}};"')
-
-    result = kubectl.run_kubectl(cmd)
-    pod_list = result.split(";")
-    for name, status in [pod.split(":") for pod in pod_list if pod != ""]:
-        assert status in statuses, (f'Pod {name} status {status}'
-                                    f'not in expected statuses: {", ".join(statuses)}')
+    for pod in found:
+        assert pod.phase in statuses, (f'Pod {pod.name} status {pod.phase}'
+                                       f'not in expected statuses: {", ".join(statuses)}')
 
 
 def wait(func, *args, **kwargs):
 
-    class TimeoutError(Exception):
-        pass
-
     timeout = kwargs.pop("wait_timeout", 0)
     delay = kwargs.pop("wait_delay", 0)
     backoff = kwargs.pop("wait_backoff", 0)
     retries = kwargs.pop("wait_retries", 0)
     allow = kwargs.pop("wait_allow", ())
     elapsed = kwargs.pop("wait_elapsed", 0)
+    policy = kwargs.pop("wait_policy", None)
 
     if retries > 0 and elapsed > 0:
         raise ValueError("wait_retries and wait_elapsed cannot both have a non zero value")
@@ -95,36 +79,39 @@ def wait(func, *args, **kwargs):
     if retries == 0 and elapsed == 0:
         raise ValueError("either wait_retries  or wait_elapsed must have a non zero value")
 
-    def _handle_timeout(signum, frame):
-        raise TimeoutError()
-
-    start = int(time.time())
-    attempts = 1
+    attempts = 0
     reason = ""
 
-    time.sleep(delay)
-    while True:
-        signal.signal(signal.SIGALRM, _handle_timeout)
-        signal.alarm(timeout)
+    def attempt():
+        nonlocal attempts, reason
+        attempts += 1
         try:
-            return func(*args, **kwargs)
-        except TimeoutError:
+            if timeout > 0:
+                return True, run_with_timeout(func, timeout, *args, **kwargs)
+            return True, func(*args, **kwargs)
+        except DeadlineExceeded:
             reason = "timeout of {}s exceded".format(timeout)
         except allow as ex:
             reason = "{}: '{}'".format(ex.__class__.__name__, ex)
-        finally:
-            signal.alarm(0)
-
-        if elapsed > 0 and int(time.time()) - start >= elapsed:
-            reason = "maximum wait time exceeded: {}s".format(elapsed)
-            break
-
-        if retries > 0 and attempts == retries:
-            break
-
-        time.sleep(backoff)
-
-        attempts = attempts + 1
+        return False, None
+
+    if policy is None:
+        # a limited number of retries is spread over the fixed backoff, as callers count on
+        # the total time it gives. A maximum elapsed time is polled fast at first
+        policy = PollingPolicy() if elapsed > 0 else PollingPolicy(initial=backoff, factor=1, jitter=0)
+
+    done, result = poll(attempt,
+                        timeout=elapsed if elapsed > 0 else None,
+                        retries=retries,
+                        delay=delay,
+                        policy=policy.capped(backoff),
+                        fixed_backoff=backoff,
+                        name=func.__name__)
+    if done:
+        return result
+
+    if elapsed > 0:
+        reason = "maximum wait time exceeded: {}s".format(elapsed)
 
     raise Exception("Failed waiting for function {} after {} attemps due to {}".format(func.__name__, attempts, reason))
 
@@ -143,7 +130,5 @@ def replace_skuba_config(kubectl, configmap_data):
 
 
 def get_skuba_configuration_dict(kubectl):
-    skubaConf_yml = kubectl.run_kubectl(
-        "get configmap skuba-config --namespace kube-system -o jsonpath='{.data.SkubaConfiguration}'"
-    )
+    skubaConf_yml = kubectl.get_configmap("skuba-config", namespace="kube-system").data["SkubaConfiguration"]
     return yaml.load(skubaConf_yml, Loader=yaml.FullLoader)
@@ -2,3 +2,4 @@ from utils.config import (BaseConfig, Constant)
 from utils.format import Format
 from utils.logger import Logger
 from utils.utils import (Utils, step)
+from utils import tracing
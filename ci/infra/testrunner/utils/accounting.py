@@ -0,0 +1,186 @@
+"""Accounting of the wall time of an operation (e.g. a test) by category.
+
+An account is attached to the current context (see contextvars), so the time
+measured by the functions executed under it, including those run in other
+threads with tracing.propagate_context, is charged to it. Measurements can be
+nested: each one is charged the time not spent in the measurements nested in it
+in the same thread, so the categories don't overlap, except for measurements
+running concurrently in several threads.
+
+Categories used by the testrunner:
+
+    sleep                 time.sleep
+    wait                  backoff between the attempts of a polling loop (see utils.polling)
+    subprocess:<binary>   commands executed with Utils.runshellcommand
+    fixture_setup         setup of the pytest fixtures, not spent in any of the above
+    other                 time not charged to any category
+"""
+
+import contextvars
+import os
+import re
+import shlex
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+SLEEP = "sleep"
+WAIT = "wait"
+SUBPROCESS = "subprocess"
+FIXTURE_SETUP = "fixture_setup"
+OTHER = "other"
+
+_current = contextvars.ContextVar("testrunner_account", default=None)
+_frames = contextvars.ContextVar("testrunner_account_frames", default=())
+
+# separators of the commands of a shell command line
+_COMMAND_SEPARATORS = (";", "&&", "||", "&")
+_ASSIGNMENT = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*=")
+
+
+class Account:
+    """Time charged to each category.
+       clock: function returning the current time (seconds)
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.start = clock()
+        self.end = None
+        self.categories = {}
+        self._lock = threading.Lock()
+
+    def charge(self, category, seconds):
+        with self._lock:
+            self.categories[category] = self.categories.get(category, 0) + seconds
+
+    def close(self):
+        if self.end is None:
+            self.end = self.clock()
+
+    def wall(self):
+        """Returns the time elapsed since the account was opened until it was closed"""
+        return (self.end if self.end is not None else self.clock()) - self.start
+
+    def totals(self):
+        """Returns the time charged to each category, including the time not charged
+        to any of them as other"""
+        with self._lock:
+            totals = dict(self.categories)
+        totals[OTHER] = max(self.wall() - sum(totals.values()), 0)
+        return totals
+
+
+class _Frame:
+    def __init__(self, category, clock):
+        self.category = category
+        self.start = clock()
+        self.nested = 0
+        self.tid = threading.get_ident()
+
+
+def current():
+    """Returns the account of the current context, if any"""
+    return _current.get()
+
+
+def current_category():
+    """Returns the category of the innermost measurement of the current context, if any"""
+    frames = _frames.get()
+    return frames[-1].category if frames else None
+
+
+@contextmanager
+def account(clock=time.monotonic):
+    """Opens an account for the time measured in the enclosed block"""
+    acc = Account(clock)
+    token = _current.set(acc)
+    frames_token = _frames.set(())
+    try:
+        yield acc
+    finally:
+        acc.close()
+        _frames.reset(frames_token)
+        _current.reset(token)
+
+
+@contextmanager
+def measure(category):
+    """Charges the time of the enclosed block, except for the nested measurements,
+    to the category of the current account. Does nothing if there is no account"""
+    acc = _current.get()
+    if acc is None:
+        yield
+        return
+
+    frames = _frames.get()
+    frame = _Frame(category, acc.clock)
+    token = _frames.set(frames + (frame,))
+    try:
+        yield
+    finally:
+        _frames.reset(token)
+        elapsed = acc.clock() - frame.start
+        acc.charge(category, max(elapsed - frame.nested, 0))
+        if frames and frames[-1].tid == frame.tid:
+            frames[-1].nested += elapsed
+
+
+def measure_sleep():
+    """Measures a sleep, unless it is the backoff of a polling loop, already measured as wait"""
+    return nullcontext() if current_category() == WAIT else measure(SLEEP)
+
+
+def command_binary(cmd):
+    """Returns the name of the binary executed by a shell command line. For a list of
+    commands (e.g. "cd dir; terraform apply"), the last one is taken"""
+    try:
+        lexer = shlex.shlex(cmd, posix=True, punctuation_chars=True)
+        lexer.whitespace_split = True
+        tokens = list(lexer)
+    except ValueError:
+        tokens = cmd.split()
+
+    commands = [[]]
+    for token in tokens:
+        if token in _COMMAND_SEPARATORS:
+            commands.append([])
+        else:
+            commands[-1].append(token)
+
+    for words in reversed(commands):
+        words = [w for w in words if not _ASSIGNMENT.match(w)]
+        if words and words[0] in ("sudo", "env", "exec", "time") and len(words) > 1:
+            words = words[1:]
+        if words:
+            return os.path.basename(words[0])
+    return "unknown"
+
+
+def report(results, top=10):
+    """Returns a summary of the time of the accounts, as the total of each category
+    and the breakdown of the top slowest ones.
+       results: dict with the wall time and the totals of each account, as {name: (wall, totals)}
+    """
+    wall = sum(w for w, _ in results.values())
+    categories = {}
+    for _, totals in results.values():
+        for category, seconds in totals.items():
+            categories[category] = categories.get(category, 0) + seconds
+
+    lines = ["{:40} {:>10} {:>6}".format("category", "time", "%")]
+    for category, seconds in sorted(categories.items(), key=lambda c: -c[1]):
+        lines.append("{:40} {:>9.0f}s {:>5.0f}%".format(
+            category[:40], seconds, 100 * seconds / wall if wall else 0))
+    lines.append("{:40} {:>9.0f}s".format("total", wall))
+
+    columns = (SLEEP, WAIT, SUBPROCESS, FIXTURE_SETUP, OTHER)
+    lines.append("")
+    lines.append("{:60} {:>8} {}".format("name", "wall", " ".join("{:>13}".format(c) for c in columns)))
+    for name, (seconds, totals) in sorted(results.items(), key=lambda r: -r[1][0])[:top]:
+        subprocess = sum(t for c, t in totals.items() if c.startswith(SUBPROCESS + ":"))
+        values = [totals.get(SLEEP, 0), totals.get(WAIT, 0), subprocess,
+                  totals.get(FIXTURE_SETUP, 0), totals.get(OTHER, 0)]
+        lines.append("{:60} {:>7.0f}s {}".format(
+            name[-60:], seconds, " ".join("{:>12.0f}s".format(v) for v in values)))
+    return "\n".join(lines)
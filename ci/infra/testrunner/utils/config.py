@@ -1,3 +1,4 @@
+import copy
 import os
 import string
 import sys
@@ -37,6 +38,8 @@ class BaseConfig:
         obj.packages = BaseConfig.Packages()
         obj.kubectl = BaseConfig.Kubectl()
         obj.utils = BaseConfig.Utils()
+        obj.pool = BaseConfig.Pool()
+        obj.perf = BaseConfig.Perf()
 
         # vars get the values from yaml file
         vars = BaseConfig.get_var_dict(yaml_path)
@@ -65,6 +68,12 @@ class BaseConfig:
     class Platform:
         def __init__(self):
             self.log_dir = "$WORKSPACE/platform_logs"
+            self.log_mode = "copy"
+            self.log_compression = "gzip"
+            self.log_extract = False
+            self.apiserver_probe_timeout = 5
+            self.journal_max_bytes = 50 * 1024 * 1024
+            self.journal_backups = 3
 
     class Openstack:
         def __init__(self):
@@ -92,6 +101,7 @@ class BaseConfig:
             self.cluster = "test-cluster"
             self.binpath = "$WORKSPACE/go/bin/skuba"
             self.verbosity = 5
+            self.join_concurrency = 5
 
     class Kubectl:
         def __init__(self):
@@ -100,11 +110,20 @@ class BaseConfig:
             self.cluster = "test-cluster"
             self.binpath = "/usr/bin/kubectl"
             self.kubeconfig = "$WORKSPACE/test-cluster/admin.conf"
+            self.backend = "api"
+            self.api_timeout = 30
+            self.snapshot_max_age = 1
 
     class Test:
         def __init__(self):
             super().__init__()
             self.no_destroy = False
+            self.workers_dir = "$WORKSPACE/test_workers"
+            self.default_duration = 300
+            self.impact_file = "$WORKSPACE/test_impact.json"
+            self.impact_ignore = ["*.md", "docs/*", "*_test.go", "*/testdata/*"]
+            self.result_cache_dir = "$WORKSPACE/test_result_cache"
+            self.result_cache_size = 5000
 
     class Log:
         def __init__(self):
@@ -113,6 +132,12 @@ class BaseConfig:
             self.quiet = False
             self.file = "$WORKSPACE/testrunner.log"
             self.overwrite = False
+            self.trace_dir = "$WORKSPACE/traces"
+            self.max_bytes = 100 * 1024 * 1024
+            self.backups = 5
+            self.compress = False
+            self.queue_size = 10000
+            self.command_dir = "$WORKSPACE/command_logs"
 
     class VMware:
         def __init__(self):
@@ -124,6 +149,23 @@ class BaseConfig:
             self.uri = "qemu:///system"
             self.keyfile = None
 
+    class Pool:
+        def __init__(self):
+            super().__init__()
+            self.dir = "$WORKSPACE/cluster_pool"
+            self.size = 2
+            self.bootstrap = False
+            self.lease_ttl = 4 * 3600
+            self.poll_interval = 30
+
+    class Perf:
+        def __init__(self):
+            super().__init__()
+            self.db = "$WORKSPACE/perf_history.db"
+            self.baseline = 10
+            self.threshold = 0.2
+            self.min_duration = 5
+
     class Packages:
         def __init__(self):
             self.mirror = None
@@ -143,6 +185,15 @@ class BaseConfig:
 
             print(f'{"  "*(level+1)}{key}: {value}', file=out)
 
+    @staticmethod
+    def copy(config):
+        """ Returns a deep copy of the configuration, which can be modified
+        without affecting the original (e.g. for deploying another stack)
+        """
+        new_config = object.__new__(type(config))
+        new_config.__dict__.update(copy.deepcopy(config.__dict__))
+        return new_config
+
     @staticmethod
     def get_yaml_path(yaml_path):
         utils_dir = os.path.dirname(os.path.realpath(__file__))
@@ -232,5 +283,7 @@ class BaseConfig:
         Kubectl,
         VMware,
         Libvirt,
-        Utils
+        Utils,
+        Pool,
+        Perf
     )
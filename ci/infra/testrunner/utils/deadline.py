@@ -0,0 +1,186 @@
+"""Deadlines and cancellation for operations running in any thread.
+
+A deadline is attached to the current context (see contextvars) and is
+inherited by the functions executed by run_with_timeout and run_async.
+Commands executed with Utils.runshellcommand are killed when the current
+deadline expires or is cancelled, and sleep() wakes up as soon as it happens.
+Unlike signal based timeouts, this works in worker threads and asyncio tasks.
+"""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from functools import wraps
+
+from utils import accounting
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class Deadline:
+    """A point in time after which an operation must be abandoned.
+    A deadline can also be cancelled before it expires. Cancelling a deadline
+    cancels the deadlines nested in it.
+    """
+
+    def __init__(self, timeout=None, parent=None):
+        self.expires = time.monotonic() + timeout if timeout is not None else None
+        self.parent = parent
+        self._cancelled = threading.Event()
+        self._children = weakref.WeakSet()
+        if parent is not None:
+            parent._children.add(self)
+            if parent.cancelled():
+                self._cancelled.set()
+
+    def remaining(self):
+        """Returns the seconds until the deadline expires, or None if it has no time limit"""
+        remaining = None
+        deadline = self
+        while deadline is not None:
+            if deadline.expires is not None:
+                left = deadline.expires - time.monotonic()
+                remaining = left if remaining is None else min(remaining, left)
+            deadline = deadline.parent
+        return remaining
+
+    def cancel(self):
+        self._cancelled.set()
+        for child in list(self._children):
+            child.cancel()
+
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def expired(self):
+        remaining = self.remaining()
+        return self.cancelled() or (remaining is not None and remaining <= 0)
+
+    def check(self):
+        """Raises DeadlineExceeded if the deadline expired or was cancelled"""
+        if self.cancelled():
+            raise DeadlineExceeded("operation cancelled")
+        if self.expired():
+            raise DeadlineExceeded("deadline exceeded")
+
+    def wait(self, seconds):
+        """Sleeps for the given seconds, waking up if the deadline expires or is cancelled.
+        Returns False if it woke up before the time elapsed"""
+        remaining = self.remaining()
+        if remaining is not None and remaining < seconds:
+            self._cancelled.wait(max(remaining, 0))
+            return False
+        return not self._cancelled.wait(seconds)
+
+
+_current = contextvars.ContextVar("testrunner_deadline", default=None)
+
+
+def current():
+    """Returns the deadline of the current context, if any"""
+    return _current.get()
+
+
+@contextmanager
+def deadline(timeout=None):
+    """Sets a deadline for the enclosed block, nested in the current deadline, if any"""
+    d = Deadline(timeout, parent=current())
+    token = _current.set(d)
+    try:
+        yield d
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def using(d):
+    """Sets an existing deadline for the enclosed block, e.g. in a thread whose
+    operations are cancelled from another thread"""
+    token = _current.set(d)
+    try:
+        yield d
+    finally:
+        _current.reset(token)
+
+
+def sleep(seconds):
+    """Sleeps, raising DeadlineExceeded if the current deadline expires or is cancelled"""
+    d = current()
+    with accounting.measure_sleep():
+        if d is None:
+            time.sleep(seconds)
+            return
+        woke = d.wait(seconds)
+    if not woke:
+        d.check()
+
+
+def run_with_timeout(func, timeout, *args, **kwargs):
+    """Runs func in a separate thread, under a deadline of timeout seconds.
+    If func does not complete in time, the deadline is cancelled, which kills
+    any command it is running, and DeadlineExceeded is raised.
+    """
+    d = Deadline(timeout, parent=current())
+    future = concurrent.futures.Future()
+
+    def target():
+        _current.set(d)
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as ex:
+            future.set_exception(ex)
+
+    ctx = contextvars.copy_context()
+    name = getattr(func, "__name__", "func")
+    thread = threading.Thread(target=ctx.run, args=(target,), name=f"deadline-{name}", daemon=True)
+    thread.start()
+    try:
+        return future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        d.cancel()
+        raise DeadlineExceeded(f"{name} did not complete in {timeout}s")
+    except BaseException:
+        d.cancel()
+        raise
+
+
+async def run_async(func, timeout, *args, **kwargs):
+    """Runs the blocking func from an asyncio task under a deadline of timeout seconds.
+    If the timeout expires or the task is cancelled, the deadline is cancelled, which
+    kills any command func is running.
+    """
+    d = Deadline(timeout, parent=current())
+    ctx = contextvars.copy_context()
+    ctx.run(_current.set, d)
+
+    loop = asyncio.get_event_loop()
+    future = loop.run_in_executor(None, lambda: ctx.run(func, *args, **kwargs))
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        d.cancel()
+        name = getattr(func, "__name__", "func")
+        raise DeadlineExceeded(f"{name} did not complete in {timeout}s")
+    except BaseException:
+        d.cancel()
+        raise
+
+
+def timeout(seconds):
+    """Decorator for running a function with a timeout.
+    Raises DeadlineExceeded if the function does not complete in time.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            return run_with_timeout(f, seconds, *args, **kwargs)
+        return wrapped
+    return decorator
@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from utils import (deadline, tracing)
+
+POOL_SIZE = 10
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _shared_pool():
+    """Returns the keep-alive session and the executor of the probes, shared by all
+    the probers of the process so they are created only once"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            session = requests.Session()
+            session.verify = False
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="httpprobe")
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+            _pool = (session, executor)
+        return _pool
+
+
+class EndpointStats:
+    """Rolling record of the last probes of an endpoint.
+       url: probed url
+       window: maximum number of probes kept
+    """
+
+    def __init__(self, url, window=50):
+        self.url = url
+        self.probes = deque(maxlen=window)
+        self.last_error = None
+
+    def record(self, ok, latency, error=None):
+        self.probes.append((ok, latency))
+        if error is not None:
+            self.last_error = error
+
+    def availability(self):
+        """Fraction of the recorded probes which succeeded, or None if there are no probes"""
+        if not self.probes:
+            return None
+        return sum(1 for ok, _ in self.probes if ok) / len(self.probes)
+
+    def latency(self, percentile=50):
+        """Latency of the successful probes at the given percentile, or None if none succeeded"""
+        latencies = sorted(latency for ok, latency in self.probes if ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+
+class HttpProber:
+    """Probes HTTPS endpoints concurrently over a pooled keep-alive session.
+    Each probe has a strict timeout, shortened to the current deadline if any,
+    so an unresponsive endpoint never blocks the caller for longer. The session
+    and the threads of the probes (up to POOL_SIZE) are shared by all the probers.
+       timeout: timeout in seconds of each probe
+       window: number of probes kept for each endpoint's stats
+    """
+
+    def __init__(self, timeout=5, window=50):
+        self.timeout = timeout
+        self.window = window
+        self.session, self.executor = _shared_pool()
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def stats(self, url):
+        with self._lock:
+            stats = self._stats.get(url)
+            if stats is None:
+                stats = EndpointStats(url, window=self.window)
+                self._stats[url] = stats
+            return stats
+
+    def probe(self, url):
+        """Returns True if the endpoint responds with 200 OK within the timeout"""
+        timeout = self.timeout
+        d = deadline.current()
+        if d is not None and d.remaining() is not None:
+            timeout = max(min(timeout, d.remaining()), 0.1)
+
+        start = time.monotonic()
+        error = None
+        try:
+            response = self.session.get(url, timeout=timeout)
+            ok = response.status_code == 200
+            if not ok:
+                error = f"status {response.status_code}"
+        except requests.exceptions.RequestException as ex:
+            ok = False
+            error = str(ex)
+
+        stats = self.stats(url)
+        with self._lock:
+            stats.record(ok, time.monotonic() - start, error)
+        return ok
+
+    def probe_all(self, urls):
+        """Probes all the urls concurrently. Returns a dictionary with the result for each url"""
+        # the probes run in the context of the caller, so they are clamped to its deadline
+        probe = tracing.propagate_context(self.probe)
+        futures = {url: self.executor.submit(probe, url) for url in urls}
+        return {url: future.result() for url, future in futures.items()}
+
+    def report(self):
+        """Returns a summary of the availability and latency of the probed endpoints"""
+        lines = ["{:40} {:>7} {:>13} {:>10} {:>10}".format("endpoint", "probes", "availability", "p50", "p95")]
+        with self._lock:
+            stats = list(self._stats.values())
+        for s in stats:
+            availability, p50, p95 = s.availability(), s.latency(50), s.latency(95)
+            lines.append("{:40} {:>7} {:>12.0f}% {:>10} {:>10}".format(
+                s.url[:40], len(s.probes), (availability or 0) * 100,
+                f"{p50 * 1000:.0f}ms" if p50 is not None else "-",
+                f"{p95 * 1000:.0f}ms" if p95 is not None else "-"))
+        return "\n".join(lines)
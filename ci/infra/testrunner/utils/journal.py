@@ -0,0 +1,124 @@
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+
+from utils.config import Constant
+from utils.deadline import Deadline, DeadlineExceeded, using
+
+logger = logging.getLogger('testrunner')
+
+JOURNAL_FILE = "journal.log"
+
+
+class JournalStreamer:
+    """Streams the journal of the nodes to a file in the log dir of each node while
+    the tests run, so the logs are available when a test hangs and don't need to be
+    collected at the end.
+
+    The journal of each node is followed over ssh (journalctl -f -o json) from a
+    background thread. Each entry is written with the test running when it was
+    received (PYTEST_CURRENT_TEST). Files are rotated when they exceed max_bytes,
+    keeping up to backups rotated files. If the connection to a node is lost (e.g.
+    it is rebooted), the stream is resumed after the last entry received.
+       utils: Utils for executing ssh
+       nodes: dict with the log dir of each node, by ip address
+       services: units streamed. All the journal if empty
+    """
+
+    def __init__(self, utils, nodes, services=(), max_bytes=50 * 1024 * 1024, backups=3, retry_delay=10):
+        self.utils = utils
+        self.nodes = nodes
+        self.services = list(services)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.retry_delay = retry_delay
+        self.cursors = {}
+        self.entries = {}
+        self._deadline = None
+        self._threads = []
+
+    def start(self, since=None):
+        """Starts streaming the journal of the nodes. Without since (seconds since the
+        epoch), the whole journal of the services is streamed"""
+        self._deadline = Deadline()
+        for ip_address, log_dir in self.nodes.items():
+            thread = threading.Thread(target=self._stream, args=(ip_address, log_dir, since),
+                                      name=f"journal-{ip_address}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Streaming the journal of {len(self.nodes)} nodes")
+
+    def stop(self):
+        """Stops streaming, killing the ssh sessions"""
+        if self._deadline is None:
+            return
+        self._deadline.cancel()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._deadline = None
+        logger.info("Stopped streaming the journal: " + ", ".join(
+            f"{ip_address} {self.entries.get(ip_address, 0)} entries" for ip_address in self.nodes))
+
+    def command(self, ip_address, since=None):
+        """Returns the command following the journal of a node after the last entry received"""
+        journal_cmd = "sudo journalctl -f -o json --no-pager"
+        for service in self.services:
+            journal_cmd += f" -u {service}"
+        cursor = self.cursors.get(ip_address)
+        if cursor:
+            journal_cmd += f' --after-cursor="{cursor}"'
+        elif since is not None:
+            journal_cmd += f" --since=@{int(since)}"
+        else:
+            journal_cmd += " --no-tail"
+        return (f"ssh {Constant.SSH_OPTS} -i {self.utils.conf.utils.ssh_key} "
+                f"{self.utils.ssh_user()}@{ip_address} -- '{journal_cmd}'")
+
+    def _stream(self, ip_address, log_dir, since):
+        out = logging.handlers.RotatingFileHandler(os.path.join(log_dir, JOURNAL_FILE),
+                                                   maxBytes=self.max_bytes, backupCount=self.backups)
+        # stopping the streamer cancels the deadline, which kills the ssh session
+        with using(self._deadline):
+            while not self._deadline.cancelled():
+                try:
+                    for line in self.utils.stream_shellcommand(self.command(ip_address, since)):
+                        self._write(out, ip_address, line)
+                except DeadlineExceeded:
+                    break
+                except Exception as ex:
+                    logger.warning(f"Journal stream of {ip_address} interrupted: {ex}")
+                self._deadline.wait(self.retry_delay)
+        out.close()
+
+    def _write(self, out, ip_address, line):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return
+        self.cursors[ip_address] = entry.get("__CURSOR")
+        self.entries[ip_address] = self.entries.get(ip_address, 0) + 1
+        label = os.environ.get("PYTEST_CURRENT_TEST", "session")
+        out.handle(logging.makeLogRecord({"msg": format_entry(entry, label)}))
+
+
+def format_entry(entry, label):
+    """Formats a journal entry, in the json format of journalctl, as a line with its
+    time, unit, process and the test running when it was received"""
+    message = entry.get("MESSAGE", "")
+    if isinstance(message, list):
+        # not valid utf-8
+        message = bytes(message).decode(errors="replace")
+    try:
+        timestamp = int(entry["__REALTIME_TIMESTAMP"])
+        when = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(timestamp // 1000000))
+        when += f".{timestamp % 1000000:06d}"
+    except (KeyError, ValueError):
+        when = "-"
+    unit = entry.get("_SYSTEMD_UNIT") or entry.get("SYSLOG_IDENTIFIER", "-")
+    pid = entry.get("_PID")
+    process = f"{unit}[{pid}]" if pid else unit
+    return f"{when} {process} [{label}]: {message}"
@@ -1,4 +1,226 @@
+"""Logging of the testrunner.
+
+The records of the testrunner logger are put in a queue by the thread which
+logs them (e.g. the threads reading the output of the commands) and are
+formatted and written to the console and the log file by a background writer,
+in batches, with one flush per batch. The log file is rotated when it exceeds
+a maximum size, optionally compressing the rotated files.
+
+The output of each command executed by Utils.runshellcommand is written to its
+own file in the command log directory of the run, instead of the main log.
+The oldest files of a run are removed when the run exceeds the maximum size of
+the log, and only the directories of the last runs are kept.
+"""
+
+import atexit
+import collections
+import gzip
+import itertools
 import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
+import time
+
+FORMAT = '%(asctime)s %(levelname)s] %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+BATCH_SIZE = 500
+
+_command_log = None
+
+
+class BlockingQueueHandler(logging.handlers.QueueHandler):
+    """Puts the records in the queue, waiting for room if it is full instead of
+    dropping them. Records are not formatted, as they are handled in the same process"""
+
+    def prepare(self, record):
+        if record.args:
+            # arguments may change before the record is formatted
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record):
+        self.queue.put(record)
+
+
+class RotatingLogHandler(logging.handlers.RotatingFileHandler):
+    """File handler rotating the file when it exceeds max_bytes and keeping up to
+    backups rotated files, compressed with gzip if compress is true. Records are
+    not flushed one by one, but by the LogWriter after each batch"""
+
+    def __init__(self, path, max_bytes=0, backups=0, compress=False, overwrite=False):
+        if overwrite:
+            # RotatingFileHandler always appends
+            open(path, "w").close()
+        super().__init__(path, maxBytes=max_bytes, backupCount=backups)
+        if compress:
+            self.namer = lambda name: name + ".gz"
+            self.rotator = _gzip_rotator
+
+    def emit(self, record):
+        try:
+            msg = self.format(record) + self.terminator
+            if self.stream is None:
+                self.stream = self._open()
+            if self.maxBytes > 0 and self.stream.tell() + len(msg) >= self.maxBytes and self.stream.tell() > 0:
+                self.doRollover()
+            self.stream.write(msg)
+        except Exception:
+            self.handleError(record)
+
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+class LogWriter:
+    """Handles the records put in a queue from a background thread, in batches of
+    up to batch_size records. Handlers are flushed after each batch.
+       handlers: handlers of the records, filtered by their level
+    """
+
+    _STOP = object()
+
+    def __init__(self, records, handlers, batch_size=BATCH_SIZE):
+        self.records = records
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Writes the pending records and stops the writer"""
+        if self._thread is None:
+            return
+        self.records.put(self._STOP)
+        self._thread.join()
+        self._thread = None
+        for handler in self.handlers:
+            handler.close()
+
+    def _run(self):
+        while True:
+            batch = [self.records.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            stop = False
+            for record in batch:
+                if record is self._STOP:
+                    stop = True
+                    continue
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+            for handler in self.handlers:
+                handler.flush()
+            if stop:
+                return
+
+
+class CommandOutput:
+    """File with the output of a command. stdout and stderr are written by
+    different threads, so writes are serialized"""
+
+    def __init__(self, path, cmd, on_close=None):
+        self.path = path
+        self.on_close = on_close
+        self._lock = threading.Lock()
+        self._file = open(path, "w")
+        self._file.write(f"$ {cmd}\n")
+
+    def writeline(self, line):
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        if self.on_close is not None:
+            self.on_close(self)
+
+
+class CommandLog:
+    """Directory with the output of the commands of a run. When the size of the
+    files exceeds max_bytes, the oldest ones are removed
+       path: directory of the run
+       max_bytes: maximum size of the files. 0 for no limit
+    """
+
+    def __init__(self, path, max_bytes=0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._seq = itertools.count(1)
+        self._closed = collections.deque()
+        self._lock = threading.Lock()
+
+    def output(self, cmd, name):
+        os.makedirs(self.path, exist_ok=True)
+        return CommandOutput(os.path.join(self.path, f"{next(self._seq):05d}-{name}.log"), cmd,
+                             on_close=self._closed_output)
+
+    def _closed_output(self, output):
+        size = os.path.getsize(output.path)
+        with self._lock:
+            self._closed.append((output.path, size))
+            self.size += size
+            # the output of the last command is always kept
+            while self.max_bytes > 0 and self.size > self.max_bytes and len(self._closed) > 1:
+                path, size = self._closed.popleft()
+                self.size -= size
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+def prune_command_dirs(command_dir, keep):
+    """Removes the command log directories of the runs, except the last keep ones and
+    the ones of processes still running. Directories are named <time>-<pid>"""
+    try:
+        runs = sorted(d for d in os.listdir(command_dir) if os.path.isdir(os.path.join(command_dir, d)))
+    except FileNotFoundError:
+        return []
+    pruned = []
+    for run in runs[:max(len(runs) - keep, 0)]:
+        pid = run.rsplit("-", 1)[-1]
+        if pid.isdigit() and _pid_alive(int(pid)):
+            continue
+        shutil.rmtree(os.path.join(command_dir, run), ignore_errors=True)
+        pruned.append(run)
+    return pruned
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def command_output(cmd, name):
+    """Returns the file for the output of a command, or None if the output of the
+    commands is sent to the main log
+       name: name of the file, e.g. the binary executed by the command
+    """
+    if _command_log is None:
+        return None
+    return _command_log.output(cmd, name)
 
 
 class Logger:
@@ -8,20 +230,45 @@ class Logger:
 
     @staticmethod
     def config_logger(conf, level=None):
+        global _command_log
+
         logging.basicConfig(
-            format='%(asctime)s %(levelname)s] %(message)s',
+            format=FORMAT,
             level=logging.DEBUG,
-            datefmt='%Y-%m-%d %H:%M:%S')
+            datefmt=DATE_FORMAT)
 
         logger = logging.getLogger("testrunner")
+        logger.setLevel(logging.DEBUG)
+        # the records are written by the handlers of the writer, not the root logger's
+        logger.propagate = False
+        formatter = logging.Formatter(FORMAT, datefmt=DATE_FORMAT)
 
+        handlers = []
         if conf.log.file:
-            file_handler = logging.FileHandler(conf.log.file)
-            logger.addHandler(file_handler)
+            file_handler = RotatingLogHandler(conf.log.file, max_bytes=conf.log.max_bytes,
+                                              backups=conf.log.backups, compress=conf.log.compress,
+                                              overwrite=conf.log.overwrite)
+            file_handler.setFormatter(formatter)
+            handlers.append(file_handler)
 
         if not conf.log.quiet:
             if not level:
                 level = conf.log.level
             console = logging.StreamHandler()
             console.setLevel(logging.getLevelName(level.upper()))
-            logger.addHandler(console)
+            console.setFormatter(formatter)
+            handlers.append(console)
+
+        records = queue.Queue(maxsize=conf.log.queue_size)
+        writer = LogWriter(records, handlers)
+        writer.start()
+        atexit.register(writer.stop)
+        logger.addHandler(BlockingQueueHandler(records))
+
+        if conf.log.command_dir:
+            # the directories of the previous runs are kept like the rotated log files
+            prune_command_dirs(conf.log.command_dir, conf.log.backups)
+            _command_log = CommandLog(
+                os.path.join(conf.log.command_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"),
+                max_bytes=conf.log.max_bytes)
+        return writer
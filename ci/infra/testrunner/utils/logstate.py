@@ -0,0 +1,56 @@
+import json
+import os
+import time
+
+
+class LogState:
+    """Keeps track of the logs already collected from a node.
+
+    The state is stored in the node's log dir and holds the journald cursor of
+    each service. Files and dirs need no state, as rsync only copies what
+    changed since the previous collection. Journal entries are
+    stored in segment files, one per collection, which are listed in an index
+    with the label (test or step) active when they were collected.
+    """
+
+    STATE_FILE = ".logstate.json"
+    INDEX_FILE = "index.json"
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        self.state_path = os.path.join(store_path, LogState.STATE_FILE)
+        self.index_path = os.path.join(store_path, LogState.INDEX_FILE)
+        self.state = LogState._load(self.state_path, {"cursors": {}})
+        self.index = LogState._load(self.index_path, [])
+
+    @staticmethod
+    def _load(path, default):
+        if not os.path.exists(path):
+            return default
+        with open(path) as f:
+            return json.load(f)
+
+    def get_cursor(self, service):
+        return self.state["cursors"].get(service)
+
+    def set_cursor(self, service, cursor):
+        self.state["cursors"][service] = cursor
+
+    def next_segment(self, service):
+        """Returns the path for the next segment of the service's journal"""
+        segments = [s for s in self.index if s["service"] == service]
+        return os.path.join(self.store_path, f"{service}.{len(segments):04d}.log")
+
+    def add_segment(self, service, segment_path, label):
+        self.index.append({
+            "service": service,
+            "file": os.path.basename(segment_path),
+            "label": label,
+            "collected": time.strftime("%Y-%m-%dT%H:%M:%S")
+        })
+
+    def save(self):
+        with open(self.state_path, "w") as f:
+            json.dump(self.state, f, indent=2)
+        with open(self.index_path, "w") as f:
+            json.dump(self.index, f, indent=2)
@@ -0,0 +1,190 @@
+import collections
+import math
+import random
+import threading
+import time
+
+from utils import accounting, deadline
+
+
+class PollingPolicy:
+    """Delays between the attempts of a polling loop.
+
+    The first retries are fast and the delay grows exponentially, with some
+    random jitter, up to max_backoff.
+       initial: delay before the first retry
+       factor: growth factor for each subsequent delay
+       max_backoff: maximum delay between retries
+       jitter: fraction of the delay randomly added or subtracted
+    """
+
+    def __init__(self, initial=1, factor=2, max_backoff=20, jitter=0.1, rand=None):
+        self.initial = initial
+        self.factor = factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.rand = rand if rand is not None else random.Random()
+
+    def capped(self, max_backoff):
+        """Returns a copy of this policy with a different maximum delay"""
+        return PollingPolicy(initial=self.initial, factor=self.factor, max_backoff=max_backoff,
+                             jitter=self.jitter, rand=self.rand)
+
+    def delays(self):
+        """Generates the delay before each retry"""
+        delay = min(self.initial, self.max_backoff)
+        while True:
+            jittered = delay * self.rand.uniform(1 - self.jitter, 1 + self.jitter)
+            yield max(0, min(jittered, self.max_backoff))
+            delay = min(delay * self.factor, self.max_backoff)
+
+
+class PollStats:
+    """Record of a polling loop.
+       name: name of the polled condition
+       attempts: number of attempts
+       elapsed: total time of the loop, including the initial delay
+       slept: time spent waiting between attempts, including the initial delay
+       succeeded: if the condition was satisfied
+       fixed_estimate: estimated time the loop would have taken retrying every
+                       fixed_backoff seconds, if it succeeded
+    """
+
+    def __init__(self, name, attempts, elapsed, slept, succeeded, fixed_estimate=None):
+        self.name = name
+        self.attempts = attempts
+        self.elapsed = elapsed
+        self.slept = slept
+        self.succeeded = succeeded
+        self.fixed_estimate = fixed_estimate
+
+    def saved(self):
+        """Estimated time saved compared to retrying with a fixed backoff"""
+        if self.fixed_estimate is None:
+            return 0
+        return self.fixed_estimate - self.elapsed
+
+
+# number of records of the most recent polling loops kept. The report is
+# computed from totals by name, so it covers all the loops
+MAX_STATS = 1000
+
+_stats = collections.deque(maxlen=MAX_STATS)
+# name -> [loops, attempts, elapsed, slept, saved]
+_totals = {}
+_stats_lock = threading.Lock()
+
+
+def _record(record):
+    with _stats_lock:
+        _stats.append(record)
+        totals = _totals.setdefault(record.name, [0, 0, 0, 0, 0])
+        for i, value in enumerate((1, record.attempts, record.elapsed, record.slept, record.saved())):
+            totals[i] += value
+
+
+def stats():
+    """Returns the record of the most recent polling loops, up to MAX_STATS"""
+    with _stats_lock:
+        return list(_stats)
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+        _totals.clear()
+
+
+def report():
+    """Returns a summary of the polling loops, grouped by name"""
+    with _stats_lock:
+        totals = {name: list(values) for name, values in _totals.items()}
+
+    lines = ["{:40} {:>6} {:>8} {:>10} {:>10} {:>10}".format(
+        "name", "loops", "attempts", "elapsed", "slept", "saved")]
+    for name, (loops, attempts, elapsed, slept, saved) in sorted(totals.items()):
+        lines.append("{:40} {:>6} {:>8} {:>9.0f}s {:>9.0f}s {:>9.0f}s".format(
+            name[:40], loops, attempts, elapsed, slept, saved))
+
+    return "\n".join(lines)
+
+
+def poll(attempt, timeout=None, retries=0, delay=0, policy=None, fixed_backoff=None, name=None,
+         clock=time.monotonic, sleep=deadline.sleep):
+    """Call attempt until it succeeds, the timeout expires or the retries are exhausted.
+
+       attempt: function returning a tuple (done, value). Exceptions are not caught
+       timeout: maximum time in seconds for the loop, including the initial delay.
+                None for no time limit
+       retries: maximum number of attempts. 0 for no limit
+       delay: time to wait before the first attempt
+       policy: PollingPolicy for the delay between attempts
+       fixed_backoff: fixed delay the loop is compared to in the recorded stats
+       name: name of the polled condition, used for recording stats
+
+    Delays between attempts are shortened to end at the deadline, so a last
+    attempt is made when the timeout expires.
+
+    Returns a tuple (done, value) with the result of the last attempt.
+    """
+    if policy is None:
+        policy = PollingPolicy()
+    if name is None:
+        name = getattr(attempt, "__name__", "poll")
+
+    start = clock()
+    deadline = start + timeout if timeout is not None else None
+    delays = policy.delays()
+    attempts = 0
+    slept = 0
+    probe_time = 0
+    last_failure = None
+
+    if delay > 0:
+        with accounting.measure(accounting.WAIT):
+            sleep(delay)
+        slept += delay
+
+    while True:
+        attempts += 1
+        probe_start = clock()
+        done, value = attempt()
+        probe_time += clock() - probe_start
+
+        if done:
+            break
+
+        last_failure = probe_start - start - delay
+        if retries > 0 and attempts >= retries:
+            break
+
+        wait = next(delays)
+        if deadline is not None:
+            remaining = deadline - clock()
+            if remaining <= 0:
+                break
+            wait = min(wait, remaining)
+
+        with accounting.measure(accounting.WAIT):
+            sleep(wait)
+        slept += wait
+
+    elapsed = clock() - start
+    fixed_estimate = None
+    if done and fixed_backoff is not None:
+        fixed_estimate = _fixed_estimate(delay, last_failure, probe_time / attempts, fixed_backoff)
+
+    _record(PollStats(name, attempts, elapsed, slept, done, fixed_estimate))
+
+    return done, value
+
+
+def _fixed_estimate(delay, last_failure, probe_time, backoff):
+    """Estimate the time needed for detecting a condition retrying every backoff seconds.
+    The condition became true after the start of the last failed attempt, so
+    it would have been detected by the first fixed attempt started after that.
+    """
+    if last_failure is None:
+        return delay + probe_time
+    period = probe_time + backoff
+    return delay + (math.floor(last_failure / period) + 1) * period + probe_time
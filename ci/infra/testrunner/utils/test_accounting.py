@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import accounting, tracing
+from utils.accounting import command_binary
+from utils.polling import PollingPolicy, poll
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_nested_measurements():
+    """Test each measurement is charged the time not spent in the measurements
+    nested in it, and the time not measured is charged to other
+    """
+    clock = FakeClock()
+    with accounting.account(clock=clock) as acc:
+        with accounting.measure(accounting.FIXTURE_SETUP):
+            clock.sleep(5)
+            with accounting.measure("subprocess:skuba"):
+                clock.sleep(60)
+        with accounting.measure_sleep():
+            clock.sleep(100)
+        clock.sleep(10)
+
+    assert acc.wall() == 175
+    assert acc.totals() == {"fixture_setup": 5, "subprocess:skuba": 60, "sleep": 100, "other": 10}
+    assert accounting.current() is None
+
+
+def test_polling_backoff():
+    """Test the sleeps between the attempts of a polling loop are charged to wait,
+    including those made in other threads
+    """
+    clock = FakeClock()
+    attempts = iter([False, False, True])
+
+    def sleep(seconds):
+        with accounting.measure_sleep():
+            clock.sleep(seconds)
+
+    def attempt():
+        return next(attempts), None
+
+    with accounting.account(clock=clock) as acc:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(tracing.propagate_context(poll), attempt, delay=2,
+                            policy=PollingPolicy(initial=1, jitter=0), clock=clock, sleep=sleep).result()
+    assert acc.totals()[accounting.WAIT] == 5
+    assert accounting.SLEEP not in acc.totals()
+
+
+def test_command_binary():
+    """Test the binary executed by shell command lines
+    """
+    assert command_binary("/usr/bin/skuba -v 5 cluster init --control-plane 10.0.0.1 cluster") == "skuba"
+    assert command_binary("ssh -i key sles@10.0.0.1 -- 'sudo systemctl stop kubelet; sudo reboot'") == "ssh"
+    assert command_binary("export OS_CLOUD=ci; terraform apply -auto-approve") == "terraform"
+    assert command_binary("KUBECONFIG=admin.conf kubectl get nodes | grep Ready") == "kubectl"
+    assert command_binary("sudo rsync -a src dst") == "rsync"
+    assert command_binary("") == "unknown"
+
+
+def test_report():
+    """Test the summary includes the total of each category and the slowest tests
+    """
+    results = {
+        "test_cilium.py::test_cilium": (200, {"sleep": 130, "subprocess:kubectl": 40, "other": 30}),
+        "test_node_reboot.py::test_reboot": (100, {"sleep": 60, "wait": 30, "subprocess:ssh": 5, "other": 5}),
+    }
+    lines = accounting.report(results, top=1).splitlines()
+    assert lines[1].split() == ["sleep", "190s", "63%"]
+    assert lines[-1].split() == ["test_cilium.py::test_cilium", "200s", "130s", "0s", "40s", "0s", "30s"]
+    assert not any("test_reboot" in line for line in lines)
@@ -0,0 +1,137 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from utils.deadline import (DeadlineExceeded, deadline, run_async, run_with_timeout, timeout)
+from utils.polling import (PollingPolicy, poll)
+from utils.utils import Utils
+
+conf = SimpleNamespace(utils=SimpleNamespace(ssh_sock="/tmp/testrunner_ssh_sock"))
+
+
+def running_in_group(pgid):
+    """Returns the pids of the processes of a process group which are not zombies"""
+    pids = []
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                # the command name is in parenthesis and can contain spaces
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if fields[0] != "Z" and int(fields[2]) == pgid:
+            pids.append(int(pid))
+    return pids
+
+
+def test_run_with_timeout():
+    """Test the result of a function completed in time is returned and
+    a function which does not complete in time raises DeadlineExceeded
+    """
+    assert run_with_timeout(lambda x: x * 2, 5, 21) == 42
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        run_with_timeout(time.sleep, 0.2, 5)
+    assert time.monotonic() - start < 1
+
+
+def test_timeout_decorator_kills_command(tmp_path):
+    """Test a command running when the timeout expires is killed, with all its children
+    """
+    utils = Utils(conf)
+    pid_file = tmp_path / "pid"
+
+    @timeout(0.5)
+    def long_command():
+        # the shell leads the process group of the command
+        return utils.runshellcommand(f"echo $$ > {pid_file}; sleep 30 & wait")
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        long_command()
+    assert time.monotonic() - start < 5
+
+    pgid = int(pid_file.read_text())
+    # give the worker thread time to observe the cancellation
+    done, pids = poll(lambda: (not running_in_group(pgid), running_in_group(pgid)), timeout=2,
+                      policy=PollingPolicy(initial=0.1, max_backoff=0.1))
+    assert done, f"processes {pids} of the command still running"
+
+
+def test_nested_deadline():
+    """Test a nested deadline never outlives the enclosing one
+    """
+    with deadline(0.2) as outer:
+        with deadline(10) as inner:
+            assert inner.remaining() <= 0.2
+            outer.cancel()
+            assert inner.expired()
+            with pytest.raises(DeadlineExceeded):
+                inner.check()
+
+
+def test_concurrent_timeouts():
+    """Test attempts with a timeout of their own can be retried from multiple threads
+    """
+    calls = {}
+    lock = threading.Lock()
+
+    def slow_then_fast(name):
+        with lock:
+            calls[name] = calls.get(name, 0) + 1
+            first = calls[name] == 1
+        if first:
+            time.sleep(5)
+        return name
+
+    def waiter(name):
+        def attempt():
+            try:
+                return True, run_with_timeout(slow_then_fast, 1, name)
+            except DeadlineExceeded:
+                return False, None
+        return poll(attempt, retries=3, policy=PollingPolicy(initial=0.1, factor=1, jitter=0))[1]
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(waiter, [f"t{i}" for i in range(8)]))
+
+    assert results == [f"t{i}" for i in range(8)]
+    assert all(calls[f"t{i}"] == 2 for i in range(8))
+    assert time.monotonic() - start < 4
+
+
+def test_concurrent_deadlines():
+    """Test deadlines in concurrent threads only expire their own thread
+    """
+    def waiter(seconds):
+        try:
+            return run_with_timeout(time.sleep, 0.5, seconds) is None
+        except DeadlineExceeded:
+            return False
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert list(executor.map(waiter, [0.1, 2, 0.1, 2])) == [True, False, True, False]
+
+
+def test_run_async():
+    """Test blocking functions can be run with a timeout from asyncio tasks
+    """
+    utils = Utils(conf)
+
+    async def main():
+        fast = run_async(utils.runshellcommand, 5, "echo ok")
+        slow = run_async(utils.runshellcommand, 0.5, "sleep 30")
+        return await asyncio.gather(fast, slow, return_exceptions=True)
+
+    start = time.monotonic()
+    fast, slow = asyncio.run(main())
+    assert fast.strip() == "ok"
+    assert isinstance(slow, DeadlineExceeded)
+    assert time.monotonic() - start < 5
@@ -0,0 +1,57 @@
+import threading
+import time
+from http.server import (BaseHTTPRequestHandler, ThreadingHTTPServer)
+
+from utils import deadline
+from utils.httpprobe import HttpProber
+
+
+class Healthz(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/hung":
+            time.sleep(5)
+        status = 500 if self.path == "/broken" else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+def test_probe_all():
+    """Test endpoints are probed concurrently, a hung endpoint does not block
+    the probes beyond the timeout and stats are recorded for each endpoint
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Healthz)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    prober = HttpProber(timeout=0.5)
+    urls = [f"{base}/healthz", f"{base}/broken", f"{base}/hung", f"{base}/hung"]
+    start = time.monotonic()
+    results = prober.probe_all(urls)
+    assert time.monotonic() - start < 2
+    assert results == {f"{base}/healthz": True, f"{base}/broken": False, f"{base}/hung": False}
+
+    for _ in range(3):
+        prober.probe(f"{base}/healthz")
+    healthz = prober.stats(f"{base}/healthz")
+    assert healthz.availability() == 1
+    assert healthz.latency(95) < 0.5
+    assert prober.stats(f"{base}/broken").last_error == "status 500"
+    assert prober.stats(f"{base}/hung").latency() is None
+
+    # the probes are clamped to the deadline of the caller
+    prober = HttpProber(timeout=10)
+    start = time.monotonic()
+    with deadline.deadline(0.5):
+        assert prober.probe_all([f"{base}/hung"]) == {f"{base}/hung": False}
+    assert time.monotonic() - start < 2
+    # the session and the threads of the probes are shared
+    assert prober.executor is HttpProber().executor
+    server.shutdown()
@@ -0,0 +1,62 @@
+import json
+from types import SimpleNamespace
+
+from utils import deadline
+from utils.journal import JournalStreamer, format_entry
+
+
+def entry(cursor, message, unit="kubelet.service"):
+    return json.dumps({"__CURSOR": cursor, "__REALTIME_TIMESTAMP": "1600000000123456",
+                       "_SYSTEMD_UNIT": unit, "_PID": "42", "MESSAGE": message}) + "\n"
+
+
+class FakeUtils:
+    """Streams two entries and drops the connection, then streams one more and
+    blocks until the stream is stopped"""
+
+    def __init__(self):
+        self.conf = SimpleNamespace(utils=SimpleNamespace(ssh_key="id_rsa"))
+        self.commands = []
+
+    def ssh_user(self):
+        return "sles"
+
+    def stream_shellcommand(self, cmd):
+        self.commands.append(cmd)
+        if len(self.commands) == 1:
+            yield entry("c1", "starting kubelet")
+            yield entry("c2", "node rebooting")
+            raise RuntimeError("connection closed")
+        yield entry("c3", "kubelet started")
+        while True:
+            deadline.sleep(0.05)
+
+
+def test_stream_resumes_after_cursor(tmp_path, monkeypatch):
+    """Test the journal is resumed after the last entry received when the connection
+    is lost, and each entry is tagged with the test running
+    """
+    monkeypatch.setenv("PYTEST_CURRENT_TEST", "test_node_reboot.py::test_reboot (call)")
+    utils = FakeUtils()
+    streamer = JournalStreamer(utils, {"10.0.0.1": str(tmp_path)}, services=["kubelet", "crio"], retry_delay=0)
+    streamer.start()
+    try:
+        with deadline.deadline(10):
+            while streamer.entries.get("10.0.0.1", 0) < 3:
+                deadline.sleep(0.01)
+    finally:
+        streamer.stop()
+
+    first, second = utils.commands[:2]
+    assert "journalctl -f -o json --no-pager -u kubelet -u crio --no-tail" in first
+    assert '--after-cursor="c2"' in second
+    lines = (tmp_path / "journal.log").read_text().splitlines()
+    assert [line.split(": ", 1)[1] for line in lines] == ["starting kubelet", "node rebooting", "kubelet started"]
+    assert "kubelet.service[42] [test_node_reboot.py::test_reboot (call)]" in lines[0]
+
+
+def test_format_entry():
+    """Test entries which are not valid utf-8 or lack fields are formatted
+    """
+    line = format_entry({"MESSAGE": [104, 105, 255], "SYSLOG_IDENTIFIER": "kernel"}, "session")
+    assert line == "- kernel [session]: hi�"
@@ -0,0 +1,81 @@
+import gzip
+import logging
+import queue
+from types import SimpleNamespace
+
+import pytest
+
+from utils import logger as logger_module
+from utils.logger import BlockingQueueHandler, LogWriter, RotatingLogHandler
+from utils.utils import Utils
+
+conf = SimpleNamespace(utils=SimpleNamespace(ssh_sock="/tmp/testrunner_ssh_sock"))
+
+
+def test_writer_rotates_and_compresses(tmp_path):
+    """Test the records logged to the queue are written by the writer, rotating
+    and compressing the log file when it exceeds the maximum size
+    """
+    path = tmp_path / "testrunner.log"
+    handler = RotatingLogHandler(str(path), max_bytes=1000, backups=2, compress=True)
+    handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+    records = queue.Queue(maxsize=10)
+    writer = LogWriter(records, [handler], batch_size=4)
+    log = logging.getLogger("testrunner.test_logger")
+    log.propagate = False
+    log.setLevel(logging.DEBUG)
+    log.addHandler(BlockingQueueHandler(records))
+
+    writer.start()
+    try:
+        for n in range(100):
+            log.debug("line %d %s", n, "x" * 20)
+    finally:
+        writer.stop()
+        log.handlers.clear()
+
+    assert path.stat().st_size < 1000
+    assert path.read_text().splitlines()[-1] == f"DEBUG line 99 {'x' * 20}"
+    rotated = gzip.open(str(tmp_path / "testrunner.log.1.gz"), "rt").read().splitlines()
+    assert rotated[0].startswith("DEBUG line")
+    assert not (tmp_path / "testrunner.log.3.gz").exists()
+
+
+def test_command_output(tmp_path, monkeypatch, caplog):
+    """Test the output of a command goes to a file of its own and the error output
+    of a failed command is logged
+    """
+    monkeypatch.setattr(logger_module, "_command_log", logger_module.CommandLog(str(tmp_path)))
+    utils = Utils(conf)
+
+    with caplog.at_level(logging.DEBUG, logger="testrunner"):
+        assert utils.runshellcommand("echo out; echo err >&2") == "out\n"
+        with pytest.raises(RuntimeError):
+            utils.runshellcommand("echo failed >&2; exit 3")
+
+    first, second = sorted(tmp_path.iterdir())
+    assert first.name.endswith("-echo.log")
+    assert sorted(first.read_text().splitlines()) == ["$ echo out; echo err >&2", "err", "out"]
+    assert "failed" in second.read_text()
+    assert not any(record.getMessage() in ("out", "err") for record in caplog.records)
+    assert f"Command exited with code 3, output in {second}\nfailed" in caplog.text
+
+
+def test_command_log_bounded(tmp_path, monkeypatch):
+    """Test the oldest outputs of a run are removed when the run exceeds the maximum
+    size, and only the directories of the last runs are kept
+    """
+    command_log = logger_module.CommandLog(str(tmp_path / "20200101-000000-1"), max_bytes=100)
+    for n in range(5):
+        output = command_log.output(f"echo {n}", "echo")
+        output.writeline("x" * 40)
+        output.close()
+    assert sorted(p.name for p in (tmp_path / "20200101-000000-1").iterdir()) == ["00004-echo.log", "00005-echo.log"]
+    assert command_log.size <= 100
+
+    monkeypatch.setattr(logger_module, "_pid_alive", lambda pid: pid == 3)
+    for run in ("20200101-000000-2", "20200101-000000-3", "20200102-000000-4", "20200103-000000-5"):
+        (tmp_path / run).mkdir()
+    assert logger_module.prune_command_dirs(str(tmp_path), 2) == ["20200101-000000-1", "20200101-000000-2"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["20200101-000000-3", "20200102-000000-4",
+                                                         "20200103-000000-5"]
@@ -0,0 +1,27 @@
+import os
+
+from utils.logstate import LogState
+
+
+def test_log_state(tmp_path):
+    """Test the cursors and the index of the segments are kept across collections
+    """
+    state = LogState(str(tmp_path))
+    assert state.get_cursor("kubelet") is None
+
+    for n, label in enumerate(["test_a.py::test_one", "test_a.py::test_two"]):
+        segment = state.next_segment("kubelet")
+        assert segment == os.path.join(str(tmp_path), f"kubelet.{n:04d}.log")
+        state.add_segment("kubelet", segment, label)
+        state.set_cursor("kubelet", f"s={n}")
+    state.add_segment("crio", state.next_segment("crio"), "test_a.py::test_two")
+    state.save()
+
+    state = LogState(str(tmp_path))
+    assert state.get_cursor("kubelet") == "s=1"
+    assert state.get_cursor("crio") is None
+    assert state.next_segment("kubelet").endswith("kubelet.0002.log")
+    assert [(s["file"], s["label"]) for s in state.index] == [
+        ("kubelet.0000.log", "test_a.py::test_one"),
+        ("kubelet.0001.log", "test_a.py::test_two"),
+        ("crio.0000.log", "test_a.py::test_two")]
@@ -0,0 +1,122 @@
+import random
+
+from utils import polling
+from utils.polling import (PollingPolicy, poll)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_policy_backoff():
+    """Test delays grow exponentially up to the maximum backoff
+    """
+    policy = PollingPolicy(initial=1, factor=2, max_backoff=10, jitter=0)
+    delays = policy.delays()
+    assert [next(delays) for _ in range(6)] == [1, 2, 4, 8, 10, 10]
+
+
+def test_policy_jitter():
+    """Test jitter stays within bounds and never exceeds the maximum backoff
+    """
+    policy = PollingPolicy(initial=4, factor=2, max_backoff=8, jitter=0.5, rand=random.Random(0))
+    delays = policy.delays()
+    first = next(delays)
+    assert 2 <= first <= 6
+    for _ in range(10):
+        assert next(delays) <= 8
+
+
+def test_poll_succeeds_early():
+    """Test a condition satisfied shortly after the first attempt is detected
+    by a fast retry instead of waiting for the full backoff
+    """
+    clock = FakeClock()
+    policy = PollingPolicy(initial=1, factor=2, max_backoff=20, jitter=0)
+
+    def attempt():
+        return clock.now >= 1, "ready"
+
+    done, value = poll(attempt, timeout=60, policy=policy, fixed_backoff=20,
+                       clock=clock.clock, sleep=clock.sleep)
+    assert done
+    assert value == "ready"
+    assert clock.sleeps == [1]
+    record = polling.stats()[-1]
+    assert record.attempts == 2
+    assert record.saved() == 19
+
+
+def test_poll_final_attempt_at_deadline():
+    """Test the last delay is shortened so an attempt is made at the deadline
+    """
+    clock = FakeClock()
+    policy = PollingPolicy(initial=4, factor=2, max_backoff=20, jitter=0)
+    attempts = []
+
+    def attempt():
+        attempts.append(clock.now)
+        return False, None
+
+    done, _ = poll(attempt, timeout=10, policy=policy, clock=clock.clock, sleep=clock.sleep)
+    assert not done
+    assert attempts == [0, 4, 10]
+
+
+def test_poll_retries_and_delay():
+    """Test the initial delay is honored and the number of attempts is limited
+    """
+    clock = FakeClock()
+    policy = PollingPolicy(initial=1, factor=1, max_backoff=1, jitter=0)
+    attempts = []
+
+    def attempt():
+        attempts.append(clock.now)
+        return False, None
+
+    done, _ = poll(attempt, retries=3, delay=30, policy=policy, clock=clock.clock, sleep=clock.sleep)
+    assert not done
+    assert attempts == [30, 31, 32]
+
+
+def test_poll_fixed_backoff():
+    """Test a policy without growth nor jitter retries every initial seconds
+    """
+    clock = FakeClock()
+    policy = PollingPolicy(initial=30, factor=1, jitter=0, max_backoff=30)
+    attempts = []
+
+    def attempt():
+        attempts.append(clock.now)
+        return len(attempts) == 3, None
+
+    done, _ = poll(attempt, retries=5, policy=policy, clock=clock.clock, sleep=clock.sleep)
+    assert done
+    assert clock.sleeps == [30, 30]
+
+
+def test_stats_bounded(monkeypatch):
+    """Test only the most recent records are kept, while the report covers all
+    the polling loops
+    """
+    monkeypatch.setattr(polling, "_stats", polling.collections.deque(maxlen=3))
+    polling.reset_stats()
+    clock = FakeClock()
+    for _ in range(5):
+        poll(lambda: (True, None), name="ready", clock=clock.clock, sleep=clock.sleep)
+
+    assert len(polling.stats()) == 3
+    assert polling.report().splitlines()[1].split()[:3] == ["ready", "5", "5"]
+
+    polling.reset_stats()
+    assert polling.stats() == []
+    assert len(polling.report().splitlines()) == 1
@@ -0,0 +1,76 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils import step, tracing
+
+
+class FakeSkuba:
+    def __init__(self, conf):
+        self.conf = conf
+
+    @step
+    def join_nodes(self, masters=0, workers=2):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(tracing.propagate_context(self.node_join), range(workers)))
+
+    @step
+    def node_join(self, nr):
+        time.sleep(0.01)
+        if nr == 1:
+            raise Exception("join failed")
+
+
+@pytest.fixture(autouse=True)
+def tracer():
+    tracing.tracer().reset()
+    yield tracing.tracer()
+    tracing.tracer().reset()
+
+
+def test_span_tree(tracer):
+    """Test steps executed in other threads are nested in the step which started
+    them, with their arguments, thread and outcome
+    """
+    skuba = FakeSkuba(conf=None)
+    with pytest.raises(Exception):
+        with tracing.span("deploy"):
+            skuba.join_nodes(workers=2)
+
+    spans = {(s.name, s.args.get("nr")): s for s in tracer.spans}
+    join = spans[("FakeSkuba.join_nodes", None)]
+    assert join.args == {"workers": "2"}
+    assert join.path() == ["deploy", "FakeSkuba.join_nodes"]
+    assert join.outcome == "error: Exception"
+
+    ok, failed = spans[("FakeSkuba.node_join", "0")], spans[("FakeSkuba.node_join", "1")]
+    assert ok.parent is join and failed.parent is join
+    assert ok.thread != join.thread
+    assert ok.outcome == "ok"
+    assert failed.outcome == "error: Exception"
+    assert ok.duration >= 0.01
+    assert tracing.current_span() is None
+
+
+def test_write(tmp_path, tracer):
+    """Test the spans are written as Chrome trace events and folded stacks with
+    the time spent in each stack
+    """
+    with tracing.span("deploy"):
+        with tracing.span("init"):
+            time.sleep(0.02)
+
+    path = tracer.write(str(tmp_path), "run")
+    events = json.load(open(path))["traceEvents"]
+    complete = [e for e in events if e["ph"] == "X"]
+    assert [e["name"] for e in complete] == ["deploy", "init"]
+    assert complete[1]["dur"] >= 20000
+    assert complete[1]["ts"] >= complete[0]["ts"]
+    assert any(e["ph"] == "M" for e in events)
+
+    folded = dict(line.rsplit(" ", 1) for line in (tmp_path / "run.folded").read_text().splitlines())
+    assert set(folded) == {"deploy", "deploy;init"}
+    assert int(folded["deploy;init"]) >= 20
+    assert int(folded["deploy"]) < 20
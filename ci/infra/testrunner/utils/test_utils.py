@@ -0,0 +1,114 @@
+import gzip
+import io
+import os
+import subprocess
+import tarfile
+from types import SimpleNamespace
+
+import pytest
+
+from utils.logstate import LogState
+from utils.utils import Utils
+
+
+def run_script(script, env=None):
+    return subprocess.run(["sh", "-s"], input=script.encode(), stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, env=env)
+
+
+def test_log_bundle(tmp_path):
+    """Test the bundle has the existing files and dirs, and is extracted with
+    the compression detected from its content
+    """
+    logs_dir = tmp_path / "logs"
+    (logs_dir / "pods").mkdir(parents=True)
+    (logs_dir / "pods" / "0.log").write_text("pod log")
+    (logs_dir / "status.json").write_text("{}")
+    logs = {"files": [str(logs_dir / "status.json"), str(logs_dir / "missing.log")],
+            "dirs": [str(logs_dir / "pods")]}
+
+    result = run_script(Utils._log_bundle_script(logs, "gzip"))
+    assert result.returncode == 0, result.stderr
+    # a bundle named for zstd, compressed with gzip by a node without zstd
+    bundle = tmp_path / "logs.tar.zst"
+    bundle.write_bytes(result.stdout)
+
+    bundle_path = Utils._fix_log_bundle_suffix(str(bundle))
+    assert bundle_path == str(tmp_path / "logs.tar.gz")
+    assert not bundle.exists()
+
+    dest = tmp_path / "extracted"
+    dest.mkdir()
+    Utils(None).extract_log_bundle(bundle_path, str(dest))
+    assert (dest / str(logs_dir / "pods" / "0.log").lstrip("/")).read_text() == "pod log"
+    assert (dest / str(logs_dir / "status.json").lstrip("/")).exists()
+    assert (dest / "journal").is_dir()
+
+    (tmp_path / "unknown.tar.gz").write_bytes(b"not a tar")
+    with pytest.raises(ValueError):
+        Utils._fix_log_bundle_suffix(str(tmp_path / "unknown.tar.gz"))
+
+
+def test_log_bundle_tar_failure(tmp_path):
+    """Test a failure of tar fails the script, instead of producing a truncated bundle
+    """
+    fake_bin = tmp_path / "bin"
+    fake_bin.mkdir()
+    (fake_bin / "tar").write_text("#!/bin/sh\necho 'tar: /etc/shadow: Cannot open' >&2\nexit 2\n")
+    os.chmod(fake_bin / "tar", 0o755)
+    env = {**os.environ, "PATH": f"{fake_bin}:{os.environ['PATH']}"}
+
+    result = run_script(Utils._log_bundle_script({"files": ["/etc/hostname"]}, "gzip"), env=env)
+    assert result.returncode == 2
+    assert b"Cannot open" in result.stderr
+
+
+@pytest.mark.parametrize("name,linkname", [("../evil", None), ("/etc/evil", None),
+                                           ("var/log/link", "/etc"), ("var/log/link", "../../../etc")])
+def test_extract_log_bundle_unsafe_members(tmp_path, name, linkname):
+    """Test bundles with members extracted out of the destination dir are rejected
+    """
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w") as tar:
+        member = tarfile.TarInfo(name)
+        if linkname is not None:
+            member.type, member.linkname = tarfile.SYMTYPE, linkname
+        tar.addfile(member, io.BytesIO())
+    bundle = tmp_path / "logs.tar.gz"
+    bundle.write_bytes(gzip.compress(buf.getvalue()))
+
+    dest = tmp_path / "extracted"
+    dest.mkdir()
+    with pytest.raises(ValueError):
+        Utils(None).extract_log_bundle(str(bundle), str(dest))
+    assert os.listdir(dest) == []
+
+
+def test_journal_segment_resumes_from_cursor(tmp_path, monkeypatch):
+    """Test each collection gets the journal entries after the cursor of the previous
+    one, and no segment is stored when there are no new entries
+    """
+    outputs = ["entry 1\nentry 2\n-- cursor: s=2\n", "entry 3\n-- cursor: s=3\n", "-- No entries --\n"]
+    commands = []
+
+    def runshellcommand(cmd, **kwargs):
+        commands.append(cmd)
+        with open(cmd.rsplit("> ", 1)[1], "w") as f:
+            f.write(outputs[len(commands) - 1])
+
+    utils = Utils(SimpleNamespace(utils=SimpleNamespace(ssh_key="id_rsa", ssh_user="sles")))
+    monkeypatch.setattr(utils, "runshellcommand", runshellcommand)
+
+    for label in ("test_a", "test_b", "test_c"):
+        state = LogState(str(tmp_path))
+        utils._collect_journal_segment("10.0.0.1", "kubelet", state, label)
+        state.save()
+
+    assert "--after-cursor" not in commands[0]
+    assert '--after-cursor="s=2"' in commands[1]
+    assert '--after-cursor="s=3"' in commands[2]
+    state = LogState(str(tmp_path))
+    assert state.get_cursor("kubelet") == "s=3"
+    assert [(s["file"], s["label"]) for s in state.index] == [("kubelet.0000.log", "test_a"),
+                                                              ("kubelet.0001.log", "test_b")]
+    assert sorted(os.listdir(tmp_path)) == [".logstate.json", "index.json", "kubelet.0000.log", "kubelet.0001.log"]
@@ -0,0 +1,222 @@
+"""Tracing of the steps executed by the testrunner.
+
+Each step (see utils.step) is recorded as a span with its name, arguments, start
+time, duration, thread and outcome. The span being executed is kept in a context
+variable, so the spans form a tree even when steps run in several threads, as
+long as the threads run in the context of the step which started them (see
+propagate_context).
+
+The spans of a run are written as a Chrome trace (chrome://tracing, Perfetto)
+and as folded stacks, the input of flamegraph.pl, with the time spent in each
+stack of steps:
+
+    Skuba.cluster_deploy;Skuba.join_nodes;Skuba.node_join 312000
+"""
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger('testrunner')
+
+_current = contextvars.ContextVar("testrunner_span", default=None)
+
+MAX_ARG_LENGTH = 100
+
+
+class Span:
+    """Execution of a step.
+       name: name of the step
+       args: arguments of the step, as strings
+       start: time the step started (seconds since the epoch)
+       duration: seconds the step took, None while it is running
+       thread: name of the thread the step ran in
+       outcome: "ok", or "error: <exception type>" if the step raised an exception
+       category: kind of span (step, test)
+    """
+
+    def __init__(self, name, args=None, parent=None, clock=time.time, category="step"):
+        self.name = name
+        self.category = category
+        self.args = args or {}
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 1
+        self.start = clock()
+        self.duration = None
+        self.outcome = None
+        self.thread = threading.current_thread().name
+        self.tid = threading.get_ident()
+        self.children = []
+        self._started = time.perf_counter()
+        if parent is not None:
+            parent.children.append(self)
+
+    def finish(self, outcome="ok"):
+        """Ends the span. An outcome set while it was running is kept, unless it failed"""
+        self.duration = time.perf_counter() - self._started
+        if self.outcome is None or outcome != "ok":
+            self.outcome = outcome
+
+    def path(self):
+        """Returns the names of the spans from the root to this one"""
+        names = []
+        span = self
+        while span is not None:
+            names.append(span.name)
+            span = span.parent
+        return list(reversed(names))
+
+    def self_time(self):
+        """Returns the time not spent in the children executed in the same thread"""
+        nested = sum(c.duration or 0 for c in self.children if c.tid == self.tid)
+        return max((self.duration or 0) - nested, 0)
+
+
+class Tracer:
+    """Collects the spans of the process.
+       max_spans: maximum number of spans kept. Further spans are dropped
+    """
+
+    def __init__(self, max_spans=100000):
+        self.max_spans = max_spans
+        self.spans = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def record(self, span):
+        with self._lock:
+            if len(self.spans) >= self.max_spans:
+                self.dropped += 1
+                return
+            self.spans.append(span)
+
+    def snapshot(self):
+        """Returns the spans recorded so far"""
+        with self._lock:
+            return list(self.spans)
+
+    def reset(self):
+        with self._lock:
+            self.spans = []
+            self.dropped = 0
+
+    def chrome_trace(self):
+        """Returns the spans as Chrome trace events"""
+        pid = os.getpid()
+        spans = self.snapshot()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                  for tid, name in sorted({(s.tid, s.thread) for s in spans})]
+        for span in sorted(spans, key=lambda s: s.start):
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": int(span.start * 1e6),
+                "dur": int(span.duration * 1e6),
+                "pid": pid,
+                "tid": span.tid,
+                "args": {**span.args, "outcome": span.outcome},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def folded(self):
+        """Returns the time spent in each stack of spans (milliseconds), in the folded format"""
+        stacks = {}
+        spans = self.snapshot()
+        for span in spans:
+            stack = ";".join(name.replace(";", ":").replace(" ", "_") for name in span.path())
+            stacks[stack] = stacks.get(stack, 0) + span.self_time()
+        return "".join(f"{stack} {int(seconds * 1000)}\n" for stack, seconds in sorted(stacks.items()))
+
+    def write(self, directory, name):
+        """Writes the Chrome trace and the folded stacks of the spans to <name>.trace.json
+        and <name>.folded in the directory. Returns the path of the trace, or None if
+        there are no spans"""
+        if not self.spans:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        trace_path = os.path.join(directory, f"{name}.trace.json")
+        with open(trace_path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+        with open(os.path.join(directory, f"{name}.folded"), "w") as f:
+            f.write(self.folded())
+        if self.dropped:
+            logger.warning(f"Trace {trace_path} is incomplete: {self.dropped} steps were dropped")
+        return trace_path
+
+
+_tracer = Tracer()
+
+
+def tracer():
+    """Returns the tracer of the process"""
+    return _tracer
+
+
+def current_span():
+    """Returns the span being executed in the current context, if any"""
+    return _current.get()
+
+
+@contextmanager
+def span(name, args=None, category="step"):
+    """Records the execution of the block as a span, child of the current span.
+       args: dict with the arguments of the step
+    """
+    current = Span(name, args={k: _format_arg(v) for k, v in (args or {}).items()}, parent=_current.get(),
+                   category=category)
+    token = _current.set(current)
+    outcome = "ok"
+    try:
+        yield current
+    except BaseException as ex:
+        outcome = f"error: {type(ex).__name__}"
+        raise
+    finally:
+        current.finish(outcome)
+        _current.reset(token)
+        _tracer.record(current)
+
+
+def propagate_context(func):
+    """Returns a function which runs func in a copy of the current context, so the
+    spans (and deadlines) started by func in another thread are nested in the
+    current ones. Each call gets its own copy, so it can be used with executors"""
+    ctx = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return ctx.copy().run(func, *args, **kwargs)
+    return run
+
+
+def step_args(signature, args, kwargs):
+    """Returns the arguments of a call to a function with the signature, except
+    self and the configuration"""
+    try:
+        bound = signature.bind_partial(*args, **kwargs)
+    except TypeError:
+        return {}
+    return {name: value for name, value in bound.arguments.items() if name not in ("self", "conf")}
+
+
+def _format_arg(value):
+    text = value if isinstance(value, str) else repr(value)
+    return text if len(text) <= MAX_ARG_LENGTH else text[:MAX_ARG_LENGTH - 3] + "..."
+
+
+def write_run(directory, name):
+    """Writes the trace of the run to the directory, if any. Errors are only logged"""
+    if not directory:
+        return None
+    try:
+        path = _tracer.write(directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+    except OSError as ex:
+        logger.warning(f"Error writing the trace of the steps: {ex}")
+        return None
+    if path:
+        logger.info(f"Trace of the steps written to {path}")
+    return path
@@ -1,38 +1,74 @@
 import glob
+import inspect
 import logging
 import os
 import shutil
+import signal
 import subprocess
+import tarfile
 from functools import wraps
 from threading import Thread
 
 import requests
-from timeout_decorator import timeout
 
+from utils import accounting, tracing
 from utils.config import Constant
+from utils.deadline import (DeadlineExceeded, current as current_deadline, timeout)
 from utils.format import Format
+from utils.logger import command_output
+from utils.logstate import LogState
 
 logger = logging.getLogger('testrunner')
 
-_stepdepth = 0
+LOG_BUNDLE_SUFFIXES = {
+    "gzip": ".gz",
+    "zstd": ".zst"
+}
+
+LOG_BUNDLE_MAGIC = {
+    "gzip": b"\x1f\x8b",
+    "zstd": b"\x28\xb5\x2f\xfd"
+}
+
+JOURNAL_CURSOR_PREFIX = "-- cursor: "
+
+# lines of the error output of a failed command logged, when its output goes to a file
+COMMAND_ERROR_LINES = 20
 
 
 def step(f):
+    """Logs the execution of the function and records it as a span (see utils.tracing)"""
+    signature = inspect.signature(f)
+
     @wraps(f)
     def wrapped(*args, **kwargs):
-        global _stepdepth
-        _stepdepth += 1
-        logger.debug("{} entering {} {}".format(Format.DOT * _stepdepth, f.__name__,
-                                                f.__doc__ or ""))
-        r = f(*args, **kwargs)
-        logger.debug("{}  exiting {}".format(
-            Format.DOT_EXIT * _stepdepth, f.__name__))
-        _stepdepth -= 1
-        return r
+        with tracing.span(f.__qualname__, tracing.step_args(signature, args, kwargs)) as current:
+            logger.debug("{} entering {} {}".format(Format.DOT * current.depth, f.__name__,
+                                                    f.__doc__ or ""))
+            r = f(*args, **kwargs)
+            logger.debug("{}  exiting {}".format(
+                Format.DOT_EXIT * current.depth, f.__name__))
+            return r
 
     return wrapped
 
 
+def _safe_members(tar, bundle_path):
+    """Returns the members of the tar, which comes from a remote node. Raises ValueError
+    if any of them would be extracted out of the destination dir"""
+    members = tar.getmembers()
+    for member in members:
+        names = [member.name]
+        if member.issym():
+            names.append(os.path.join(os.path.dirname(member.name), member.linkname))
+        elif member.islnk():
+            names.append(member.linkname)
+        for name in names:
+            if os.path.isabs(name) or ".." in os.path.normpath(name).split(os.sep):
+                raise ValueError(f"Unsafe member {member.name} in log bundle {bundle_path}")
+    return members
+
+
 class Utils:
 
     def __init__(self, conf):
@@ -125,6 +161,157 @@ class Utils:
 
         return logging_errors
 
+    def collect_remote_logs_bundle(self, ip_address, logs, store_path, compression="gzip", extract=False):
+        """
+        Collect logs from a remote machine as a single compressed tar stream.
+        The journal of each service is exported and archived together with the
+        files and dirs on the node, and streamed over one ssh session.
+        :param ip_address: (str) IP of the machine to collect the logs from
+        :param logs: (dict: list) The different logs to collect {"files": [], "dirs": [], ""services": []}
+        :param store_path: (str) Path to store the bundle to
+        :param compression: (str) Compression used for the bundle: "zstd" or "gzip"
+        :param extract: (bool) Extract the bundle in store_path once downloaded
+        :return: (bool) True if there was an error while collecting the logs
+        """
+        if compression not in LOG_BUNDLE_SUFFIXES:
+            raise ValueError(f"Invalid log compression '{compression}'")
+
+        bundle_path = os.path.join(store_path, "logs.tar" + LOG_BUNDLE_SUFFIXES[compression])
+        script = self._log_bundle_script(logs, compression)
+        cmd = (f"ssh {Constant.SSH_OPTS} -i {self.conf.utils.ssh_key} {self.ssh_user()}@{ip_address}"
+               f" -- sudo sh -s > {bundle_path}")
+        try:
+            self.runshellcommand(cmd, stdin=script.encode())
+            # the node may lack zstd and fall back to gzip
+            bundle_path = self._fix_log_bundle_suffix(bundle_path)
+            if extract:
+                self.extract_log_bundle(bundle_path)
+        except Exception as ex:
+            logger.debug(f"Error while collecting log bundle from {ip_address}\n {ex}")
+            return True
+
+        return False
+
+    def collect_remote_logs_incremental(self, ip_address, logs, store_path, label):
+        """
+        Collect the logs from a remote machine produced since the previous collection.
+        New journal entries of each service are stored in a new segment and
+        indexed with the given label. Files and dirs are synced with rsync.
+        :param ip_address: (str) IP of the machine to collect the logs from
+        :param logs: (dict: list) The different logs to collect {"files": [], "dirs": [], ""services": []}
+        :param store_path: (str) Path to copy the logs to
+        :param label: (str) Test or step the collected logs belong to
+        :return: (bool) True if there was an error while collecting the logs
+        """
+        logging_errors = False
+        state = LogState(store_path)
+
+        for log in logs.get("files", []) + logs.get("dirs", []):
+            try:
+                self.rsync(ip_address, log, store_path)
+            except Exception as ex:
+                logger.debug(
+                    f"Error while collecting {log} from {ip_address}\n {ex}")
+                logging_errors = True
+
+        for service in logs.get("services", []):
+            try:
+                self._collect_journal_segment(ip_address, service, state, label)
+            except Exception as ex:
+                logger.debug(
+                    f"Error while collecting {service} journal from {ip_address}\n {ex}")
+                logging_errors = True
+
+        state.save()
+
+        return logging_errors
+
+    def _collect_journal_segment(self, ip_address, service, state, label):
+        """Store the journal entries of a service after the saved cursor in a new segment"""
+        cursor = state.get_cursor(service)
+        segment_path = state.next_segment(service)
+
+        journal_cmd = f"sudo journalctl -xu {service} --no-pager --show-cursor"
+        if cursor:
+            journal_cmd += f' --after-cursor="{cursor}"'
+        cmd = (f"ssh {Constant.SSH_OPTS} -i {self.conf.utils.ssh_key} {self.ssh_user()}@{ip_address}"
+               f" -- '{journal_cmd}' > {segment_path}")
+        self.runshellcommand(cmd)
+
+        new_cursor = None
+        with open(segment_path) as f:
+            for line in f:
+                if line.startswith(JOURNAL_CURSOR_PREFIX):
+                    new_cursor = line[len(JOURNAL_CURSOR_PREFIX):].strip()
+
+        # no entries since last collection
+        if new_cursor is None:
+            os.remove(segment_path)
+            return
+
+        state.set_cursor(service, new_cursor)
+        state.add_segment(service, segment_path, label)
+
+    @staticmethod
+    def _log_bundle_script(logs, compression):
+        """Build the remote script which writes the compressed log bundle to stdout"""
+        paths = [path.lstrip("/") for path in logs.get("files", []) + logs.get("dirs", [])]
+        if compression == "zstd":
+            compressor = "if command -v zstd >/dev/null; then zstd -q -c; else gzip -c; fi"
+        else:
+            compressor = "gzip -c"
+
+        lines = ['tmp=$(mktemp -d)',
+                 'trap \'rm -rf "$tmp"\' EXIT',
+                 'mkdir "$tmp/journal"']
+        for service in logs.get("services", []):
+            lines.append(f'journalctl -xeu {service} > "$tmp/journal/{service}.log" 2>&1')
+        lines.append('set --')
+        for path in paths:
+            lines.append(f'[ -e "/{path}" ] && set -- "$@" "{path}"')
+        # the status of tar is lost in the pipe. 1 only means some files changed while read
+        lines.append(f'{{ tar -cf - -C "$tmp" journal -C / "$@"; echo $? > "$tmp/tar.rc"; }} | {compressor}')
+        lines.append('rc=$(cat "$tmp/tar.rc")')
+        lines.append('[ "$rc" -le 1 ] || exit "$rc"')
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _fix_log_bundle_suffix(bundle_path):
+        """Rename the bundle if its content does not match the compression in its name"""
+        with open(bundle_path, "rb") as f:
+            magic = f.read(4)
+
+        for compression, signature in LOG_BUNDLE_MAGIC.items():
+            if magic.startswith(signature):
+                suffix = LOG_BUNDLE_SUFFIXES[compression]
+                break
+        else:
+            raise ValueError(f"Unknown format for log bundle {bundle_path}")
+
+        if bundle_path.endswith(suffix):
+            return bundle_path
+
+        fixed_path = bundle_path[:bundle_path.rindex(".tar")] + ".tar" + suffix
+        os.rename(bundle_path, fixed_path)
+        return fixed_path
+
+    def extract_log_bundle(self, bundle_path, dest=None):
+        """
+        Extract a log bundle collected with collect_remote_logs_bundle
+        :param bundle_path: (str) Path to the bundle
+        :param dest: (str) Path to extract to. Defaults to the bundle's directory
+        """
+        if dest is None:
+            dest = os.path.dirname(bundle_path)
+
+        if bundle_path.endswith(LOG_BUNDLE_SUFFIXES["zstd"]):
+            # GNU tar strips leading slashes and skips the members with ".." on extraction
+            self.runshellcommand(f"tar --zstd -xf {bundle_path} -C {dest}")
+        else:
+            with tarfile.open(bundle_path, "r:gz") as tar:
+                tar.extractall(dest, members=_safe_members(tar, bundle_path))
+
     def ssh_user(self):
         return self.conf.utils.ssh_user
 
@@ -136,11 +323,11 @@ class Utils:
             pubkey = f.read().strip()
         return pubkey
 
-    def ssh_run(self, ipaddr, cmd):
+    def ssh_run(self, ipaddr, cmd, stdin=None):
         key_fn = self.conf.utils.ssh_key
         cmd = "ssh " + Constant.SSH_OPTS + " -i {key_fn} {username}@{ip} -- '{cmd}'".format(
             key_fn=key_fn, ip=ipaddr, cmd=cmd, username=self.ssh_user())
-        return self.runshellcommand(cmd)
+        return self.runshellcommand(cmd, stdin=stdin)
 
     def scp_file(self, ip_address, remote_file_path, local_file_path):
         """
@@ -194,32 +381,124 @@ class Utils:
         else:
             logger.info("Executing command {}".format(cmd))
 
+        # commands running under a deadline are started in their own process group,
+        # so the command and all its children can be killed when the deadline expires
+        deadline = current_deadline()
+        if deadline is not None:
+            deadline.check()
+
+        binary = accounting.command_binary(cmd)
+        # the output goes to a file of its own, if the logger is configured for it
+        output = command_output(cmd, binary)
+        if output is not None:
+            logger.debug("Output of the command in {}".format(output.path))
+            log_stdout = log_stderr = output.writeline
+        else:
+            log_stdout, log_stderr = logger.debug, logger.error
+
         stdout, stderr = [], []
-        p = subprocess.Popen(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd,
-            stdin=subprocess.PIPE if stdin else None, shell=True, env=cmd_env
-        )
-        if stdin:
-            p.stdin.write(stdin)
-            p.stdin.close()
-        stdoutStreamer = Thread(target=self.read_fd, args=(p, p.stdout, logger.debug, stdout))
-        stderrStreamer = Thread(target=self.read_fd, args=(p, p.stderr, logger.error, stderr))
-        stdoutStreamer.start()
-        stderrStreamer.start()
-        stdoutStreamer.join()
-        stderrStreamer.join()
-        # this is redundant, at this point threads were joined and they waited for the subprocess
-        # to exit, however it should not hurt to explicitly wait for it again (no-op).
-        p.wait()
+        with accounting.measure(f"{accounting.SUBPROCESS}:{binary}"):
+            p = subprocess.Popen(
+                cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd,
+                stdin=subprocess.PIPE if stdin else None, shell=True, env=cmd_env,
+                start_new_session=deadline is not None
+            )
+            stdoutStreamer = Thread(target=self.read_fd, args=(p, p.stdout, log_stdout, stdout))
+            stderrStreamer = Thread(target=self.read_fd, args=(p, p.stderr, log_stderr, stderr))
+            stdoutStreamer.start()
+            stderrStreamer.start()
+            if stdin:
+                p.stdin.write(stdin)
+                p.stdin.close()
+            killed = deadline is not None and self._wait_or_kill(p, deadline)
+            stdoutStreamer.join()
+            stderrStreamer.join()
+            # this is redundant, at this point threads were joined and they waited for the subprocess
+            # to exit, however it should not hurt to explicitly wait for it again (no-op).
+            p.wait()
         stdout, stderr = "".join(stdout), "".join(stderr)
+        if output is not None:
+            output.close()
+
+        if killed:
+            raise DeadlineExceeded("Command {} killed after deadline expired".format(cmd))
 
         if p.returncode != 0:
+            if output is not None:
+                tail = stderr.splitlines()[-COMMAND_ERROR_LINES:]
+                logger.error("Command exited with code {}, output in {}\n{}".format(
+                    p.returncode, output.path, "\n".join(tail)))
             if not ignore_errors:
                 raise RuntimeError("Error executing command {}".format(cmd))
             else:
                 return stderr
         return stdout
 
+    def stream_shellcommand(self, cmd, env={}):
+        """Running shell command, yielding its output line by line
+        The command is killed when the caller stops iterating or the current
+        deadline, if any, expires.
+        Keyword arguments:
+        cmd -- command to run
+        env -- environment variables
+        """
+        cmd_env = {
+            "SSH_AUTH_SOCK": self.conf.utils.ssh_sock,
+            "PATH": os.environ['PATH'],
+            **env
+        }
+
+        deadline = current_deadline()
+        if deadline is not None:
+            deadline.check()
+
+        logger.debug("Streaming command {}".format(cmd))
+
+        stderr = []
+        p = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, env=cmd_env,
+            start_new_session=True
+        )
+        stderrStreamer = Thread(target=self.read_fd, args=(p, p.stderr, logger.error, stderr))
+        stderrStreamer.start()
+        if deadline is not None:
+            Thread(target=self._wait_or_kill, args=(p, deadline), daemon=True).start()
+
+        try:
+            for line in iter(p.stdout.readline, b""):
+                yield line.decode()
+        finally:
+            if p.poll() is None:
+                try:
+                    os.killpg(p.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            p.wait()
+            stderrStreamer.join()
+
+        if deadline is not None and deadline.expired():
+            raise DeadlineExceeded("Command {} killed after deadline expired".format(cmd))
+
+        if p.returncode != 0:
+            raise RuntimeError("Error executing command {}".format(cmd))
+
+    @staticmethod
+    def _wait_or_kill(proc, deadline):
+        """Wait for proc to finish, killing its process group if the deadline expires
+        or is cancelled. Returns True if the process was killed"""
+        while True:
+            try:
+                proc.wait(timeout=0.1)
+                return False
+            except subprocess.TimeoutExpired:
+                if deadline.expired():
+                    try:
+                        os.killpg(proc.pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                    proc.wait()
+                    return True
+
     def read_fd(self, proc, fd, logger_func, output):
         """Read from fd, logging using logger_func
 
@@ -258,7 +537,8 @@ class Utils:
                 raise
         # clean up old ssh agent process(es)
         try:
-            self.runshellcommand("pkill -f 'ssh-agent -a {}'".format(sock_fn))
+            # anchored, so the agents of other stacks, whose sockets share the prefix, are not killed
+            self.runshellcommand("pkill -f 'ssh-agent -a {}$'".format(sock_fn))
             logger.warning("Killed previous instance of ssh-agent")
         except Exception:
             pass